@@ -18,16 +18,21 @@
  *   * floots: an array of floot aggregates to show in the feed
  *   * actions: an aggregate containing functions that can be used to open a
  *     modal, post a new floot, etc
+ *   * hasMoreFloots: true if older floots can still be loaded (the feed is
+ *     loaded a page at a time)
  *
  * Returns the following structure:
  *   <div class="newsfeed">
  *       <NewFlootEntry />
  *       <FlootList />
+ *       {{#if hasMoreFloots}}
+ *           <button class="button load-more-button">Load more</button>
+ *       {{/if}}
  *   </div>
  *
  * You don't need to change anything here.
  */
-function NewsFeed(selectedUser, floots, actions) {
+function NewsFeed(selectedUser, floots, actions, hasMoreFloots) {
     let newsfeed = document.createElement("div");
     newsfeed.classList.add("newsfeed");
 
@@ -41,6 +46,16 @@ function NewsFeed(selectedUser, floots, actions) {
     // triggerDataRefresh will be called.
     newsfeed.appendChild(FlootList(floots, selectedUser, actions));
 
+    // Older floots are fetched a page at a time, when asked for.
+    if (hasMoreFloots) {
+        let loadMoreButton = document.createElement("button");
+        loadMoreButton.classList.add("button");
+        loadMoreButton.classList.add("load-more-button");
+        loadMoreButton.appendChild(document.createTextNode("Load more"));
+        loadMoreButton.addEventListener("click", actions.loadMoreFloots);
+        newsfeed.appendChild(loadMoreButton);
+    }
+
     return newsfeed;
 }
 
@@ -270,8 +285,10 @@ function LikeCommentCount(flootInfo, selectedUser, onLike) {
 
     // We haven't learned this in class, but you can do
     // Object.keys(someAggregate) to get an array of keys in that aggregate,
-    // and then we can take the array length.
-    let numComments = Object.keys(flootInfo.comments).length;
+    // and then we can take the array length. Floots in the feed only carry
+    // their first few comments, so prefer the server's comment_count.
+    let numComments = flootInfo.comment_count !== undefined ?
+        flootInfo.comment_count : Object.keys(flootInfo.comments).length;
     container.appendChild(CommentCount(numComments));
 
     return container;
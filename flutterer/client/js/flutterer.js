@@ -19,6 +19,9 @@ const USERS = [
     "Doris"
 ];
 
+// How many floots the feed loads at a time (see GET /api/floots?limit=)
+const FEED_PAGE_SIZE = 20;
+
 /**
  * Function: Flutterer
  * -------------------
@@ -37,34 +40,213 @@ function Flutterer() {
         openFlootInModal: openFlootInModal,
         closeModal: closeModal,
         createComment: createComment,
-        deleteComment: deleteComment
+        deleteComment: deleteComment,
+        loadMoreFloots: loadMoreFloots
     };
 
+    // Cursor for the next (older) page of floots, or null once the whole feed
+    // has been loaded
+    let nextCursor = null;
+    // True while a page of older floots is being fetched
+    let loadingMore = false;
+
+    // Sequence number of the last change we know about (see
+    // GET /api/floots/changes)
+    let latestSeq = null;
+    // Server-Sent Events connection to /api/stream, which pushes changes
+    // made by everyone as they happen
+    let stream = null;
+    // ID of the floot shown in the modal, or null if the modal is closed
+    let openFlootID = null;
+    // The floot shown in the modal, with all of its comments (floots in the
+    // feed only carry the first few), or null until it has been fetched
+    let openFloot = null;
+
     postFloots();
 
-    // Makes a request to load the floots
+    // Makes a request to load the first page of floots. The latest change
+    // number is fetched first, so that any change made while the page is
+    // loading is picked up by the next call to fetchChanges.
     function postFloots() {
-        let req = AsyncRequest("/api/floots");
-        req.setSuccessHandler(makeFlootsList);
+        let req = AsyncRequest("/api/floots/changes");
+        req.setSuccessHandler(function(response) {
+            latestSeq = JSON.parse(response.getPayload()).seq;
+            let listReq = AsyncRequest("/api/floots?limit=" + FEED_PAGE_SIZE);
+            listReq.setSuccessHandler(makeFlootsList);
+            listReq.send();
+        });
         req.send();
     }
 
 
     // Updates the floots list
     function makeFlootsList(response) {
-        let flootsList = JSON.parse(response.getPayload());
-        allFlootsList = flootsList;
+        let page = JSON.parse(response.getPayload());
+        allFlootsList = page.floots;
+        nextCursor = page.next_cursor;
+        renderPage(emptyPage);
+        listenForChanges();
+    }
+
+    // Fetches the next page of older floots and adds it to the bottom of the
+    // feed
+    function loadMoreFloots() {
+        if (nextCursor === null || loadingMore) {
+            return;
+        }
+        loadingMore = true;
+        let req = AsyncRequest("/api/floots?limit=" + FEED_PAGE_SIZE +
+                               "&before=" + encodeURIComponent(nextCursor));
+        req.setSuccessHandler(function(response) {
+            loadingMore = false;
+            let page = JSON.parse(response.getPayload());
+            for (let floot of page.floots) {
+                if (!allFlootsList.some(f => f.id === floot.id)) {
+                    allFlootsList.push(floot);
+                }
+            }
+            nextCursor = page.next_cursor;
+            renderPage(getOpenFloot());
+        });
+        req.setErrorHandler(function() {
+            loadingMore = false;
+        });
+        req.send();
+    }
+
+    // Opens the live change stream, if the browser supports it. Each change
+    // is applied as soon as it arrives, keeping an open modal open.
+    function listenForChanges() {
+        if (stream !== null || !window.EventSource) {
+            return;
+        }
+        stream = new EventSource("/api/stream?last_event_id=" + latestSeq);
+        let changeTypes = ["floot_saved", "floot_deleted", "comment_added",
+                           "comment_deleted", "liked", "unliked"];
+        for (let changeType of changeTypes) {
+            stream.addEventListener(changeType, function(event) {
+                applyChange(JSON.parse(event.data));
+                latestSeq = Number(event.lastEventId);
+                renderPage(getOpenFloot());
+            });
+        }
+        // The server no longer knows what we missed, so reload everything.
+        stream.addEventListener("reset", postFloots);
+    }
+
+    // Asks the server only for what changed since we last heard from it, and
+    // applies those changes to the floots list. Falls back to reloading the
+    // whole list if the server can't tell us.
+    function fetchChanges() {
+        if (stream !== null && stream.readyState === EventSource.OPEN) {
+            // The change will be pushed to us over the stream
+            return;
+        }
+        if (latestSeq === null) {
+            postFloots();
+            return;
+        }
+        let req = AsyncRequest("/api/floots/changes?since=" + latestSeq);
+        req.setSuccessHandler(applyChanges);
+        req.send();
+    }
+
+    // Applies a response from GET /api/floots/changes to allFlootsList
+    function applyChanges(response) {
+        let payload = JSON.parse(response.getPayload());
+        if (payload.reset) {
+            postFloots();
+            return;
+        }
+        for (let change of payload.changes) {
+            applyChange(change);
+        }
+        latestSeq = payload.seq;
         renderPage(emptyPage);
     }
 
+    // Returns the floot to show in the modal: the full copy if it has been
+    // fetched, the feed's copy otherwise, or emptyPage if none is open.
+    function getOpenFloot() {
+        if (openFloot !== null && openFloot.id === openFlootID) {
+            return openFloot;
+        }
+        let floot = allFlootsList.find(f => f.id === openFlootID);
+        return floot === undefined ? emptyPage : floot;
+    }
+
+    // Applies a single change to allFlootsList (and to the floot in the
+    // modal). Changes may be applied more than once, so each of them is
+    // written to be idempotent.
+    function applyChange(change) {
+        if (change.type === "floot_saved") {
+            // Saved floots come as they appear in the feed, with only their
+            // first few comments
+            let index = allFlootsList.findIndex(f => f.id === change.floot.id);
+            if (index !== -1) {
+                allFlootsList[index] = change.floot;
+            } else {
+                addToFeed(change.floot);
+            }
+            if (openFloot !== null && openFloot.id === change.floot.id) {
+                fetchOpenFloot(change.floot.id);
+            }
+        } else if (change.type === "floot_deleted") {
+            allFlootsList = allFlootsList.filter(f => f.id !== change.floot_id);
+        } else {
+            let floot = allFlootsList.find(f => f.id === change.floot_id);
+            if (floot !== undefined) {
+                applyFlootChange(floot, change);
+            }
+            if (openFloot !== null && openFloot.id === change.floot_id) {
+                applyFlootChange(openFloot, change);
+            }
+        }
+    }
+
+    // Adds a floot that isn't in the feed yet where it belongs, newest first.
+    // Floots older than every loaded one are left for loadMoreFloots.
+    function addToFeed(floot) {
+        let index = allFlootsList.findIndex(f => f.timestamp_us < floot.timestamp_us);
+        if (index !== -1) {
+            allFlootsList.splice(index, 0, floot);
+        } else if (nextCursor === null) {
+            allFlootsList.push(floot);
+        }
+    }
+
+    // Applies a comment or like change to a single floot
+    function applyFlootChange(floot, change) {
+        if (change.type === "comment_added") {
+            // Floots in the feed only list their first few comments, so a new
+            // comment is only added to a list that holds every comment.
+            if (floot.comments.length >= floot.comment_count &&
+                    !floot.comments.some(c => c.id === change.comment.id)) {
+                floot.comments.push(change.comment);
+            }
+            floot.comment_count = change.comment_count;
+        } else if (change.type === "comment_deleted") {
+            floot.comments = floot.comments.filter(c => c.id !== change.comment_id);
+            floot.comment_count = change.comment_count;
+        } else if (change.type === "liked") {
+            if (!floot.liked_by.includes(change.username)) {
+                floot.liked_by.push(change.username);
+            }
+        } else if (change.type === "unliked") {
+            floot.liked_by = floot.liked_by.filter(u => u !== change.username);
+        }
+    }
+
     // Draws / re-renders the page given the floot elements
     function renderPage(flootObject) {
+        openFlootID = flootObject === emptyPage ? null : flootObject.id;
         // Clears whatever is in the body
         while (document.body.lastChild != emptyPage) {
             document.body.removeChild(document.body.lastChild);
         }
         // Updates the MainComponent 
-        document.body.appendChild(MainComponent(selectedUser, flootObject, allFlootsList, actions));
+        document.body.appendChild(MainComponent(selectedUser, flootObject, allFlootsList, actions,
+                                                nextCursor !== null));
     }
 
     // Creates a new floot and makes an asynchronous request to post a new floot
@@ -75,7 +257,7 @@ function Flutterer() {
             username: selectedUser,
             message: message,
         }))
-        req.setSuccessHandler(postFloots);
+        req.setSuccessHandler(fetchChanges);
         req.send();
     }
 
@@ -87,14 +269,30 @@ function Flutterer() {
             username: selectedUser,
             message: comment,
         }));
-        req.setSuccessHandler(postFloots);
+        req.setSuccessHandler(fetchChanges);
         req.send();
     }
 
     // Opens a floot in a modal
-    // Renders the page with the selected floot
+    // Renders the page with the selected floot, then again once all of its
+    // comments have been fetched
     function openFlootInModal(flootObject) {
+        openFloot = null;
         renderPage(flootObject);
+        fetchOpenFloot(flootObject.id);
+    }
+
+    // Fetches the floot with all of its comments, and shows it in the modal
+    // if it is still open
+    function fetchOpenFloot(flootID) {
+        let req = AsyncRequest("/api/floots/" + flootID);
+        req.setSuccessHandler(function(response) {
+            if (openFlootID === flootID) {
+                openFloot = JSON.parse(response.getPayload());
+                renderPage(openFloot);
+            }
+        });
+        req.send();
     }
 
     // Updates the currentUser and then renders the page with
@@ -111,7 +309,7 @@ function Flutterer() {
         req.setPayload(JSON.stringify({
             username: selectedUser
         }))
-        req.setSuccessHandler(postFloots);
+        req.setSuccessHandler(fetchChanges);
         req.send();
     }
 
@@ -128,7 +326,7 @@ function Flutterer() {
         req.setPayload(JSON.stringify({
             username: selectedUser
         }));
-        req.setSuccessHandler(postFloots);
+        req.setSuccessHandler(fetchChanges);
         req.send();
     }
 }
@@ -147,6 +345,7 @@ function Flutterer() {
  *   * TODO: In Milestone 7: a parameter that contains the floot object that
  *     should be displayed in a modal, or null if no floot has been clicked and
  *     the modal should not be displayed
+ *   * hasMoreFloots: true if older floots can still be loaded into the feed
  *
  * Returns a node with the following structure:
  *   <div class="primary-container">
@@ -154,14 +353,14 @@ function Flutterer() {
  *       <NewsFeed />
  *   </div>
  */
-function MainComponent(selectedUser, selectedFloot, floots, actions) {
+function MainComponent(selectedUser, selectedFloot, floots, actions, hasMoreFloots) {
     // Creates container element for main component
     let mainComponent = document.createElement("div");
     mainComponent.classList.add("primary-container");
     // Create sidebar with selected user options
     let sideBar = Sidebar(USERS, selectedUser, actions);
     // Creates news feed with posted floots
-    let newsFeed = NewsFeed(selectedUser, floots, actions);
+    let newsFeed = NewsFeed(selectedUser, floots, actions, hasMoreFloots);
     // Append the sidebar and news feed to the container
     mainComponent.appendChild(sideBar);
     mainComponent.appendChild(newsFeed);
@@ -1,17 +1,59 @@
-import mimetypes
+import itertools
 import os
+from urllib.parse import unquote
 
+import metrics
+from cursor import (decode_comment_cursor, decode_cursor, encode_comment_cursor,
+                    encode_cursor)
 from database import Database
 from error import HTTPError
 from floot import Floot
 from floot_comment import FlootComment
-from response import Response
+from static_cache import StaticFileCache, StaticFileResponse
 
 SERVER_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
 CLIENT_SRC_DIR = os.path.abspath(os.path.join(SERVER_SRC_DIR, "..", "client"))
 
 db = Database()
 
+static_files = StaticFileCache()
+
+# Browsers may keep static files, but must check with the server (which
+# answers "304 Not Modified" if nothing changed) before using them again.
+STATIC_CACHE_CONTROL = "no-cache"
+
+# Page sizes for paginated routes (e.g. GET /api/floots?limit=20)
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def parse_limit(limit):
+    """
+    Converts the `limit` query parameter into a page size, or returns an
+    HTTPError with status 400 if it isn't a sensible number.
+    """
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except ValueError:
+        return HTTPError(400, f"limit must be a number, not {limit!r}")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return HTTPError(400, f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+def parse_cursor(cursor, decode=decode_cursor):
+    """
+    Decodes a cursor query parameter (e.g. `before`) into a (timestamp, id)
+    tuple (or whatever `decode` returns), or returns an HTTPError with status
+    400 if it isn't valid.
+    """
+    if cursor is None:
+        return None
+    try:
+        return decode(cursor)
+    except ValueError:
+        return HTTPError(400, "Invalid cursor")
+
 # GET /
 def serve_file(path):
     """
@@ -24,17 +66,20 @@ def serve_file(path):
         path = "/index.html"
     target_file_path = os.path.abspath(os.path.join(CLIENT_SRC_DIR, path[1:]))
     # Avoid serving files above client source directory for security
-    if not target_file_path.startswith(CLIENT_SRC_DIR + os.sep) \
-            or not os.path.isfile(target_file_path):
+    if not target_file_path.startswith(CLIENT_SRC_DIR + os.sep):
+        return HTTPError(404, "File not found")
+    static_file = static_files.get(target_file_path)
+    if static_file is None:
         return HTTPError(404, "File not found")
 
-    with open(target_file_path, "rb") as f:
-        # Return the file. Guess the content-type based on the file extension
-        # (e.g. a .html file is probably text/html).
-        return Response(f.read(), content_type=mimetypes.guess_type(target_file_path)[0])
+    return StaticFileResponse(static_file, headers={
+        "ETag": static_file.etag,
+        "Last-Modified": static_file.last_modified,
+        "Cache-Control": STATIC_CACHE_CONTROL,
+    })
 
 # GET /api/floots
-def get_floots():
+def get_floots(limit=None, before=None):
     """
     Returns a list of all floots from the database. Remember that these
     functions are used to send JSON to the client, so you should return a list
@@ -42,14 +87,114 @@ def get_floots():
     easily converted to JSON so that the client can understand them, but it's
     not straightforward to send an arbitrary object, like a Floot object, over
     the internet.) You may find the Floot to_dictionary() method helpful.
+
+    To keep the feed small, each floot only carries its first few comments,
+    plus a "comment_count" (see Floot.to_feed_dictionary); the rest can be
+    fetched from GET /api/floots/{floot_id}/comments.
+
+    If the client passes ?limit=N and/or ?before=CURSOR, only one page of
+    floots is returned instead, as a dictionary of this shape:
+    {
+        "floots": [ ...at most `limit` floots, newest first... ],
+        "next_cursor": "pass this as ?before= to get the next page",
+    }
+    next_cursor is null when there are no more floots.
     """
+    if limit is not None or before is not None:
+        return get_floots_page(limit, before)
+
     floots = db.get_floots()
     floot_dicts = []
     # Iterate through the floots from the databaase and append them to the dictionary
     for floot in floots:
-        floot_dicts.append(floot.to_dictionary())
+        floot_dicts.append(floot.to_feed_dictionary())
     return floot_dicts
 
+def get_floots_page(limit, before, username=None):
+    """
+    Returns one page of floots for GET /api/floots?limit=&before= (see
+    get_floots), or of the floots posted by username.
+    """
+    limit = parse_limit(limit)
+    before = parse_cursor(before)
+    for parsed in (limit, before):
+        if isinstance(parsed, HTTPError):
+            return parsed
+
+    # Ask for one extra floot to find out whether there is a next page.
+    floots = db.get_floots(limit + 1, before=before, username=username)
+    next_cursor = None
+    if len(floots) > limit:
+        floots = floots[:limit]
+        next_cursor = encode_cursor(*db.get_floot_key(floots[-1]))
+    return {
+        "floots": [floot.to_feed_dictionary() for floot in floots],
+        "next_cursor": next_cursor,
+    }
+
+# GET /api/users/{username}/floots
+def get_user_floots(username, limit=None, before=None):
+    """
+    Returns one page of the floots posted by the given user, newest first, in
+    the same shape as GET /api/floots?limit=&before= (see get_floots). A user
+    who hasn't posted anything simply has no floots.
+    """
+    return get_floots_page(limit, before, unquote(username))
+
+# GET /api/search
+def search_floots(q=None, limit=None, before=None):
+    """
+    Returns one page of the floots whose message or comments contain every
+    word of the query `q` (see Database.search_floots), newest first, in the
+    same shape as GET /api/floots?limit=&before= (see get_floots). Returns an
+    HTTPError with status 400 if `q` has no words in it.
+    """
+    if q is None or not q.strip():
+        return HTTPError(400, "Missing search query (?q=)")
+    limit = parse_limit(limit)
+    before = parse_cursor(before)
+    for parsed in (limit, before):
+        if isinstance(parsed, HTTPError):
+            return parsed
+
+    floots = db.search_floots(q, limit + 1, before=before)
+    next_cursor = None
+    if len(floots) > limit:
+        floots = floots[:limit]
+        next_cursor = encode_cursor(*db.get_floot_key(floots[-1]))
+    return {
+        "floots": [floot.to_feed_dictionary() for floot in floots],
+        "next_cursor": next_cursor,
+    }
+
+# GET /api/floots/changes
+def get_floot_changes(since=None):
+    """
+    Returns the changes made to the floots since the change numbered `since`
+    (see Database.get_changes_since), in this shape:
+    {
+        "seq": number of the latest change; pass it as ?since= next time,
+        "reset": true if the changes since `since` aren't available (or
+                 `since` wasn't given) and the client should reload
+                 /api/floots instead,
+        "changes": [ ...changes, oldest first... ],
+    }
+    """
+    # Read the latest seq before the changes, so that a change recorded in
+    # between is sent again next time rather than skipped.
+    latest_seq = db.get_latest_change_seq()
+    changes = None
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return HTTPError(400, f"since must be a number, not {since!r}")
+        changes = db.get_changes_since(since)
+    if changes is None:
+        return {"seq": latest_seq, "reset": True, "changes": []}
+    changes = [change for change in changes if change["seq"] <= latest_seq]
+    return {"seq": latest_seq, "reset": False, "changes": changes}
+
 # GET /api/floots/{floot_id}
 def get_floot(floot_id):
     """
@@ -62,6 +207,7 @@ def get_floot(floot_id):
     if db.has_floot(floot_id):
         floot = db.get_floot_by_id(floot_id)
         floot_dict = floot.to_dictionary()
+        floot_dict[Floot.COMMENT_COUNT] = floot.get_num_comments()
         return floot_dict
     else:
         return HTTPError(404, "invalid floot id")
@@ -129,21 +275,62 @@ def delete_floot(floot_id, request_body):
 
 
 # GET /api/floot/{floot_id}/comments
-def get_comments(floot_id):
+def get_comments(floot_id, limit=None, after=None, count_only=None):
     """
     Given a floot_id, returns a list of comments for that floot. (You should
     return a list of dictionaries, not a list of FlootComment objects.) If
     floot_id is invalid, return an HTTPError with status 404.
+
+    If the client passes ?limit=N and/or ?after=CURSOR, only one page of
+    comments is returned instead, as a dictionary of this shape:
+    {
+        "comments": [ ...at most `limit` comments, oldest first... ],
+        "comment_count": total number of comments on the floot,
+        "next_cursor": "pass this as ?after= to get the next page",
+    }
+    next_cursor is null when there are no more comments. With ?count_only=1,
+    only {"comment_count": N} is returned.
     """
+    if not db.has_floot(floot_id):
+        return HTTPError(404, "Invalid floot id")
+    floot = db.get_floot_by_id(floot_id)
+    if count_only in ("1", "true"):
+        return {"comment_count": floot.get_num_comments()}
+    if limit is not None or after is not None:
+        return get_comments_page(floot, limit, after)
+
     # Get the floot by the id and append to the comments list
     comments = []
-    if db.has_floot(floot_id):
-        floot = db.get_floot_by_id(floot_id)
-        for comment in floot.get_comments():
-            comments.append(comment.to_dictionary())
-        return comments
-    else:
-        return HTTPError(404, "Invalid floot id")
+    for comment in floot.iter_comments():
+        comments.append(comment.to_dictionary())
+    return comments
+
+def get_comments_page(floot, limit, after):
+    """
+    Returns one page of comments for GET /api/floots/{floot_id}/comments
+    ?limit=&after= (see get_comments).
+    """
+    limit = parse_limit(limit)
+    after = parse_cursor(after, decode_comment_cursor)
+    for parsed in (limit, after):
+        if isinstance(parsed, HTTPError):
+            return parsed
+
+    # `start` is the number of comments before the first one on this page.
+    offset, comment_id = after if after is not None else (0, None)
+    start = offset + 1 if floot.has_comment(comment_id) else offset
+    # Ask for one extra comment to find out whether there is a next page.
+    comments = list(itertools.islice(floot.iter_comments_after(comment_id, offset),
+                                     limit + 1))
+    next_cursor = None
+    if len(comments) > limit:
+        comments = comments[:limit]
+        next_cursor = encode_comment_cursor(start + limit - 1, comments[-1].get_id())
+    return {
+        "comments": [comment.to_dictionary() for comment in comments],
+        "comment_count": floot.get_num_comments(),
+        "next_cursor": next_cursor,
+    }
 
 # POST /api/floots/{floot_id}/comments
 def create_comment(floot_id, request_body):
@@ -166,8 +353,12 @@ def create_comment(floot_id, request_body):
     message = request_body["message"]
     username = request_body["username"]
     comment = FlootComment(message, username)
-    floot = db.get_floot_by_id(floot_id)
-    floot.create_comment(comment)
+    try:
+        floot = db.get_floot_by_id(floot_id)
+        db.add_comment(floot, comment)
+    except KeyError:
+        # Deleted by another server process in the meantime
+        return HTTPError(404, "No floot with floot id")
     comment_dict = comment.to_dictionary()
     return comment_dict
 
@@ -195,17 +386,23 @@ def delete_comment(floot_id, comment_id, request_body):
         return HTTPError(404, "No floot with given floot id")
     elif not "username" in request_body.keys():
         return HTTPError(400, "Username not provided")
-    floot = db.get_floot_by_id(floot_id)
-    comments = floot.get_comments()
+    try:
+        floot = db.get_floot_by_id(floot_id)
+    except KeyError:
+        # Deleted by another server process in the meantime
+        return HTTPError(404, "No floot with given floot id")
     username = request_body["username"]
-    for comment in comments:
-        if comment_id == comment.get_id():
-            # If the username is not the author, the user cannot delete it
-            if username != comment.get_author():
-                return HTTPError(401, "Comment cannot be deleted.")
-            floot.delete_comment(comment, username)
-            return "OK"
-    return HTTPError(404, "Comment cannot be deleted.")
+    if not floot.has_comment(comment_id):
+        return HTTPError(404, "Comment cannot be deleted.")
+    comment = floot.get_comment(comment_id)
+    # If the username is not the author, the user cannot delete it
+    if username != comment.get_author():
+        return HTTPError(401, "Comment cannot be deleted.")
+    try:
+        db.delete_comment(floot, comment, username)
+    except KeyError:
+        return HTTPError(404, "No floot with given floot id")
+    return "OK"
 
 # POST /api/floots/{floot_id}/like
 def like_floot(floot_id, request_body):
@@ -222,11 +419,10 @@ def like_floot(floot_id, request_body):
     requests from the same user liking the same floot have no effect (the like
     count should not increase). If floot_id is invalid, you should return an
     HTTPError with status 404, and if "username" is missing from request_body,
-    return an HTTPError with status 401.
+    return an HTTPError with status 401. Otherwise, returns the floot as a
+    dictionary.
     """
-    # TODO: if you're trying to do this extension, delete the following line,
-    # and replace it with your own implementation
-    return HTTPError(501, "api.like_floot not implemented yet")
+    return set_floot_liked(floot_id, request_body, True)
 
 # POST /api/floots/{floot_id}/unlike
 def unlike_floot(floot_id, request_body):
@@ -243,17 +439,46 @@ def unlike_floot(floot_id, request_body):
     If the specified user had not already liked this floot, this has no effect
     (but doesn't return an error either).  If floot_id is invalid, you should
     return an HTTPError with status 404, and if "username" is missing from
-    request_body, return an HTTPError with status 401.
+    request_body, return an HTTPError with status 401. Otherwise, returns the
+    floot as a dictionary.
+    """
+    return set_floot_liked(floot_id, request_body, False)
+
+def set_floot_liked(floot_id, request_body, liked):
+    """
+    Shared by like_floot and unlike_floot. Returns the updated floot as a
+    dictionary.
+    """
+    if not db.has_floot(floot_id):
+        return HTTPError(404, "No floot with given floot id")
+    if "username" not in request_body:
+        return HTTPError(401, "No username given")
+    try:
+        floot = db.get_floot_by_id(floot_id)
+        db.set_liked(floot, request_body["username"], liked)
+    except KeyError:
+        return HTTPError(404, "No floot with given floot id")
+    return floot.to_feed_dictionary()
+
+# GET /api/metrics
+def get_metrics():
+    """
+    Returns statistics about the server's caches and optimizations (see
+    metrics.py).
+
+    You don't need to understand or modify this function.
     """
-    # TODO: if you're trying to do this extension, delete the following line,
-    # and replace it with your own implementation
-    return HTTPError(501, "api.unlike_floot not implemented yet")
+    return metrics.get_metrics()
 
 # This specifies which functions should be called given a particular incoming
 # path. You don't need to understand or change this, unless you're doing an
 # extension that requires adding new API routes.
 GET_ROUTES = [
     ("/api/floots", get_floots),
+    ("/api/floots/changes", get_floot_changes),
+    ("/api/metrics", get_metrics),
+    ("/api/search", search_floots),
+    (("/api/users/(.*)/floots", "username"), get_user_floots),
     (("/api/floots/(.*?)/comments", "floot_id"), get_comments),
     (("/api/floots/(.*)", "floot_id"), get_floot),
     (("(/.*)", "path"), serve_file),
@@ -0,0 +1,261 @@
+#! /usr/bin/env python3
+
+"""
+This contains an alternative front end for the Flutterer server, built on
+asyncio instead of http.server. It serves the same routes (api.GET_ROUTES and
+api.POST_ROUTES), but handles every connection on a single thread, keeps
+connections open between requests (HTTP/1.1 keep-alive, including pipelined
+requests), and needs nothing outside the standard library. Run it instead of
+serve.py:
+
+    python3 async_serve.py [--port PORT]
+
+STUDENTS: You don't need to read anything in this file.
+"""
+
+import argparse
+import asyncio
+import http.client
+import io
+import time
+import traceback
+from email.utils import formatdate
+from http import HTTPStatus
+
+import api
+import compression
+from colorama import init
+from event_stream import AsyncEventStreamHub
+from serve import (DEFAULT_BACKLOG, INTERNAL_SERVER_ERROR_MESSAGE, SERVER_PORT,
+                   STREAM_PATH, flutterer_print, get_last_event_id, print_gray,
+                   print_green, print_red, service_request)
+
+# Requests whose line and headers don't fit in this many bytes are refused.
+MAX_HEADER_BYTES = 64 * 1024
+
+# Requests with a bigger body than this are refused.
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+# Connections that stay idle between requests (or stall in the middle of
+# one) for this long are closed.
+KEEP_ALIVE_TIMEOUT = 30  # second(s)
+
+_date_header = (None, None)
+
+def get_date_header():
+    """
+    Returns the value of the Date header, which only changes once a second.
+    """
+    global _date_header
+    now = int(time.time())
+    if _date_header[0] != now:
+        _date_header = (now, formatdate(now, usegmt=True))
+    return _date_header[1]
+
+def wants_keep_alive(version, headers):
+    """
+    Returns whether the client expects the connection to stay open after this
+    request: HTTP/1.1 keeps it open unless asked not to, HTTP/1.0 only if asked.
+    """
+    connection = (headers["Connection"] or "").lower()
+    if version == "HTTP/1.1":
+        return connection != "close"
+    return connection == "keep-alive"
+
+def format_response_head(status, content_type, content_length, keep_alive, headers=None):
+    reason = HTTPStatus(status).phrase
+    head = (f"HTTP/1.1 {status} {reason}\r\n"
+            f"Date: {get_date_header()}\r\n"
+            f"Content-Type: {content_type}\r\n")
+    if headers:
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    # 304 responses never have a body, and their Content-Length would have to
+    # be the one of the full response.
+    if content_length is not None and status != 304:
+        head += f"Content-Length: {content_length}\r\n"
+    head += f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    return head.encode("latin-1")
+
+class AsyncFluttererServer:
+    """
+    Serves the Flutterer API from the asyncio event loop it is started on.
+    Handlers run directly on the loop, one request at a time, so they never
+    see each other's half-applied changes.
+    """
+    def __init__(self, database, quiet=False):
+        self._db = database
+        self._quiet = quiet
+        self._server = None
+        self.stream_hub = None
+
+    async def start(self, host="0.0.0.0", port=SERVER_PORT, backlog=DEFAULT_BACKLOG):
+        """
+        Starts listening for connections.
+        """
+        self.stream_hub = AsyncEventStreamHub(self._db)
+        self._server = await asyncio.start_server(
+            self._handle_connection, host, port, backlog=backlog, limit=MAX_HEADER_BYTES)
+
+    def get_port(self):
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        self.stream_hub.close()
+        await self._server.wait_closed()
+
+    def _log(self, print_function, msg):
+        if not self._quiet:
+            print_function(msg)
+
+    def _send(self, writer, status, content_type, body, keep_alive, http_error=None,
+              headers=None):
+        writer.write(format_response_head(status, content_type, len(body), keep_alive, headers)
+                     + body)
+        msg = f"  -> {status} {HTTPStatus(status).phrase}"
+        if http_error:
+            msg += f": {http_error.message}"
+        self._log(print_green if status in (200, 304) else print_red, msg)
+
+    def _send_error(self, writer, status):
+        self._send(writer, status, "text/plain", HTTPStatus(status).phrase.encode("utf-8"), False)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while await self._handle_request(reader, writer):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader, writer):
+        """
+        Reads one request from the connection and answers it. Returns whether
+        the connection should be kept open for another request.
+        """
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+        except asyncio.LimitOverrunError:
+            self._send_error(writer, 431)
+            return False
+        except asyncio.IncompleteReadError:
+            return False  # The client hung up between requests
+
+        request_line, _, header_bytes = head.partition(b"\r\n")
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            self._send_error(writer, 400)
+            return False
+        headers = http.client.parse_headers(io.BytesIO(header_bytes))
+        keep_alive = wants_keep_alive(version, headers)
+        self._log(print_gray, f"{method} {target}")
+
+        if headers["Transfer-Encoding"]:
+            self._send_error(writer, 411)
+            return False
+        try:
+            length = int(headers["Content-Length"] or 0)
+        except ValueError:
+            self._send_error(writer, 400)
+            return False
+        if length < 0:
+            self._send_error(writer, 400)
+            return False
+        if length > MAX_BODY_BYTES:
+            self._send_error(writer, 413)
+            return False
+        body = None
+        if length:
+            body = await asyncio.wait_for(reader.readexactly(length), KEEP_ALIVE_TIMEOUT)
+
+        path, _, query_string = target.partition("?")
+        if method == "GET" and path == STREAM_PATH:
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: text/event-stream\r\n"
+                         b"Cache-Control: no-cache\r\n"
+                         b"Connection: close\r\n\r\n")
+            self._log(print_green, "  -> 200 OK")
+            await self.stream_hub.serve(reader, writer, get_last_event_id(headers, query_string))
+            return False
+
+        try:
+            # Waiting for durability on this thread would hold up every other
+            # connection, so it's done here instead.
+            status, response, http_error = service_request(method, target, headers, body,
+                                                           wait_until_durable=False)
+            if method == "POST":
+                await asyncio.wrap_future(api.db.durable())
+        except Exception:
+            traceback.print_exc()
+            self._send(writer, 500, "text/plain",
+                       INTERNAL_SERVER_ERROR_MESSAGE.encode("utf-8"), False)
+            return False
+        if response.is_streamed():
+            return await self._send_streamed(writer, status, response, version, keep_alive)
+        self._send(writer, status, response.get_content_type(), response.get_body_bytes(),
+                   keep_alive, http_error, response.get_headers())
+        # Only waits if the client isn't reading its responses.
+        await writer.drain()
+        return keep_alive
+
+    async def _send_streamed(self, writer, status, response, version, keep_alive):
+        """
+        Sends a response whose body is produced in chunks, using chunked
+        transfer encoding (or, for HTTP/1.0 clients, by closing the connection
+        at the end). Returns whether the connection can be kept open.
+        """
+        chunked = version == "HTTP/1.1"
+        keep_alive = keep_alive and chunked
+        headers = dict(response.get_headers())
+        if chunked:
+            headers["Transfer-Encoding"] = "chunked"
+        writer.write(format_response_head(status, response.get_content_type(), None,
+                                          keep_alive, headers))
+        self._log(print_green if status == 200 else print_red,
+                  f"  -> {status} {HTTPStatus(status).phrase}")
+        try:
+            for chunk in response.iter_body_bytes():
+                if chunk:
+                    writer.write(b"%x\r\n%b\r\n" % (len(chunk), chunk) if chunked else chunk)
+                    await writer.drain()
+        except Exception:
+            # The status line is gone already, so just drop the connection.
+            traceback.print_exc()
+            return False
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return keep_alive
+
+def get_args():
+    """
+    Parses the command line arguments, applying defaults for options that
+    weren't specified.
+    """
+    parser = argparse.ArgumentParser(description="Runs the Flutterer server on asyncio.")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--backlog", type=int, default=DEFAULT_BACKLOG,
+                        help="number of pending connections the OS may queue "
+                        f"(default: {DEFAULT_BACKLOG})")
+    parser.add_argument("--gzip-level", type=int, default=compression.DEFAULT_LEVEL,
+                        help="gzip level for API responses, from 1 (fastest) to 9 "
+                        f"(smallest) (default: {compression.DEFAULT_LEVEL})")
+    parser.add_argument("--quiet", action="store_true",
+                        help="don't print a line for every request")
+    return parser.parse_args()
+
+async def main(args):
+    compression.set_level(args.gzip_level)
+    server = AsyncFluttererServer(api.db, quiet=args.quiet)
+    await server.start(port=args.port, backlog=args.backlog)
+    flutterer_print(f"Listening for requests at http://localhost:{args.port}")
+    await server.serve_forever()
+
+if __name__ == "__main__":
+    init()  # initialize terminal color support
+    asyncio.run(main(get_args()))
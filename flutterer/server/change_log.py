@@ -0,0 +1,82 @@
+"""
+This file exports ChangeLog, an in-memory record of the most recent mutations
+made to the Database. Every change gets a sequence number, so a client that
+remembers the last number it saw can ask for only the changes made since.
+
+STUDENTS: You don't need to read anything in this file.
+"""
+
+import time
+
+# How many changes are kept around. Clients that fall further behind than this
+# have to re-download the whole feed.
+MAX_RETAINED_CHANGES = 10000
+
+# Change types
+FLOOT_SAVED = "floot_saved"
+FLOOT_DELETED = "floot_deleted"
+COMMENT_ADDED = "comment_added"
+COMMENT_DELETED = "comment_deleted"
+LIKED = "liked"
+UNLIKED = "unliked"
+
+class ChangeLog:
+    def __init__(self, capacity=MAX_RETAINED_CHANGES, first_seq=None):
+        # Sequence numbers start at the current time in microseconds rather
+        # than at 0, so that they keep increasing across server restarts and
+        # a client holding a number from before a restart is told to reload
+        # instead of silently missing changes.
+        if first_seq is None:
+            first_seq = int(time.time() * 1000000)
+        self._capacity = capacity
+        self._changes = []
+        self._first_seq = first_seq
+        self._latest_seq = first_seq - 1
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """
+        Registers a function that is called with every change (a dictionary)
+        right after it is recorded.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """
+        Opposite of add_listener.
+        """
+        self._listeners.remove(listener)
+
+    def record(self, change_type, **fields):
+        """
+        Records a change of the given type, described by fields, and returns
+        the change as a dictionary (including its "seq" and "type").
+        """
+        self._latest_seq += 1
+        change = {"seq": self._latest_seq, "type": change_type}
+        change.update(fields)
+        self._changes.append(change)
+        # Trim in big batches so that recording stays O(1) amortized.
+        if len(self._changes) >= 2 * self._capacity:
+            dropped = len(self._changes) - self._capacity
+            del self._changes[:dropped]
+            self._first_seq += dropped
+        for listener in self._listeners:
+            listener(change)
+        return change
+
+    def get_latest_seq(self):
+        """
+        Returns the sequence number of the newest change.
+        """
+        return self._latest_seq
+
+    def get_changes_since(self, seq):
+        """
+        Returns the list of changes with a sequence number greater than seq,
+        oldest first. Returns None if those changes are no longer available
+        (seq is too old, or is from the future, e.g. from before a restart).
+        """
+        if seq < self._first_seq - 1 or seq > self._latest_seq:
+            return None
+        return self._changes[seq - self._first_seq + 1:]
@@ -0,0 +1,146 @@
+"""
+This file compresses responses with gzip for clients that say they accept it
+(with the Accept-Encoding request header). JSON feeds shrink to a fraction of
+their size this way. Dynamic responses are compressed as they are sent;
+static files are compressed once and cached (see static_cache.py).
+
+STUDENTS: You don't need to read anything in this file.
+"""
+
+import gzip
+import time
+import zlib
+
+import metrics
+from response import Response
+
+# Responses smaller than this are sent as they are: compressing them saves
+# less than it costs.
+MIN_COMPRESSED_SIZE = 1024  # byte(s)
+
+# Compression level for dynamic responses: 1 is fastest, 9 is smallest.
+DEFAULT_LEVEL = 6
+
+# Makes zlib write a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Content types worth compressing (images are already compressed)
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript",
+                      "image/svg+xml", "image/vnd.microsoft.icon")
+
+_level = DEFAULT_LEVEL
+
+# Counts every gzip-encoded response sent, and the time spent compressing
+# (including compressing each static file once).
+_stats = metrics.Counters("responses", "bytes_in", "bytes_out", "cpu_seconds")
+
+def _get_metrics():
+    values = _stats.to_dictionary()
+    values["ratio"] = values["bytes_out"] / values["bytes_in"] if values["bytes_in"] else None
+    values["level"] = _level
+    return values
+
+metrics.register("compression", _get_metrics)
+
+def set_level(level):
+    """
+    Sets the compression level used for dynamic responses (1-9).
+    """
+    global _level
+    if not 1 <= level <= 9:
+        raise ValueError(f"Compression level must be between 1 and 9, not {level}")
+    _level = level
+
+def accepts_gzip(accept_encoding):
+    """
+    Returns whether an Accept-Encoding header value (e.g. "gzip, deflate, br"
+    or "gzip;q=0, *") allows a gzip-encoded response.
+    """
+    if not accept_encoding:
+        return False
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+def compress(body, level=None):
+    """
+    Returns body compressed with gzip, and counts the time that took.
+    """
+    start = time.thread_time()
+    compressed = gzip.compress(body, compresslevel=level or _level, mtime=0)
+    _stats.add(cpu_seconds=time.thread_time() - start)
+    return compressed
+
+def compress_chunks(chunks):
+    """
+    Compresses an iterator of chunks of bytes into a single gzip stream,
+    yielding compressed chunks as they become available.
+    """
+    compressor = zlib.compressobj(_level, zlib.DEFLATED, GZIP_WBITS)
+    bytes_in = bytes_out = 0
+    cpu_seconds = 0.0
+    for chunk in chunks:
+        start = time.thread_time()
+        compressed = compressor.compress(chunk)
+        cpu_seconds += time.thread_time() - start
+        bytes_in += len(chunk)
+        bytes_out += len(compressed)
+        if compressed:
+            yield compressed
+    compressed = compressor.flush()
+    bytes_out += len(compressed)
+    _stats.add(responses=1, bytes_in=bytes_in, bytes_out=bytes_out, cpu_seconds=cpu_seconds)
+    yield compressed
+
+def encode_response(request_headers, response):
+    """
+    Returns response gzip-encoded if the client accepts that and it is worth
+    it, and otherwise returns response unchanged.
+    """
+    headers = response.get_headers()
+    content_type = response.get_content_type()
+    if "Content-Encoding" in headers or content_type is None \
+            or not content_type.startswith(COMPRESSIBLE_TYPES):
+        return response
+    if response.is_streamed():
+        # Streamed bodies are big, so they are always worth compressing.
+        body = response.body
+    else:
+        body = response.get_body_bytes()
+        if len(body) < MIN_COMPRESSED_SIZE:
+            return response
+
+    # Caches must keep the compressed and uncompressed versions apart.
+    headers = dict(headers, Vary="Accept-Encoding")
+    if not accepts_gzip(request_headers["Accept-Encoding"]):
+        return Response(body, content_type=content_type, headers=headers)
+    headers["Content-Encoding"] = "gzip"
+    if response.is_streamed():
+        return Response(compress_chunks(response.iter_body_bytes()),
+                        content_type=content_type, headers=headers)
+
+    # Static files (see static_cache.StaticFileResponse) keep a compressed
+    # copy around.
+    static_file = getattr(response, "static_file", None)
+    if static_file is not None:
+        compressed = static_file.get_gzip_body()
+    else:
+        compressed = compress(body)
+    _stats.add(responses=1, bytes_in=len(body), bytes_out=len(compressed))
+    etag = headers.get("ETag")
+    if etag is not None:
+        # Each encoding of a resource needs its own ETag.
+        headers["ETag"] = etag[:-1] + '-gzip"'
+    return Response(compressed, content_type=content_type, headers=headers)
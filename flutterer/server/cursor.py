@@ -0,0 +1,67 @@
+"""
+This file exports helpers for the opaque cursors used to paginate API
+responses. A cursor names the last item of a page by its (timestamp, id) key,
+so the next page starts right after it even if newer items were added (or
+that item was deleted) in the meantime. Comment cursors name the last comment
+of a page by its id and by how many comments came before it, since comments
+have no timestamp.
+
+STUDENTS: You don't need to read anything in this file.
+"""
+
+import base64
+
+SEPARATOR = "|"
+
+def encode_cursor(timestamp, item_id):
+    """
+    Returns an opaque, URL-safe string naming the item with the given
+    timestamp (in microseconds since the epoch) and id.
+    """
+    return _encode(str(timestamp) + SEPARATOR + item_id)
+
+def decode_cursor(cursor):
+    """
+    Opposite of encode_cursor: returns a (timestamp, item_id) tuple. Raises a
+    ValueError if cursor was not produced by encode_cursor.
+    """
+    timestamp, item_id = _decode(cursor)
+    try:
+        return (int(timestamp), item_id)
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+
+def encode_comment_cursor(offset, comment_id):
+    """
+    Returns an opaque, URL-safe string naming the comment with the given id,
+    which is preceded by `offset` other comments.
+    """
+    return _encode(str(offset) + SEPARATOR + comment_id)
+
+def decode_comment_cursor(cursor):
+    """
+    Opposite of encode_comment_cursor: returns an (offset, comment_id) tuple.
+    Raises a ValueError if cursor was not produced by encode_comment_cursor.
+    """
+    offset, comment_id = _decode(cursor)
+    try:
+        offset = int(offset)
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+    if offset < 0:
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return (offset, comment_id)
+
+def _encode(raw):
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode(cursor):
+    # Returns the two halves of the cursor's text.
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+    if SEPARATOR not in raw:
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return raw.split(SEPARATOR, 1)
@@ -13,65 +13,235 @@ with an underscore) and read their associated method comments to understand how
 to use the Database class.
 """
 
-import json
 import os
-from floot import Floot
-from datetime import datetime
+import threading
+import change_log
+from change_log import ChangeLog
+from json_storage import JsonStorage
+from rwlock import ReadWriteLock
+from search_index import SearchIndex
+from sharded_storage import ShardedStorage, read_shard_count
+from sqlite_storage import SqliteStorage
 
 DATE_FORMAT = "%a %b %d %H:%M:%S %Y"
 
+# Storage engines the Database can sit on top of, along with the file each one
+# uses when no db_path is given. The engine can also be picked with the
+# FLUTTERER_DB_BACKEND environment variable.
+BACKENDS = {
+    "json": (JsonStorage, "data.json"),
+    "sqlite": (SqliteStorage, "data.db"),
+}
+DEFAULT_BACKEND = "json"
+
+# A JSON database can be split into several files (shards); the number of
+# shards can also be set with this environment variable.
+SHARDS_ENV = "FLUTTERER_DB_SHARDS"
+
 class Database:
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, backend=None, shared=False, shards=None,
+                 **storage_options):
         """
-        Constructs a new Database
+        Constructs a new Database. Pass shared=True if several processes will
+        use the same database file at once (see serve.py --workers); only some
+        backends support this. Pass durability="always", "batched" or "os" to
+        choose how soon changes are synced to the disk (see durability.py).
+        Pass shards=N to split a JSON database into N files that are written
+        (and loaded) in parallel (see sharded_storage.py); a database that is
+        already sharded is opened with its own number of shards by default.
         """
+        if not backend:
+            backend = os.environ.get("FLUTTERER_DB_BACKEND", DEFAULT_BACKEND)
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown database backend {backend!r} "
+                             f"(expected one of {', '.join(BACKENDS)})")
+        storage_class, default_file = BACKENDS[backend]
         if not db_path:
             db_path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                         "data.json")
+                                         default_file)
         self._db_path = db_path
-        self._data = {}
-        if os.path.exists(self._db_path):
-            self._load_data_from_file()
+        recorded_shards = read_shard_count(db_path) if storage_class is JsonStorage else None
+        if shards is None:
+            shards = int(os.environ.get(SHARDS_ENV) or recorded_shards or 1)
+        if recorded_shards is not None and shards != recorded_shards:
+            raise ValueError(f"{db_path} has {recorded_shards} shards, not {shards}")
+        if shared and not hasattr(storage_class, "create_shared_change_log"):
+            raise ValueError(f"The {backend!r} database backend can't be shared "
+                             "between processes")
+        if shards > 1 and storage_class is not JsonStorage:
+            raise ValueError(f"The {backend!r} database backend can't be sharded")
+        self._lock = ReadWriteLock()
+        if storage_class is JsonStorage:
+            # JSON snapshots are written in the background, and read the
+            # floots while holding this lock.
+            storage_options.setdefault("lock", self._lock)
+        if shards > 1:
+            self._storage = ShardedStorage(db_path, shards, **storage_options)
+        else:
+            self._storage = storage_class(db_path, **storage_options)
+        if shared:
+            self._changes = self._storage.create_shared_change_log()
+        else:
+            self._changes = ChangeLog()
+
+        # The search index is built by the first search, so that opening the
+        # database doesn't have to read every floot. From then on it is kept
+        # up to date by listening to changes, which also covers changes made
+        # by other processes sharing the file.
+        self._search = None
+        self._search_lock = threading.Lock()
+        # (floot_id, comment_id) of the comments deleted by this process and
+        # already taken out of the search index (see delete_comment), whose
+        # changes haven't reached _update_search_index yet
+        self._unindexed_comments = set()
+        self._changes.add_listener(self._update_search_index)
+
+    def _get_search_index(self):
+        # Must be called with the read (or write) lock held.
+        with self._search_lock:
+            if self._search is None:
+                search = SearchIndex()
+                search.index_floots(self._storage.iter_floots())
+                self._search = search
+            return self._search
+
+    def _update_search_index(self, change):
+        if change["type"] in (change_log.LIKED, change_log.UNLIKED):
+            return
+        floot_id = change["floot"]["id"] if "floot" in change else change["floot_id"]
+        # A change that arrives while the index is being built waits for it,
+        # and is then applied on top.
+        with self._lock.reading(), self._search_lock:
+            if self._search is None:
+                return
+            # A new comment only adds its own words. Deleted comments are
+            # taken out by delete_comment, since changes don't say what they
+            # were; only those deleted by other processes need the whole floot
+            # to be indexed again.
+            if change["type"] == change_log.COMMENT_ADDED:
+                if self._search.add_text(floot_id, change["comment"]["message"]):
+                    return
+            elif change["type"] == change_log.COMMENT_DELETED:
+                key = (floot_id, change["comment_id"])
+                if key in self._unindexed_comments:
+                    self._unindexed_comments.remove(key)
+                    return
+            try:
+                floot = self._storage.get_floot(floot_id)
+            except KeyError:
+                self._search.remove_floot(floot_id)
+                return
+            self._search.index_floot(floot)
+
+    def compact(self):
+        """
+        Tidies up the files backing the database (e.g. folds the JSON journal
+        into the snapshot). Takes the lock itself, so it must not be called
+        while holding it (see reading() and writing()).
+
+        Students: you don't need to call this method; the database compacts
+        itself automatically.
+        """
+        self._storage.compact()
+
+    def close(self):
+        """
+        Releases the files held open by the database, once the changes being
+        saved are written. The Database must not be used after this is
+        called, and it must not be called while holding the lock.
+        """
+        self._storage.close()
+
+    def durable(self):
+        """
+        Returns a Future (see concurrent.futures) that is done once every
+        change made to the database so far is safely on the disk. Every method
+        that changes the database also returns one, for that change:
+
+        database.save_floot(floot).result()  # Waits until floot is saved
 
-    def _load_data_from_file(self):
+        How long that takes depends on the durability mode the database was
+        opened with. You don't have to wait: the change is made (and seen by
+        every reader) either way, but could be lost if the computer crashes
+        before the Future is done.
         """
-        Students: Don't call this method.
+        with self._lock.reading():
+            return self._storage.durable()
+
+    def reading(self):
         """
-        with open(self._db_path, "r") as f:
-            parsed_file = json.load(f)
+        Returns a context manager that keeps other threads from changing the
+        database while you read from it:
 
-        for floot_id, floot_dict in parsed_file.items():
-            self._data[floot_id] = Floot.from_dictionary(floot_dict)
+        with database.reading():
+            ...
 
-    def _write_data_to_file(self):
+        Each Database method already does this by itself; use it to make
+        several calls (and reading the Floots they return) see one consistent
+        state.
         """
-        Students: don't call this method.
+        return self._lock.reading()
+
+    def writing(self):
         """
-        with open(self._db_path, "w") as f:
-            json.dump({floot_id: floot.to_dictionary()
-                       for floot_id, floot in self._data.items()}, f, indent=4)
+        Returns a context manager that gives you exclusive access to the
+        database while you change it (see reading()).
+        """
+        return self._lock.writing()
 
-    def get_floots(self, count=None):
+    def get_floots(self, count=None, before=None, username=None):
         """
         Returns a list of Floot objects, containing no more than `count`
         Floots. If count is unspecified, returns a list of all the Floots. If
         count is specified, the most recent `count` floots are returned.
         Floots in the returned list are sorted from newest to oldest.
+
+        If `before` is specified, it must be a (timestamp, floot_id) tuple (see
+        get_floot_key), and only floots older than that key are returned.
+
+        If `username` is specified, only the floots posted by that user are
+        returned. The database keeps each user's floots in order, so this
+        costs the same no matter how many floots other users posted.
         """
-        if count is None:
-            count = len(self._data)
+        with self._lock.reading():
+            return self._storage.get_floots(count, before, username)
 
-        floots = list(self._data.values())
-        floots = sorted(floots, key=lambda f: f.get_timestamp_raw(), reverse=True)
+    def search_floots(self, query, count=None, before=None):
+        """
+        Returns a list of the Floot objects whose message or comments contain
+        every word in query (ignoring case), newest first, containing no more
+        than `count` Floots. A word ending with "*" matches any word starting
+        with it: "flut*" finds "Flutterer". `before` works like it does for
+        get_floots.
+
+        The first search reads every floot to build the search index, so it
+        is much slower than the following ones.
+        """
+        with self._lock.reading():
+            floots = []
+            for floot_id in self._get_search_index().search(query, count, before):
+                try:
+                    floots.append(self._storage.get_floot(floot_id))
+                except KeyError:
+                    pass  # Deleted by another process, and not yet unindexed
+            return floots
 
-        return floots[:count]
+    def get_floot_key(self, floot):
+        """
+        Returns the (timestamp, floot_id) tuple the database orders the
+        provided floot by, with the timestamp in microseconds since the epoch
+        (see Floot.get_timestamp_us), which unlike local times never repeats. Pass it as `before` to get_floots to get the floots
+        that come after this one.
+        """
+        return (floot.get_timestamp_us(), floot.get_id())
 
     def has_floot(self, floot_id):
         """
         Takes a floot ID and returns True if that ID exists in the database,
         and False if it does not.
         """
-        return floot_id in self._data
+        with self._lock.reading():
+            return self._storage.has_floot(floot_id)
 
     def get_floot_by_id(self, floot_id):
         """
@@ -79,7 +249,8 @@ class Database:
         are unique. Raises a KeyError if no floot has the provided floot_id.
         """
         try:
-            return self._data[floot_id]
+            with self._lock.reading():
+                return self._storage.get_floot(floot_id)
         except KeyError:
             raise KeyError(f"No floot with id {floot_id} in database")
 
@@ -92,29 +263,125 @@ class Database:
         You will also need to call this method to re-save a floot if you add or
         remove comments from that Floot.
         """
-        self._data[floot.get_id()] = floot
-        self._write_data_to_file()
+        with self._lock.writing():
+            durable = self._storage.save_floot(floot)
+            # Listeners get the floot as it appears in the feed (see
+            # Floot.to_feed_dictionary), not with all of its comments.
+            self._changes.record(change_log.FLOOT_SAVED, floot=floot.to_feed_dictionary())
+            return durable
 
     def delete_floot_by_id(self, floot_id):
         """
         Attempts to delete the floot with provided id.  Raises a KeyError if
         provided id doesn't exist in the database.
         """
-        try:
-            del self._data[floot_id]
-            self._write_data_to_file()
-        except:
-            raise KeyError(f"No floot with id {floot_id} in database")
+        with self._lock.writing():
+            try:
+                durable = self._storage.delete_floot(floot_id)
+            except KeyError:
+                raise KeyError(f"No floot with id {floot_id} in database")
+            self._changes.record(change_log.FLOOT_DELETED, floot_id=floot_id)
+            return durable
 
     def delete_floot(self, floot):
         """
         Attempts to delete the provided floot (of type Floot). Raises a
         KeyError if provided Floot is not in the database.
         """
-        self.delete_floot_by_id(floot.get_id())
+        return self.delete_floot_by_id(floot.get_id())
+
+    def add_comment(self, floot, comment):
+        """
+        Adds the comment (of type FlootComment) to the provided floot (of type
+        Floot) and saves the change. This is cheaper than calling
+        floot.create_comment() followed by save_floot(), since only the new
+        comment needs to be written out. Raises a KeyError if the floot is no
+        longer in the database (e.g. another server process deleted it).
+        """
+        with self._lock.writing():
+            floot.create_comment(comment)
+            durable = self._change_stored_floot(self._storage.add_comment, floot, comment)
+            self._changes.record(change_log.COMMENT_ADDED, floot_id=floot.get_id(),
+                                 comment=comment.to_dictionary(),
+                                 comment_count=floot.get_num_comments())
+            return durable
+
+    def delete_comment(self, floot, comment, username):
+        """
+        Deletes the comment (of type FlootComment) from the provided floot and
+        saves the change. Raises the same errors as Floot.delete_comment(),
+        and the same KeyError as add_comment().
+        """
+        with self._lock.writing():
+            floot.delete_comment(comment, username)
+            durable = self._change_stored_floot(self._storage.delete_comment, floot, comment)
+            with self._search_lock:
+                if (self._search is not None
+                        and self._search.remove_text(floot.get_id(), comment.get_message())):
+                    self._unindexed_comments.add((floot.get_id(), comment.get_id()))
+            self._changes.record(change_log.COMMENT_DELETED, floot_id=floot.get_id(),
+                                 comment_id=comment.get_id(),
+                                 comment_count=floot.get_num_comments())
+            return durable
+
+    def set_liked(self, floot, username, liked):
+        """
+        Notes that the given user likes (or doesn't like) the provided floot,
+        and saves the change. Only the like itself is written out, not the
+        whole floot. Raises the same KeyError as add_comment().
+        """
+        with self._lock.writing():
+            if not floot.set_liked(username, liked):
+                return self._storage.durable()
+            durable = self._change_stored_floot(self._storage.set_liked, floot, username, liked)
+            self._changes.record(change_log.LIKED if liked else change_log.UNLIKED,
+                                 floot_id=floot.get_id(), username=username)
+            return durable
+
+    def _change_stored_floot(self, change, floot, *args):
+        # Calls a storage method that changes floot, which must still exist.
+        try:
+            return change(floot, *args)
+        except KeyError:
+            raise KeyError(f"No floot with id {floot.get_id()} in database")
+
+    def get_latest_change_seq(self):
+        """
+        Every change made to the database (saving or deleting a floot, adding
+        or removing a comment, liking or unliking) is given an increasing
+        sequence number. Returns the sequence number of the latest change.
+        """
+        with self._lock.reading():
+            return self._changes.get_latest_seq()
+
+    def add_change_listener(self, listener):
+        """
+        Registers a function that is called with each change (see
+        get_changes_since) as soon as it has been saved.
+        """
+        with self._lock.writing():
+            self._changes.add_listener(listener)
+
+    def remove_change_listener(self, listener):
+        """
+        Opposite of add_change_listener.
+        """
+        with self._lock.writing():
+            self._changes.remove_listener(listener)
+
+    def get_changes_since(self, seq):
+        """
+        Returns a list of the changes made after the change numbered seq,
+        oldest first. Each change is a dictionary with a "seq" and a "type"
+        (see change_log.py) plus the data that changed. Returns None if those
+        changes are no longer remembered, in which case you should reload
+        everything instead.
+        """
+        with self._lock.reading():
+            return self._changes.get_changes_since(seq)
 
     def __str__(self):
-        return "<FlootDatabase(" + str(self._data) + ")>"
+        return "<FlootDatabase(" + str(self._storage) + ")>"
 
     def __repr__(self):
         return str(self)
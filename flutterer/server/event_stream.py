@@ -0,0 +1,342 @@
+"""
+This file exports EventStreamHub, which pushes every Database change to the
+clients connected to GET /api/stream as Server-Sent Events:
+
+    id: <change seq>
+    event: <change type>
+    data: <the change, as JSON>
+
+All subscribers are served by a single background thread that waits on their
+(non-blocking) sockets with a selector, so thousands of idle connections cost
+one buffer each rather than one thread each. AsyncEventStreamHub does the same
+for the asyncio front end, using the event loop instead of a thread.
+
+STUDENTS: You don't need to read anything in this file.
+"""
+
+import asyncio
+import json
+import selectors
+import socket
+import threading
+import time
+
+# How often a comment line is sent to idle subscribers, so that proxies keep
+# the connection open and dead peers are noticed.
+HEARTBEAT_INTERVAL = 15  # second(s)
+
+# How long a browser should wait before reconnecting after losing the stream.
+RETRY_INTERVAL = 3000  # millisecond(s)
+
+# Subscribers that fall this far behind are disconnected; their browser will
+# reconnect and catch up from its Last-Event-ID.
+MAX_BUFFERED_BYTES = 1 << 20
+
+# Largest number of bytes handed to a single send() call
+WRITE_CHUNK_SIZE = 1 << 16
+
+HEARTBEAT = b": keepalive\n\n"
+
+def format_event(event_id, event_type, data):
+    """
+    Encodes a single Server-Sent Event.
+    """
+    return (f"id: {event_id}\nevent: {event_type}\n"
+            f"data: {json.dumps(data, separators=(',', ':'))}\n\n").encode("utf-8")
+
+def format_change(change):
+    """
+    Encodes a Database change (see change_log.py) as a Server-Sent Event.
+    """
+    return format_event(change["seq"], change["type"], change)
+
+class _Subscriber:
+    def __init__(self, sock):
+        self.sock = sock
+        # Seq of the last change queued for this subscriber
+        self.watermark = None
+        # Changes published while the subscriber's backlog is being read
+        self.held = []
+        self.buffer = bytearray()
+        self.registered_events = 0
+
+class EventStreamHub:
+    def __init__(self, database, heartbeat_interval=HEARTBEAT_INTERVAL):
+        self._db = database
+        self._heartbeat_interval = heartbeat_interval
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._pending = []
+        self._running = True
+
+        self._selector = selectors.DefaultSelector()
+        # Other threads write a byte to this socket pair to wake the selector
+        # up when there is something new to send.
+        self._wake_reader, self._wake_writer = socket.socketpair()
+        self._wake_reader.setblocking(False)
+        self._wake_writer.setblocking(False)
+        self._selector.register(self._wake_reader, selectors.EVENT_READ)
+
+        database.add_change_listener(self.publish)
+        self._thread = threading.Thread(target=self._run, name="event-stream", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, sock, last_event_id=None):
+        """
+        Starts streaming changes to sock, whose response headers must already
+        have been sent. If last_event_id (the seq of the last change the client
+        saw) is given, the changes after it are sent first; if they are no
+        longer available, a "reset" event tells the client to reload.
+        """
+        sock.setblocking(False)
+        subscriber = _Subscriber(sock)
+        with self._lock:
+            self._pending.append(subscriber)
+
+        # The backlog is read without holding our lock (the Database calls
+        # publish while holding its own), so changes published meanwhile are
+        # held back and merged in below.
+        latest_seq = self._db.get_latest_change_seq()
+        backlog = None
+        if last_event_id is not None:
+            backlog = self._db.get_changes_since(last_event_id)
+
+        with self._lock:
+            held, subscriber.held = subscriber.held, None
+            subscriber.buffer += f"retry: {RETRY_INTERVAL}\n\n".encode("utf-8")
+            if backlog is None:
+                event_type = "ready" if last_event_id is None else "reset"
+                subscriber.buffer += format_event(latest_seq, event_type, {"seq": latest_seq})
+                subscriber.watermark = latest_seq
+            else:
+                subscriber.watermark = last_event_id
+                for change in backlog:
+                    self._queue(subscriber, change, format_change(change))
+            for change in held:
+                self._queue(subscriber, change, format_change(change))
+        self._wake()
+
+    def publish(self, change):
+        """
+        Queues a change for every subscriber. Called by the Database.
+        """
+        event = format_change(change)
+        with self._lock:
+            for subscriber in self._pending:
+                self._queue(subscriber, change, event)
+            for subscriber in self._subscribers.values():
+                self._queue(subscriber, change, event)
+        self._wake()
+
+    def _queue(self, subscriber, change, event):
+        # Must be called with self._lock held.
+        if subscriber.held is not None:
+            subscriber.held.append(change)
+        elif change["seq"] > subscriber.watermark:
+            subscriber.buffer += event
+            subscriber.watermark = change["seq"]
+
+    def get_subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers) + len(self._pending)
+
+    def close(self):
+        """
+        Disconnects every subscriber and stops the background thread.
+        """
+        self._db.remove_change_listener(self.publish)
+        self._running = False
+        self._wake()
+        self._thread.join()
+        for subscriber in list(self._subscribers.values()) + self._pending:
+            subscriber.sock.close()
+        self._selector.close()
+        self._wake_reader.close()
+        self._wake_writer.close()
+
+    def _wake(self):
+        try:
+            self._wake_writer.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # A wake-up is already pending (or the hub is closed)
+
+    def _run(self):
+        next_heartbeat = time.monotonic() + self._heartbeat_interval
+        while self._running:
+            for key, events in self._selector.select(timeout=max(0, next_heartbeat - time.monotonic())):
+                if key.fileobj is self._wake_reader:
+                    self._drain_wake_socket()
+                    continue
+                subscriber = key.data
+                if events & selectors.EVENT_READ:
+                    self._read(subscriber)
+                if events & selectors.EVENT_WRITE and subscriber.sock.fileno() != -1:
+                    self._write(subscriber)
+
+            if time.monotonic() >= next_heartbeat:
+                next_heartbeat = time.monotonic() + self._heartbeat_interval
+                with self._lock:
+                    for subscriber in self._subscribers.values():
+                        if not subscriber.buffer:
+                            subscriber.buffer += HEARTBEAT
+            self._update_registrations()
+
+    def _drain_wake_socket(self):
+        try:
+            while self._wake_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _update_registrations(self):
+        """
+        Registers new subscribers, and asks the selector to report whether a
+        subscriber is writable only while it has something to send.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            for subscriber in pending:
+                self._subscribers[subscriber.sock] = subscriber
+            subscribers = list(self._subscribers.values())
+
+        for subscriber in subscribers:
+            if len(subscriber.buffer) > MAX_BUFFERED_BYTES:
+                self._disconnect(subscriber)
+                continue
+            events = selectors.EVENT_READ
+            if subscriber.buffer:
+                events |= selectors.EVENT_WRITE
+            if subscriber.registered_events == 0:
+                self._selector.register(subscriber.sock, events, subscriber)
+            elif subscriber.registered_events != events:
+                self._selector.modify(subscriber.sock, events, subscriber)
+            subscriber.registered_events = events
+
+    def _read(self, subscriber):
+        # Clients don't send anything after their request, so readability
+        # means the connection was closed (or reset).
+        try:
+            if subscriber.sock.recv(4096):
+                return
+        except BlockingIOError:
+            return
+        except OSError:
+            pass
+        self._disconnect(subscriber)
+
+    def _write(self, subscriber):
+        with self._lock:
+            data = bytes(subscriber.buffer[:WRITE_CHUNK_SIZE])
+        try:
+            sent = subscriber.sock.send(data)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._disconnect(subscriber)
+            return
+        with self._lock:
+            del subscriber.buffer[:sent]
+
+    def _disconnect(self, subscriber):
+        with self._lock:
+            self._subscribers.pop(subscriber.sock, None)
+        if subscriber.registered_events:
+            self._selector.unregister(subscriber.sock)
+        subscriber.sock.close()
+
+class AsyncEventStreamHub:
+    """
+    Same as EventStreamHub, but for the asyncio front end (async_serve.py):
+    subscribers are asyncio StreamWriters served by the event loop.
+    """
+    def __init__(self, database, heartbeat_interval=HEARTBEAT_INTERVAL):
+        # Must be created from a coroutine running on the server's loop.
+        self._db = database
+        self._heartbeat_interval = heartbeat_interval
+        self._loop = asyncio.get_running_loop()
+        # Maps each subscriber's writer to the seq of the last change queued
+        # for it.
+        self._subscribers = {}
+        database.add_change_listener(self._on_change)
+        self._heartbeat_task = self._loop.create_task(self._send_heartbeats())
+
+    def _on_change(self, change):
+        # Called by the Database, possibly from another thread.
+        self._loop.call_soon_threadsafe(self.publish, change)
+
+    async def serve(self, reader, writer, last_event_id=None):
+        """
+        Streams changes to writer (whose response headers must already have
+        been written) until the client disconnects. See
+        EventStreamHub.subscribe for the meaning of last_event_id.
+        """
+        latest_seq = self._db.get_latest_change_seq()
+        backlog = None
+        if last_event_id is not None:
+            backlog = self._db.get_changes_since(last_event_id)
+
+        writer.write(f"retry: {RETRY_INTERVAL}\n\n".encode("utf-8"))
+        if backlog is None:
+            event_type = "ready" if last_event_id is None else "reset"
+            writer.write(format_event(latest_seq, event_type, {"seq": latest_seq}))
+            watermark = latest_seq
+        else:
+            watermark = last_event_id
+            for change in backlog:
+                writer.write(format_change(change))
+                watermark = change["seq"]
+        # Changes already sent as part of the backlog are skipped by publish,
+        # which runs later on the loop.
+        self._subscribers[writer] = watermark
+        try:
+            # Clients don't send anything after their request, so wait for
+            # them to hang up.
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self._subscribers.pop(writer, None)
+            writer.close()
+
+    def publish(self, change):
+        """
+        Queues a change for every subscriber. Must run on the loop.
+        """
+        event = format_change(change)
+        for writer, watermark in list(self._subscribers.items()):
+            if self._is_behind(writer):
+                continue
+            if change["seq"] > watermark:
+                writer.write(event)
+                self._subscribers[writer] = change["seq"]
+
+    def get_subscriber_count(self):
+        return len(self._subscribers)
+
+    def _is_behind(self, writer):
+        """
+        Disconnects writer (and returns True) if it has stopped reading.
+        """
+        if writer.transport.get_write_buffer_size() <= MAX_BUFFERED_BYTES:
+            return False
+        self._subscribers.pop(writer, None)
+        writer.close()
+        return True
+
+    async def _send_heartbeats(self):
+        while True:
+            await asyncio.sleep(self._heartbeat_interval)
+            for writer in list(self._subscribers):
+                if not self._is_behind(writer) and writer.transport.get_write_buffer_size() == 0:
+                    writer.write(HEARTBEAT)
+
+    def close(self):
+        """
+        Disconnects every subscriber and stops sending heartbeats.
+        """
+        self._db.remove_change_listener(self._on_change)
+        self._heartbeat_task.cancel()
+        for writer in list(self._subscribers):
+            writer.close()
+        self._subscribers.clear()
@@ -5,11 +5,19 @@ read the method headers and their associated method comments to understand how
 to use the Floot class.
 """
 
+import itertools
 import uuid
 from datetime import datetime, timezone
-from floot_comment import FlootComment
+import timestamp_codec
+from floot_comment import FlootComment, intern_name
+from json_cache import floot_json
+from packed_ids import pack_id, unpack_id
 
 class Floot:
+    # Declaring the attributes up front saves memory for each Floot.
+    # __weakref__ lets the JSON cache (see json_cache.py) refer to Floots.
+    __slots__ = ("_message", "_username", "_liked_by", "_timestamp", "_timestamp_text",
+                 "_id", "_comments", "_comment_positions", "_deleted_comments", "__weakref__")
 
     DATE_FORMAT = "%a %b %d %H:%M:%S %Y"
 
@@ -17,11 +25,19 @@ class Floot:
     FLOOT_ID = "id"
     MESSAGE = "message"
     TIMESTAMP = "timestamp"
+    # TIMESTAMP only has a precision of one second, so the exact time is also
+    # sent, in microseconds since the Unix epoch (see timestamp_codec.py)
+    TIMESTAMP_US = "timestamp_us"
     FLOOT_USERNAME = "username"
     LIKED_BY = "liked_by"
     LIKED = "liked"
     LIKES = "likes"
     COMMENTS = "comments"
+    COMMENT_COUNT = "comment_count"
+
+    # How many comments each floot carries in the feed (see
+    # to_feed_dictionary); the rest are fetched page by page.
+    FEED_COMMENTS = 3
 
     def __init__(self, message, username, liked_by=None,
                  floot_id=None, timestamp=None, comments=None):
@@ -36,36 +52,61 @@ class Floot:
         code, but won't be useful to you.
         """
         self._message = message
-        self._username = username
-        self._liked_by = [] if liked_by is None else liked_by
+        # Usernames repeat a lot, so every Floot and like by the same user
+        # shares one string.
+        self._username = intern_name(username)
+        # Used as an ordered set: the keys are the users who like this Floot,
+        # in the order they liked it.
+        self._liked_by = dict.fromkeys(intern_name(user) for user in liked_by or ())
 
         # Optionally set timestamp, floot_id, and comments if specified.
         # This option would only be used when Floots are being
         # recreated on reload of database. Students should NOT
         # use the constructor to set timestamp, floot_id, or comments.
-        if not timestamp:
-            self._timestamp = datetime.now()
+        # The timestamp is kept in microseconds since the Unix epoch (see
+        # timestamp_codec.py), along with its string form once it is needed.
+        if isinstance(timestamp, int):
+            self._timestamp = timestamp
+        elif not timestamp:
+            self._timestamp = timestamp_codec.now()
+        elif isinstance(timestamp, datetime):
+            self._timestamp = timestamp_codec.from_datetime(timestamp)
         else:
             # Provided timestamp param is a string.
-            # Convert it to datetime object.
-            self._timestamp = datetime.strptime(timestamp, self.DATE_FORMAT)
+            self._timestamp = timestamp_codec.parse_timestamp(timestamp)
+        self._timestamp_text = None
 
+        # Ids are kept in compact form (see packed_ids.py).
         if not floot_id:
-            self._id = str(uuid.uuid4())
+            self._id = uuid.uuid4().bytes
         else:
-            self._id = floot_id
+            self._id = pack_id(floot_id)
 
-        if not comments:
-            self._comments = []
-        else:
-            self._comments = comments
+        # Comments are kept oldest to newest, with None left behind where a
+        # comment was deleted, along with the position of each comment by
+        # (packed) id.
+        # That way a comment can be found or deleted without a linear scan.
+        self._comments = []
+        self._comment_positions = {}
+        self._deleted_comments = 0
+        for comment in comments or []:
+            self._add_comment(comment)
 
     def get_timestamp(self):
         """Returns timestamp of when this Floot was created as a string."""
-        return self._timestamp.strftime(self.DATE_FORMAT)
+        if self._timestamp_text is None:
+            self._timestamp_text = timestamp_codec.format_timestamp(self._timestamp)
+        return self._timestamp_text
 
     def get_timestamp_raw(self):
-        """Returns the timestamp of this Floot as a datetime object"""
+        """Returns the timestamp of this Floot as a (naive, local) datetime object"""
+        return timestamp_codec.to_datetime(self._timestamp)
+
+    def get_timestamp_us(self):
+        """
+        Returns the timestamp of this Floot as a number of microseconds since
+        the Unix epoch (January 1st, 1970, UTC).
+        """
         return self._timestamp
 
     def get_comments(self):
@@ -74,11 +115,62 @@ class Floot:
         the returned list is of type FlootComment. The list is sorted from
         oldest to newest comment.
         """
-        return self._comments[:]
+        return [comment for comment in self._comments if comment is not None]
+
+    def iter_comments(self):
+        """
+        Same as get_comments(), but returns an iterator instead of building a
+        list. Don't add or delete comments while iterating.
+        """
+        return (comment for comment in self._comments if comment is not None)
+
+    def iter_comments_after(self, comment_id=None, offset=0):
+        """
+        Iterates over the comments that come after the comment with the given
+        id, oldest to newest (or over all comments if comment_id is None). If
+        that comment has since been deleted, the first `offset` comments are
+        skipped instead.
+
+        STUDENTS: You don't need to use this method.
+        """
+        if comment_id is None:
+            return self.iter_comments()
+        position = self._comment_positions.get(pack_id(comment_id))
+        if position is None:
+            return itertools.islice(self.iter_comments(), offset, None)
+        comments = self._comments
+        return (comments[i] for i in range(position + 1, len(comments))
+                if comments[i] is not None)
+
+    def get_comment(self, comment_id):
+        """
+        Returns the comment (of type FlootComment) with the provided id. Raises
+        a KeyError if this Floot has no such comment.
+        """
+        try:
+            return self._comments[self._comment_positions[pack_id(comment_id)]]
+        except KeyError:
+            raise KeyError(f"No comment with id {comment_id} found in Floot with id {self.get_id()}")
+
+    def has_comment(self, comment_id):
+        """
+        Returns True if this Floot has a comment with the provided id.
+        """
+        return pack_id(comment_id) in self._comment_positions
+
+    def get_num_comments(self):
+        """
+        Returns the number of comments on this Floot.
+        """
+        return len(self._comment_positions)
 
     def get_id(self):
         """Returns this Floot's unique id (string)."""
-        return self._id
+        return unpack_id(self._id)
+
+    def get_message(self):
+        """Returns the text contained in this Floot."""
+        return self._message
 
     def get_username(self):
         """Returns the username of this Floot's creator."""
@@ -92,35 +184,64 @@ class Floot:
         this comment (and therefore isn't allowed to delete it), a
         PermissionError is raised.
         """
-        if comment not in self._comments:
-            raise KeyError(f"No comment with id {comment.get_id()} found in Floot with id {self._id}")
+        if comment.get_packed_id() not in self._comment_positions:
+            raise KeyError(f"No comment with id {comment.get_id()} found in Floot with id {self.get_id()}")
 
         if comment.get_author() != username:
             raise PermissionError(f"Comment with id {comment.get_id()} has username {comment.get_author()} but {username} was provided")
 
-        self._comments.remove(comment)
+        position = self._comment_positions.pop(comment.get_packed_id())
+        self._comments[position] = None
+        self._deleted_comments += 1
+        # Squeeze out the gaps once they take up most of the list.
+        if self._deleted_comments > len(self._comment_positions):
+            self._comments = self.get_comments()
+            self._comment_positions = {c.get_packed_id(): i for i, c in enumerate(self._comments)}
+            self._deleted_comments = 0
+        floot_json.discard(self)
 
     def create_comment(self, comment):
         """
         Adds comment (of type FlootComment) to this Floot.
         """
+        self._add_comment(comment)
+        floot_json.discard(self)
+
+    def _add_comment(self, comment):
+        position = self._comment_positions.get(comment.get_packed_id())
+        if position is not None:
+            # Same id as an existing comment: replace it
+            self._comments[position] = comment
+            return
+        self._comment_positions[comment.get_packed_id()] = len(self._comments)
         self._comments.append(comment)
 
     def set_liked(self, user, liked):
         """
-        Notes that the given user likes (or doesn't like) this Floot.
+        Notes that the given user likes (or doesn't like) this Floot. Returns
+        True if that changed anything.
         """
         already_liked = user in self._liked_by
         if already_liked and not liked:
-            self._liked_by.remove(user)
+            del self._liked_by[user]
         elif not already_liked and liked:
-            self._liked_by.append(user)
+            self._liked_by[intern_name(user)] = None
+        else:
+            return False
+        floot_json.discard(self)
+        return True
+
+    def is_liked_by(self, user):
+        """
+        Returns True if the given user likes this Floot.
+        """
+        return user in self._liked_by
 
     def get_liked_by(self):
         """
         Returns a list of users who like this Floot.
         """
-        return self._liked_by[:]
+        return list(self._liked_by)
 
     def get_num_likes(self):
         """
@@ -135,14 +256,56 @@ class Floot:
         representing a Floot.
         """
         return {
-            self.FLOOT_ID:       self._id,
+            self.FLOOT_ID:       self.get_id(),
+            self.MESSAGE:        self._message,
+            self.TIMESTAMP:      self.get_timestamp(),
+            self.TIMESTAMP_US:   self._timestamp,
+            self.FLOOT_USERNAME: self._username,
+            self.LIKED_BY:       list(self._liked_by),
+            self.COMMENTS:       [comm.to_dictionary() for comm in self.iter_comments()]
+        }
+
+    def to_feed_dictionary(self):
+        """
+        Returns the dictionary sent for this Floot in the feed: the same as
+        to_dictionary(), except that only the first FEED_COMMENTS comments are
+        included, along with the total number of comments ("comment_count").
+        The dictionary is cached and shared (so it can't be modified) and
+        remembers its JSON encoding, so the server can send it almost for
+        free.
+
+        STUDENTS: You don't need to use this method; use to_dictionary().
+        """
+        return floot_json.get(self, self._build_feed_dictionary)
+
+    def _build_feed_dictionary(self):
+        comments = itertools.islice(self.iter_comments(), self.FEED_COMMENTS)
+        return {
+            self.FLOOT_ID:       self.get_id(),
             self.MESSAGE:        self._message,
             self.TIMESTAMP:      self.get_timestamp(),
+            self.TIMESTAMP_US:   self._timestamp,
             self.FLOOT_USERNAME: self._username,
-            self.LIKED_BY:       self._liked_by,
-            self.COMMENTS:       [comm.to_dictionary() for comm in self._comments]
+            self.LIKED_BY:       list(self._liked_by),
+            self.COMMENTS:       [comm.to_dictionary() for comm in comments],
+            self.COMMENT_COUNT:  self.get_num_comments(),
         }
 
+    @staticmethod
+    def get_dictionary_timestamp_us(floot_dict):
+        """
+        Returns the timestamp of the floot represented by floot_dict (see
+        to_dictionary) in microseconds since the epoch, without building the
+        Floot.
+
+        STUDENTS: You don't need to use this method.
+        """
+        timestamp = floot_dict.get(Floot.TIMESTAMP_US)
+        if timestamp is None:
+            # Saved before TIMESTAMP_US existed
+            timestamp = timestamp_codec.parse_timestamp(floot_dict[Floot.TIMESTAMP])
+        return timestamp
+
     @staticmethod
     def from_dictionary(floot_dict):
         """
@@ -152,7 +315,10 @@ class Floot:
         """
         floot_id = floot_dict[Floot.FLOOT_ID]
         message = floot_dict[Floot.MESSAGE]
-        timestamp = floot_dict[Floot.TIMESTAMP]
+        # Older saved floots only have the (less precise) string timestamp.
+        timestamp = floot_dict.get(Floot.TIMESTAMP_US)
+        if timestamp is None:
+            timestamp = floot_dict[Floot.TIMESTAMP]
         username = floot_dict[Floot.FLOOT_USERNAME]
         liked_by = floot_dict[Floot.LIKED_BY]
 
@@ -6,9 +6,23 @@ method comments to understand how to use this class.
 """
 
 from datetime import datetime, timezone
+import sys
 import uuid
+from packed_ids import pack_id, unpack_id
+
+def intern_name(name):
+    """
+    Returns the one shared copy of the username name (see sys.intern), so
+    that repeated usernames cost a single string. Usernames that aren't
+    strings are returned as they are.
+    """
+    return sys.intern(name) if isinstance(name, str) else name
 
 class FlootComment:
+    # Declaring the attributes up front saves memory for each comment (there
+    # can be millions of them).
+    __slots__ = ("_message", "_author", "_id")
+
     # Dictionary constants
     COMMENT_ID = "id"
     COMMENT_TEXT = "message"
@@ -24,20 +38,35 @@ class FlootComment:
         Ignore the comment_id parameter; it will be created for you.
         """
         self._message = message
-        self._author = author
+        # Usernames repeat a lot, so every comment by the same user shares
+        # one string.
+        self._author = intern_name(author)
 
         # Optionally set comment id if specified.  This option would only be
         # used when FlootComments are being recreated on reload of database.
         # Students should NOT use these options to set comment_id.
         if not comment_id:
-            self._id = str(uuid.uuid4())
+            self._id = uuid.uuid4().bytes
         else:
-            self._id = comment_id
+            self._id = pack_id(comment_id)
 
     def get_id(self):
         """Returns the id of this comment (string)."""
+        return unpack_id(self._id)
+
+    def get_packed_id(self):
+        """
+        Returns the id of this comment in the compact form it is stored in
+        (see packed_ids.py).
+
+        STUDENTS: You don't need to use this method; use get_id().
+        """
         return self._id
 
+    def get_message(self):
+        """Returns the text of this comment."""
+        return self._message
+
     def get_author(self):
         """
         Returns the author of this comment (i.e. username of the person who
@@ -52,7 +81,7 @@ class FlootComment:
         representing a FlootComment.
         """
         return {
-            self.COMMENT_ID:     self._id,
+            self.COMMENT_ID:     self.get_id(),
             self.COMMENT_TEXT:   self._message,
             self.COMMENT_AUTHOR: self._author
         }
@@ -70,7 +99,7 @@ class FlootComment:
         return FlootComment(message, author, comment_id)
 
     def __str__(self):
-        return f"<FlootComment({self._message}, {self._author}, {self._id})>"
+        return f"<FlootComment({self._message}, {self._author}, {self.get_id()})>"
 
     def __repr__(self):
         return str(self)
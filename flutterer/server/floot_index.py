@@ -0,0 +1,74 @@
+"""
+This file exports FlootIndex, a sorted index of floot ids keyed by
+(timestamp, floot_id), the timestamp being in microseconds since the epoch
+(see Floot.get_timestamp_us). The storage engines use it so that "the newest k
+floots" costs O(k) instead of sorting every floot on each request.
+
+STUDENTS: You don't need to read anything in this file.
+"""
+
+import bisect
+from itertools import islice
+
+class FlootIndex:
+    def __init__(self):
+        # Keys are kept sorted oldest to newest, so the newest floots are at
+        # the end of the list and appending a brand new floot is cheap.
+        self._keys = []
+        self._key_by_id = {}
+
+    def add(self, timestamp, floot_id):
+        """
+        Adds (or moves) floot_id so that it is ordered by timestamp.
+        """
+        key = (timestamp, floot_id)
+        old_key = self._key_by_id.get(floot_id)
+        if old_key == key:
+            return
+        if old_key is not None:
+            self._remove_key(old_key)
+        self._key_by_id[floot_id] = key
+        if not self._keys or self._keys[-1] < key:
+            self._keys.append(key)
+        else:
+            bisect.insort(self._keys, key)
+
+    def remove(self, floot_id):
+        """
+        Removes floot_id from the index. Does nothing if it isn't there.
+        """
+        key = self._key_by_id.pop(floot_id, None)
+        if key is not None:
+            self._remove_key(key)
+
+    def _remove_key(self, key):
+        position = bisect.bisect_left(self._keys, key)
+        del self._keys[position]
+
+    def get_key(self, floot_id):
+        """
+        Returns the (timestamp, floot_id) key of floot_id, or None.
+        """
+        return self._key_by_id.get(floot_id)
+
+    def newest(self, count=None, before=None):
+        """
+        Returns an iterator over floot ids from newest to oldest, yielding at
+        most `count` ids. If `before` is a (timestamp, floot_id) key, only
+        floots strictly older than that key are included.
+        """
+        return (key[1] for key in self.newest_keys(count, before))
+
+    def newest_keys(self, count=None, before=None):
+        """
+        Same as newest(), but yields (timestamp, floot_id) keys.
+        """
+        end = len(self._keys) if before is None else bisect.bisect_left(self._keys, before)
+        keys = (self._keys[i] for i in range(end - 1, -1, -1))
+        return keys if count is None else islice(keys, count)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, floot_id):
+        return floot_id in self._key_by_id
@@ -0,0 +1,118 @@
+"""
+This file exports JsonCache, which remembers the JSON encoding of objects
+(mostly Floots) that rarely change, so that sending the feed costs little more
+than copying strings. Objects drop their entry whenever they change (see
+Floot.set_liked, for example), and the least recently used entries are
+dropped once the cache holds too much JSON.
+
+STUDENTS: You don't need to read anything in this file.
+"""
+
+import json
+import threading
+import weakref
+from collections import OrderedDict
+
+import metrics
+
+# Most JSON text the cache holds. The dictionaries it was encoded from are
+# kept too, so the cache uses a few times this much memory.
+MAX_CACHED_JSON_BYTES = 64 * 1024 * 1024
+
+ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+class EncodedDict(dict):
+    """
+    A read-only dictionary that carries its own compact JSON encoding, so that
+    it can be sent without being encoded again.
+    """
+    def __init__(self, fields, json_text):
+        dict.__init__(self, fields)
+        self.json = json_text
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("This dictionary is shared and can't be modified; "
+                        "use to_dictionary() to get your own copy")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+class JsonCache:
+    def __init__(self, max_bytes=MAX_CACHED_JSON_BYTES):
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        # Maps id(object) to (weak reference to object, EncodedDict), least
+        # recently used first. Entries go away with their object, so the
+        # cache never keeps anything alive.
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._hits = self._misses = self._evictions = self._uncached = 0
+
+    def get(self, obj, to_dictionary):
+        """
+        Returns obj's EncodedDict, building it from to_dictionary() if it
+        isn't cached.
+        """
+        key = id(obj)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+
+        fields = to_dictionary()
+        encoded = EncodedDict(fields, ENCODER.encode(fields))
+        with self._lock:
+            self._misses += 1
+            if key not in self._entries:
+                self._entries[key] = (weakref.ref(obj, lambda ref: self._forget(key, ref)), encoded)
+                self._bytes += len(encoded.json)
+                while self._bytes > self._max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self._bytes -= len(evicted.json)
+                    self._evictions += 1
+        return encoded
+
+    def encode(self, to_dictionary):
+        """
+        Returns the EncodedDict of to_dictionary() without caching it, for
+        objects that are only ever encoded once (e.g. Floots read from SQLite
+        for a single request), which would just fill the cache with misses.
+        """
+        fields = to_dictionary()
+        encoded = EncodedDict(fields, ENCODER.encode(fields))
+        with self._lock:
+            self._uncached += 1
+        return encoded
+
+    def discard(self, obj):
+        """
+        Forgets obj's JSON. Must be called whenever obj changes.
+        """
+        with self._lock:
+            entry = self._entries.pop(id(obj), None)
+            if entry is not None:
+                self._bytes -= len(entry[1].json)
+
+    def _forget(self, key, ref):
+        # Called when a cached object is garbage collected.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is ref:
+                del self._entries[key]
+                self._bytes -= len(entry[1].json)
+
+    def get_metrics(self):
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "uncached": self._uncached,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+floot_json = JsonCache()
+metrics.register("json_cache", floot_json.get_metrics)
@@ -0,0 +1,584 @@
+"""
+This file exports JsonStorage, the storage engine the Database uses by
+default. All floots are kept in memory; on disk they live in a JSON snapshot
+(data.json) plus an append-only journal of the mutations made since that
+snapshot was written (data.json.log).
+
+Snapshots are written in the background, to a temporary file that then
+replaces the snapshot, so a crash never leaves a half-written snapshot. Each
+one starts with a checksum, and the snapshot it replaced is kept (along with
+the journal leading from it to the new one) in case the new one turns out to
+be damaged anyway.
+
+In lazy mode (lazy=True, or FLUTTERER_LAZY_LOAD=1 in the environment), opening
+the database only indexes each floot's id, author and timestamp. A Floot
+object (with its comments) is only built when that floot is first read, and
+only the most recently used ones are kept, so a huge snapshot opens quickly
+and doesn't all have to fit in memory as objects.
+
+Journal records are handed to the operating system as soon as they are
+written; when they are synced to the disk depends on the durability mode (see
+durability.py). In "batched" mode a background thread syncs the journal once
+for all the records written within BATCH_WINDOW of each other.
+
+STUDENTS: You don't need to read anything in this file. Use the Database class
+instead.
+"""
+
+import json
+import os
+import threading
+import warnings
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from durability import (BATCH_WINDOW, DURABILITY_ALWAYS, DURABILITY_BATCHED, SyncBatcher,
+                        completed_future, get_durability)
+from floot import Floot
+from floot_comment import FlootComment
+from floot_index import FlootIndex
+from rwlock import ReadWriteLock
+
+# Every mutation is appended to a journal file next to the snapshot instead of
+# rewriting the whole snapshot. Once the journal holds this many records, it
+# is folded back into the snapshot.
+JOURNAL_SUFFIX = ".log"
+COMPACTION_THRESHOLD = 1000
+
+# While a snapshot is being written, the journal it replaces is set aside
+# under this name (data.json.log.1) and a new journal is started.
+ROTATED_JOURNAL_SUFFIX = ".log.1"
+
+# Snapshots are written to data.json.tmp, then renamed to data.json. The
+# snapshot they replace becomes data.json.prev, and the journal that leads
+# from it to the new one becomes data.json.prev.log.
+TEMP_SUFFIX = ".tmp"
+PREVIOUS_SUFFIX = ".prev"
+# A snapshot that fails its checksum is renamed to data.json.damaged.
+DAMAGED_SUFFIX = ".damaged"
+
+# Snapshots start with a header line holding this format number and the
+# length and CRC-32 of the JSON after it. Snapshots written before there was
+# a header are just JSON, and are still read.
+SNAPSHOT_FORMAT = 2
+
+# Snapshots written in the background read this many floots at a time while
+# holding the read lock, so that writers never wait for long.
+SNAPSHOT_CHUNK_SIZE = 1000
+
+# Journal record types
+OP_UPSERT_FLOOT = "upsert_floot"
+OP_DELETE_FLOOT = "delete_floot"
+OP_ADD_COMMENT = "add_comment"
+OP_DELETE_COMMENT = "delete_comment"
+OP_LIKE = "like"
+OP_UNLIKE = "unlike"
+
+LAZY_LOAD_ENV = "FLUTTERER_LAZY_LOAD"
+
+# In lazy mode, at most this many floots are kept as Floot objects; the least
+# recently used ones go back to being plain dictionaries.
+MAX_LOADED_FLOOTS = 100000
+
+def encode_snapshot(floot_dicts):
+    """
+    Returns the contents of a snapshot file holding floot_dicts.
+    """
+    payload = json.dumps(floot_dicts, separators=(",", ":")).encode()
+    header = {"format": SNAPSHOT_FORMAT, "length": len(payload), "crc32": zlib.crc32(payload)}
+    return json.dumps(header).encode() + b"\n" + payload
+
+def decode_snapshot(data):
+    """
+    Opposite of encode_snapshot. Raises a ValueError if the snapshot is
+    damaged.
+    """
+    first_line, _, payload = data.partition(b"\n")
+    try:
+        header = json.loads(first_line)
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("format") != SNAPSHOT_FORMAT:
+        return json.loads(data)  # Written before snapshots had a header
+    if len(payload) != header["length"] or zlib.crc32(payload) != header["crc32"]:
+        raise ValueError("Snapshot doesn't match its checksum")
+    return json.loads(payload)
+
+def read_snapshot(path):
+    """
+    Returns the floot dictionaries in the snapshot file at path. Raises a
+    ValueError if the snapshot is damaged.
+    """
+    with open(path, "rb") as f:
+        return decode_snapshot(f.read())
+
+def read_journal(path):
+    """
+    Returns the records in the journal at path, oldest first, along with the
+    length of the part of the file that holds them. Reading stops at a torn
+    record at the end of the file (left behind if the server was killed
+    mid-write).
+    """
+    records = []
+    good_offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            records.append(record)
+            good_offset += len(line)
+    return (records, good_offset)
+
+def sync_directory(path):
+    """
+    Makes the renames in the directory holding path durable.
+    """
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return  # Directories can't be opened on Windows (nor need syncing).
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class JsonStorage:
+    def __init__(self, path, compaction_threshold=COMPACTION_THRESHOLD, lazy=None,
+                 max_loaded_floots=MAX_LOADED_FLOOTS, durability=None,
+                 batch_window=BATCH_WINDOW, lock=None, preread=None):
+        """
+        lock is the ReadWriteLock held by whoever changes the floots (the
+        Database's); snapshots take its read lock while they read floots.
+        preread, if given, maps the paths of files the caller has already
+        started reading (e.g. in other processes; see sharded_storage.py) to
+        a Future of read_snapshot(path) or read_journal(path).
+        """
+        self._db_path = path
+        self._durability = get_durability(durability)
+        self._journal_path = path + JOURNAL_SUFFIX
+        self._rotated_journal_path = path + ROTATED_JOURNAL_SUFFIX
+        self._previous_path = path + PREVIOUS_SUFFIX
+        self._previous_journal_path = self._previous_path + JOURNAL_SUFFIX
+        self._floot_lock = lock or ReadWriteLock()
+        self._journal_length = 0
+        self._compaction_threshold = compaction_threshold
+        if lazy is None:
+            lazy = os.environ.get(LAZY_LOAD_ENV, "0") not in ("", "0")
+        self._lazy = lazy
+        self._max_loaded_floots = max_loaded_floots
+        # Maps floot ids to Floot objects. In lazy mode, only some floots are
+        # in here, least recently used first, and _raw holds the dictionary
+        # of every floot that isn't (and of loaded floots that haven't changed
+        # since they were loaded). Reads build Floots, so in lazy mode they
+        # take _lock.
+        self._data = OrderedDict() if lazy else {}
+        self._raw = {}
+        self._lock = threading.Lock()
+        self._index = FlootIndex()
+        # One more index per author, so that one user's floots can be listed
+        # without looking at anybody else's.
+        self._user_indexes = {}
+        self._preread = preread or {}
+        for journal_path in self._load_snapshot():
+            if os.path.exists(journal_path):
+                self._replay_journal(journal_path)
+        self._preread = None
+        self._journal = open(self._journal_path, "ab")
+        # Only the thread syncing the journal and the one setting it aside
+        # for a snapshot need this; appends are already serialized.
+        self._journal_lock = threading.Lock()
+        # Future of the latest snapshot written in the background
+        self._snapshot = completed_future()
+        # In batched mode, the records written within batch_window of each
+        # other share a sync; otherwise, only those written during a sync do.
+        self._syncs = SyncBatcher(self._sync_journal,
+                                  batch_window if self._durability == DURABILITY_BATCHED else 0)
+
+    def _read(self, read, path):
+        # Returns read(path), unless the caller already started reading it.
+        future = self._preread.pop(path, None)
+        return read(path) if future is None else future.result()
+
+    def _load_snapshot(self):
+        """
+        Loads the newest good snapshot, and returns the paths of the journals
+        to replay on top of it, oldest first.
+        """
+        journal_paths = [self._rotated_journal_path, self._journal_path]
+        try:
+            floot_dicts = self._read(read_snapshot, self._db_path)
+        except FileNotFoundError:
+            # Brand new database, or a crash right after the snapshot became
+            # data.json.prev and before its replacement took its place
+            if not os.path.exists(self._previous_path):
+                return journal_paths
+            floot_dicts = read_snapshot(self._previous_path)
+            journal_paths.insert(0, self._previous_journal_path)
+        except ValueError as e:
+            if not os.path.exists(self._previous_path):
+                raise
+            warnings.warn(f"{self._db_path} is damaged ({e}); loading the previous "
+                          f"snapshot instead, and moving it to {self._db_path + DAMAGED_SUFFIX}")
+            floot_dicts = read_snapshot(self._previous_path)
+            journal_paths.insert(0, self._previous_journal_path)
+            os.replace(self._db_path, self._db_path + DAMAGED_SUFFIX)
+
+        for floot_dict in floot_dicts.values():
+            if self._lazy:
+                self._put_raw(floot_dict)
+            else:
+                self._put(Floot.from_dictionary(floot_dict))
+        return journal_paths
+
+    def _is_durable(self):
+        return self._durability in (DURABILITY_ALWAYS, DURABILITY_BATCHED)
+
+    def _replay_journal(self, journal_path):
+        """
+        Re-applies every record in a journal on top of the snapshot that was
+        just loaded. A torn record at the end of the file is discarded and
+        truncated away so that later appends start on a clean line.
+        """
+        records, good_offset = self._read(read_journal, journal_path)
+        for record in records:
+            self._apply_record(record)
+        self._journal_length += len(records)
+        if good_offset != os.path.getsize(journal_path):
+            with open(journal_path, "r+b") as f:
+                f.truncate(good_offset)
+
+    def _apply_record(self, record):
+        """
+        Applies a single journal record to the in-memory data. Records are
+        idempotent, so replaying a journal that was already folded into the
+        snapshot (e.g. after a crash during compaction) is harmless. So is
+        replaying one on top of a snapshot that also holds some later
+        changes (see _start_snapshot), as long as the journal with those
+        changes is replayed after it.
+        """
+        op = record["op"]
+        if op == OP_UPSERT_FLOOT:
+            self._put(Floot.from_dictionary(record["floot"]))
+            return
+
+        floot_id = record["floot_id"]
+        if not self.has_floot(floot_id):
+            return
+        if op == OP_DELETE_FLOOT:
+            self._remove(floot_id)
+            return
+        floot = self.get_floot(floot_id)
+        # The floot is about to change, so its dictionary (if any) goes stale.
+        self._raw.pop(floot_id, None)
+        if op == OP_ADD_COMMENT:
+            comment = FlootComment.from_dictionary(record["comment"])
+            if not floot.has_comment(comment.get_id()):
+                floot.create_comment(comment)
+        elif op == OP_DELETE_COMMENT:
+            if floot.has_comment(record["comment_id"]):
+                comment = floot.get_comment(record["comment_id"])
+                floot.delete_comment(comment, comment.get_author())
+        elif op == OP_LIKE or op == OP_UNLIKE:
+            floot.set_liked(record["username"], op == OP_LIKE)
+        else:
+            raise ValueError(f"Unknown journal record type {op!r}")
+
+    def _append_to_journal(self, record):
+        """
+        Appends one mutation record to the journal, compacting the journal into
+        the snapshot once it grows past the compaction threshold. Returns a
+        Future that is done once the record is durable.
+        """
+        self._journal.write((json.dumps(record, separators=(",", ":")) + "\n").encode())
+        self._journal.flush()
+        self._journal_length += 1
+        # Syncing on another thread lets the caller release the database lock
+        # before waiting for it.
+        future = self._syncs.request() if self._is_durable() else completed_future()
+        if self._journal_length >= self._compaction_threshold and self._snapshot.done():
+            self._start_snapshot()
+        return future
+
+    def _sync_journal(self):
+        with self._journal_lock:
+            os.fsync(self._journal.fileno())
+
+    def durable(self):
+        """
+        Returns a Future that is done once every change made so far is
+        durable.
+        """
+        return self._syncs.last_future()
+
+    def _put(self, floot):
+        floot_id = floot.get_id()
+        old_username = self._get_username(floot_id)
+        if old_username is not None and old_username != floot.get_username():
+            self._remove_from_user_index(floot_id, old_username)
+        self._raw.pop(floot_id, None)
+        self._keep_loaded(floot)
+        self._add_to_indexes(floot_id, floot.get_username(), floot.get_timestamp_us())
+
+    def _put_raw(self, floot_dict):
+        # Lazy mode counterpart of _put, for floots read from the snapshot
+        floot_id = floot_dict[Floot.FLOOT_ID]
+        self._raw[floot_id] = floot_dict
+        self._add_to_indexes(floot_id, floot_dict[Floot.FLOOT_USERNAME],
+                             Floot.get_dictionary_timestamp_us(floot_dict))
+
+    def _add_to_indexes(self, floot_id, username, timestamp):
+        self._index.add(timestamp, floot_id)
+        user_index = self._user_indexes.get(username)
+        if user_index is None:
+            user_index = self._user_indexes[username] = FlootIndex()
+        user_index.add(timestamp, floot_id)
+
+    def _keep_loaded(self, floot):
+        """
+        Adds floot to the loaded floots, unloading the least recently used
+        ones if there are too many.
+        """
+        self._data[floot.get_id()] = floot
+        if not self._lazy:
+            return
+        self._data.move_to_end(floot.get_id())
+        while len(self._data) > self._max_loaded_floots:
+            # The dictionary goes in before the floot goes out, so that
+            # readers (which don't take the write lock) always find it.
+            floot_id, unloaded = next(iter(self._data.items()))
+            if floot_id not in self._raw:
+                self._raw[floot_id] = unloaded.to_dictionary()
+            del self._data[floot_id]
+
+    def _get_username(self, floot_id):
+        # Returns None if there is no such floot.
+        floot = self._data.get(floot_id)
+        if floot is not None:
+            return floot.get_username()
+        floot_dict = self._raw.get(floot_id)
+        return floot_dict and floot_dict[Floot.FLOOT_USERNAME]
+
+    def _remove(self, floot_id):
+        username = self._get_username(floot_id)
+        if username is None:
+            raise KeyError(floot_id)
+        self._data.pop(floot_id, None)
+        self._raw.pop(floot_id, None)
+        self._index.remove(floot_id)
+        self._remove_from_user_index(floot_id, username)
+
+    def _remove_from_user_index(self, floot_id, username):
+        user_index = self._user_indexes[username]
+        user_index.remove(floot_id)
+        if not user_index:
+            del self._user_indexes[username]
+
+    def _is_stored(self, floot):
+        # Also notes that floot is about to change, so that in lazy mode its
+        # stale dictionary is dropped.
+        if self._data.get(floot.get_id()) is not floot:
+            return False
+        self._raw.pop(floot.get_id(), None)
+        return True
+
+    def _save_copy(self, floot):
+        # floot was changed, but isn't the stored Floot with its id (e.g. it
+        # was built again after being unloaded), so it is saved whole. Raises
+        # a KeyError if the floot was deleted, rather than bring it back.
+        if not self.has_floot(floot.get_id()):
+            raise KeyError(floot.get_id())
+        return self.save_floot(floot)
+
+    def _start_snapshot(self):
+        """
+        Sets the journal aside and starts writing a snapshot to replace it in
+        the background. Must be called while nothing else changes floots
+        (e.g. with the write lock held).
+        """
+        with self._journal_lock:
+            if self._is_durable():
+                os.fsync(self._journal.fileno())
+            if os.path.exists(self._rotated_journal_path):
+                # The last snapshot failed, so the journal set aside for it is
+                # still needed: this one replaces both.
+                with open(self._journal_path, "rb") as journal, \
+                        open(self._rotated_journal_path, "ab") as rotated:
+                    rotated.write(journal.read())
+                    if self._is_durable():
+                        rotated.flush()
+                        os.fsync(rotated.fileno())
+                self._journal.truncate(0)
+            else:
+                self._journal.close()
+                os.replace(self._journal_path, self._rotated_journal_path)
+                self._journal = open(self._journal_path, "ab")
+        self._journal_length = 0
+
+        # Copy-on-write: the snapshot gets its own copy of which floots there
+        # are, but shares the dictionaries in _raw (which are replaced, never
+        # changed) and the Floot objects. Floots can change before the
+        # snapshot gets to them, so it may hold some changes that are also in
+        # the new journal, which is harmless (see _apply_record).
+        floot_dicts = dict(self._raw)
+        floots = [(floot_id, floot) for floot_id, floot in self._data.items()
+                  if floot_id not in floot_dicts]
+        self._snapshot = Future()
+        threading.Thread(target=self._write_snapshot, args=(floot_dicts, floots, self._snapshot),
+                         daemon=True).start()
+
+    def _write_snapshot(self, floot_dicts, floots, future):
+        try:
+            for start in range(0, len(floots), SNAPSHOT_CHUNK_SIZE):
+                with self._floot_lock.reading():
+                    for floot_id, floot in floots[start:start + SNAPSHOT_CHUNK_SIZE]:
+                        floot_dicts[floot_id] = floot.to_dictionary()
+            data = encode_snapshot(floot_dicts)
+
+            temp_path = self._db_path + TEMP_SUFFIX
+            with open(temp_path, "wb") as f:
+                f.write(data)
+                if self._is_durable():
+                    f.flush()
+                    os.fsync(f.fileno())
+            replacing = os.path.exists(self._db_path)
+            if replacing:
+                os.replace(self._db_path, self._previous_path)
+            os.replace(temp_path, self._db_path)
+            if self._is_durable():
+                sync_directory(self._db_path)
+            if replacing:
+                os.replace(self._rotated_journal_path, self._previous_journal_path)
+            else:
+                # There was no snapshot before (or it was damaged), so any
+                # previous one is from before the journal set aside.
+                for path in (self._previous_path, self._previous_journal_path,
+                             self._rotated_journal_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(None)
+
+    def compact(self):
+        """
+        Folds the journal into a new snapshot, and waits until it is written.
+        Must not be called while holding the lock.
+        """
+        if self._floot_lock.is_held():
+            raise RuntimeError("Can't compact while holding the database lock")
+        while True:
+            self._snapshot.exception()  # Waits for the one being written
+            with self._floot_lock.writing():
+                if self._snapshot.done():
+                    self._start_snapshot()
+                    snapshot = self._snapshot
+                    break
+        snapshot.result()
+
+    def close(self):
+        if self._floot_lock.is_held():
+            raise RuntimeError("Can't close the database while holding its lock")
+        # Wait for the snapshot being written and the last batch, which both
+        # need the journal.
+        self._snapshot.exception()
+        self.durable().result()
+        self._journal.close()
+
+    def count(self):
+        return len(self._index)
+
+    def iter_floots(self):
+        if not self._lazy:
+            return iter(list(self._data.values()))
+        # Floots that aren't loaded are built one at a time, without being
+        # kept, so that going through every floot doesn't unload the others.
+        with self._lock:
+            floot_ids = list(self._data) + [i for i in self._raw if i not in self._data]
+        return filter(None, map(self._peek_floot, floot_ids))
+
+    def _peek_floot(self, floot_id):
+        # Lazy mode: returns the floot without loading it, or None if there
+        # is no such floot.
+        with self._lock:
+            floot = self._data.get(floot_id)
+            floot_dict = self._raw.get(floot_id)
+        if floot is None and floot_dict is not None:
+            floot = Floot.from_dictionary(floot_dict)
+        return floot
+
+    def get_floots(self, count, before=None, username=None):
+        return [self.get_floot(key[1]) for key in self.newest_keys(count, before, username)]
+
+    def newest_keys(self, count, before=None, username=None):
+        """
+        Returns an iterator over the (timestamp, floot_id) keys of the floots
+        get_floots would return.
+        """
+        index = self._index if username is None else self._user_indexes.get(username)
+        if index is None:
+            return iter(())
+        return index.newest_keys(count, before)
+
+    def has_floot(self, floot_id):
+        if not self._lazy:
+            return floot_id in self._data
+        # get_floot loads and unloads floots while holding only the read lock.
+        with self._lock:
+            return floot_id in self._data or floot_id in self._raw
+
+    def get_floot(self, floot_id):
+        if not self._lazy:
+            return self._data[floot_id]
+        with self._lock:
+            floot = self._data.get(floot_id)
+            if floot is None:
+                floot = Floot.from_dictionary(self._raw[floot_id])
+            self._keep_loaded(floot)
+            return floot
+
+    def save_floot(self, floot):
+        self._put(floot)
+        return self._append_to_journal({
+            "op": OP_UPSERT_FLOOT,
+            "floot": floot.to_dictionary(),
+        })
+
+    def delete_floot(self, floot_id):
+        self._remove(floot_id)
+        return self._append_to_journal({"op": OP_DELETE_FLOOT, "floot_id": floot_id})
+
+    def add_comment(self, floot, comment):
+        if not self._is_stored(floot):
+            return self._save_copy(floot)
+        return self._append_to_journal({
+            "op": OP_ADD_COMMENT,
+            "floot_id": floot.get_id(),
+            "comment": comment.to_dictionary(),
+        })
+
+    def delete_comment(self, floot, comment):
+        if not self._is_stored(floot):
+            return self._save_copy(floot)
+        return self._append_to_journal({
+            "op": OP_DELETE_COMMENT,
+            "floot_id": floot.get_id(),
+            "comment_id": comment.get_id(),
+        })
+
+    def set_liked(self, floot, username, liked):
+        if not self._is_stored(floot):
+            return self._save_copy(floot)
+        return self._append_to_journal({
+            "op": OP_LIKE if liked else OP_UNLIKE,
+            "floot_id": floot.get_id(),
+            "username": username,
+        })
+
+    def __str__(self):
+        return str(self._data)
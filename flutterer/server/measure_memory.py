@@ -0,0 +1,124 @@
+#! /usr/bin/env python3
+
+"""
+File: measure_memory.py
+
+NOTE TO STUDENTS: You don't need to read anything in this file.
+
+Benchmark that reports how much memory the server needs per floot: it
+generates a database's worth of floots as JSON, loads them the way
+JsonStorage does (json.loads, then Floot.from_dictionary), and measures what
+stays allocated once the parsed JSON is gone.
+
+With --legacy, the floots are loaded into the layout Floot and FlootComment
+used before they were made compact (plain attributes, string ids, a separate
+string for every username) instead, so both numbers can be compared.
+
+usage: measure_memory.py [-h] [--floots N] [--comments N] [--likes N] [--users N]
+                         [--legacy]
+"""
+
+import argparse
+import gc
+import json
+import random
+import tracemalloc
+import uuid
+
+import timestamp_codec
+from floot import Floot
+from floot_comment import FlootComment
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Measures the memory used per floot.")
+    parser.add_argument("--floots", type=int, default=20000)
+    parser.add_argument("--comments", type=int, default=10, help="comments per floot")
+    parser.add_argument("--likes", type=int, default=10, help="likes per floot")
+    parser.add_argument("--users", type=int, default=1000, help="number of distinct users")
+    parser.add_argument("--legacy", action="store_true",
+                        help="measure the layout used before floots were made compact")
+    return parser.parse_args()
+
+class LegacyComment:
+    """
+    A FlootComment as it used to be laid out in memory: a plain object with a
+    string id and its own copy of the author's name.
+    """
+    def __init__(self, message, author, comment_id):
+        self._message = message
+        self._author = author
+        self._id = comment_id
+
+    @staticmethod
+    def from_dictionary(comment_dict):
+        return LegacyComment(comment_dict[FlootComment.COMMENT_TEXT],
+                             comment_dict[FlootComment.COMMENT_AUTHOR],
+                             comment_dict[FlootComment.COMMENT_ID])
+
+class LegacyFloot:
+    """
+    A Floot as it used to be laid out in memory (same attributes as Floot, but
+    without __slots__, with a string id and without interned usernames).
+    """
+    def __init__(self, message, username, liked_by, floot_id, timestamp, comments):
+        self._message = message
+        self._username = username
+        self._liked_by = dict.fromkeys(liked_by)
+        self._timestamp = timestamp
+        self._timestamp_text = None
+        self._id = floot_id
+        self._comments = comments
+        self._comment_positions = {comment._id: i for i, comment in enumerate(comments)}
+        self._deleted_comments = 0
+
+    @staticmethod
+    def from_dictionary(floot_dict):
+        timestamp = floot_dict.get(Floot.TIMESTAMP_US)
+        if timestamp is None:
+            timestamp = timestamp_codec.parse_timestamp(floot_dict[Floot.TIMESTAMP])
+        comments = [LegacyComment.from_dictionary(c) for c in floot_dict[Floot.COMMENTS]]
+        return LegacyFloot(floot_dict[Floot.MESSAGE], floot_dict[Floot.FLOOT_USERNAME],
+                           floot_dict[Floot.LIKED_BY], floot_dict[Floot.FLOOT_ID],
+                           timestamp, comments)
+
+def generate_database(num_floots, num_comments, num_likes, num_users):
+    """
+    Returns the JSON text of a database with the given shape.
+    """
+    users = [f"user{i}" for i in range(num_users)]
+    floots = {}
+    for i in range(num_floots):
+        floot = Floot(f"Floot number {i}", random.choice(users),
+                      liked_by=random.sample(users, min(num_likes, num_users)))
+        floot_dict = floot.to_dictionary()
+        floot_dict[Floot.COMMENTS] = [{
+            "id": str(uuid.uuid4()),
+            "message": f"Comment number {j}",
+            "username": random.choice(users),
+        } for j in range(num_comments)]
+        floots[floot.get_id()] = floot_dict
+    return json.dumps(floots)
+
+def measure(json_text, floot_class=Floot):
+    """
+    Loads the floots in json_text (as instances of floot_class) and returns
+    the number of bytes they keep allocated, along with the number of floots.
+    """
+    gc.collect()
+    tracemalloc.start()
+    parsed = json.loads(json_text)
+    floots = [floot_class.from_dictionary(floot_dict) for floot_dict in parsed.values()]
+    del parsed
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (allocated, len(floots))
+
+if __name__ == "__main__":
+    args = get_args()
+    floot_class = LegacyFloot if args.legacy else Floot
+    allocated, count = measure(generate_database(args.floots, args.comments, args.likes,
+                                                 args.users), floot_class)
+    layout = "legacy layout" if args.legacy else "current layout"
+    print(f"{count} floots ({args.comments} comments and {args.likes} likes each), "
+          f"{layout}: {allocated / count:.0f} bytes per floot")
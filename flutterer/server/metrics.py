@@ -0,0 +1,41 @@
+"""
+This file collects the numbers served at GET /api/metrics, which show how the
+server's caches and optimizations are doing. Each module that has something
+to report registers a function returning a dictionary of its numbers.
+
+With serve.py --workers, every worker process has its own metrics, so the
+numbers describe whichever worker answered the request.
+
+STUDENTS: You don't need to read anything in this file.
+"""
+
+import threading
+
+_sources = {}
+
+def register(name, get_values):
+    """
+    Makes get_values() (which must return a dictionary) appear under `name`
+    in get_metrics().
+    """
+    _sources[name] = get_values
+
+def get_metrics():
+    return {name: get_values() for name, get_values in sorted(_sources.items())}
+
+class Counters:
+    """
+    A thread-safe set of named counters.
+    """
+    def __init__(self, *names):
+        self._lock = threading.Lock()
+        self._values = dict.fromkeys(names, 0)
+
+    def add(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self._values[name] += amount
+
+    def to_dictionary(self):
+        with self._lock:
+            return dict(self._values)
@@ -0,0 +1,51 @@
+#! /usr/bin/env python3
+
+"""
+File: migrate_db.py
+
+NOTE TO STUDENTS: You don't need to read anything in this file.
+
+One-shot tool that copies a JSON database (data.json, plus its journal) into a
+SQLite database that can then be used with FLUTTERER_DB_BACKEND=sqlite:
+
+usage: migrate_db.py [-h] [--from JSON_PATH] [--to SQLITE_PATH]
+"""
+
+import argparse
+import os
+import sys
+
+from database import BACKENDS
+from json_storage import JsonStorage
+from sqlite_storage import SqliteStorage
+
+SERVER_DIR = os.path.dirname(os.path.realpath(__file__))
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Copies a JSON Flutterer database into SQLite.")
+    parser.add_argument("--from", dest="source", metavar="JSON_PATH",
+                        default=os.path.join(SERVER_DIR, BACKENDS["json"][1]))
+    parser.add_argument("--to", dest="target", metavar="SQLITE_PATH",
+                        default=os.path.join(SERVER_DIR, BACKENDS["sqlite"][1]))
+    return parser.parse_args()
+
+def migrate(source_path, target_path):
+    """
+    Copies every floot in the JSON database at source_path into the SQLite
+    database at target_path, and returns how many floots were copied.
+    """
+    source = JsonStorage(source_path)
+    target = SqliteStorage(target_path)
+    try:
+        target.save_floots(source.iter_floots())
+        return source.count()
+    finally:
+        target.close()
+        source.close()
+
+if __name__ == "__main__":
+    args = get_args()
+    if not os.path.exists(args.source):
+        sys.exit(f"{args.source} does not exist")
+    count = migrate(args.source, args.target)
+    print(f"Copied {count} floots from {args.source} to {args.target}")
@@ -1,3 +1,5 @@
+from collections.abc import Iterator
+
 class Response:
     """
     This class allows you to send a response to the client with a custom
@@ -5,9 +7,11 @@ class Response:
 
     STUDENTS: You almost definitely won't need to use this.
     """
-    def __init__(self, body, content_type="text/html"):
+    def __init__(self, body, content_type="text/html", headers=None):
         self.body = body
         self.content_type = content_type
+        # Extra HTTP headers to send, e.g. {"Cache-Control": "no-cache"}
+        self.headers = headers or {}
 
     def get_body(self):
         return self.body
@@ -15,8 +19,32 @@ class Response:
     def get_body_bytes(self):
         if isinstance(self.body, (bytes, bytearray)):
             return self.body
+        elif isinstance(self.body, Iterator):
+            # The body is only produced once, so keep the joined result.
+            self.body = b"".join(self.iter_body_bytes())
+            return self.body
         else:
             return bytes(str(self.body), "utf-8")
 
+    def is_streamed(self):
+        """
+        Returns whether the body is an iterator of chunks (bytes or strings)
+        that is produced while it is being sent.
+        """
+        return isinstance(self.body, Iterator)
+
+    def iter_body_bytes(self):
+        """
+        Yields the body as one or more chunks of bytes.
+        """
+        if not self.is_streamed():
+            yield self.get_body_bytes()
+            return
+        for chunk in self.body:
+            yield chunk if isinstance(chunk, (bytes, bytearray)) else bytes(str(chunk), "utf-8")
+
     def get_content_type(self):
         return self.content_type
+
+    def get_headers(self):
+        return self.headers
@@ -0,0 +1,96 @@
+"""
+This file exports ReadWriteLock, a lock that lets any number of threads read
+at the same time while making writers wait for exclusive access. The Database
+uses it so that a request never sees a half-applied change when the server
+handles several requests at once.
+
+STUDENTS: You don't need to read anything in this file.
+"""
+
+import threading
+from contextlib import contextmanager
+
+class ReadWriteLock:
+    """
+    A reentrant reader/writer lock. A thread that holds the write lock may
+    also take the read lock (or the write lock again), and a thread may take
+    the read lock several times. Waiting writers are served before new
+    readers, so a steady stream of reads can't starve writes.
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._waiting_writers = 0
+        self._writer = None
+        self._write_depth = 0
+        self._local = threading.local()
+
+    def _read_depth(self):
+        return getattr(self._local, "read_depth", 0)
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer != me and self._read_depth() == 0:
+                while self._writer is not None or self._waiting_writers:
+                    self._condition.wait()
+                self._readers += 1
+            self._local.read_depth = self._read_depth() + 1
+
+    def release_read(self):
+        with self._condition:
+            self._local.read_depth -= 1
+            if self._local.read_depth == 0 and self._writer != threading.get_ident():
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+            if self._read_depth():
+                raise RuntimeError("Can't take the write lock while holding the read lock")
+            self._waiting_writers += 1
+            while self._writer is not None or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self):
+        with self._condition:
+            self._write_depth -= 1
+            if self._write_depth == 0:
+                self._writer = None
+                self._condition.notify_all()
+
+    def is_held(self):
+        """
+        Returns True if the calling thread holds the read or write lock.
+        """
+        return self._writer == threading.get_ident() or self._read_depth() > 0
+
+    @contextmanager
+    def reading(self):
+        """
+        Context manager that holds the read lock: `with lock.reading(): ...`
+        """
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def writing(self):
+        """
+        Context manager that holds the write lock: `with lock.writing(): ...`
+        """
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
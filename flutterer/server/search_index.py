@@ -0,0 +1,252 @@
+"""
+This file exports SearchIndex, an in-memory inverted index over the text of
+floots and their comments. Every word maps to the sorted list of the floots
+that contain it, so a search walks the rarest word's floots newest first and
+checks the other words with set lookups, never touching floots that can't
+match.
+
+Queries are lowercased and split into words the same way as the text. Every
+word must match (AND), and a word ending with "*" matches any word starting
+with it, e.g. "hello wor*".
+
+STUDENTS: You don't need to read anything in this file.
+"""
+
+import bisect
+import heapq
+import re
+import threading
+
+WORD_PATTERN = re.compile(r"\w+")
+PREFIX_MARKER = "*"
+
+# A prefix matching more words than this (e.g. "a*") matches so many floots
+# that it's cheaper to check every floot, newest first, than to merge the
+# lists of all those words.
+MAX_MERGED_WORDS = 64
+
+def tokenize(text):
+    """
+    Returns the list of lowercase words in text. Any message is valid, so
+    text may not be a string; it is indexed as it would be printed.
+    """
+    return WORD_PATTERN.findall(str(text).lower())
+
+def parse_query(query):
+    """
+    Turns a search query into a list of (word, is_prefix) tuples.
+    """
+    clauses = []
+    for part in query.split():
+        words = tokenize(part)
+        for word in words:
+            clauses.append((word, False))
+        if words and part.endswith(PREFIX_MARKER):
+            clauses[-1] = (words[-1], True)
+    return clauses
+
+def get_words(floot):
+    """
+    Returns a dictionary mapping each word in floot's message and comments to
+    the number of them (message or comment) it appears in.
+    """
+    words = dict.fromkeys(tokenize(floot.get_message()), 1)
+    for comment in floot.iter_comments():
+        for word in set(tokenize(comment.get_message())):
+            words[word] = words.get(word, 0) + 1
+    return words
+
+def insert_key(keys, key):
+    # Floots are mostly indexed oldest to newest, so most keys go at the end.
+    if not keys or keys[-1] < key:
+        keys.append(key)
+    else:
+        bisect.insort(keys, key)
+
+def remove_key(keys, key):
+    del keys[bisect.bisect_left(keys, key)]
+
+def newest_keys(keys, before=None):
+    """
+    Iterates over a sorted list of (timestamp, floot_id) keys from newest to
+    oldest, starting right before `before` if it is given.
+    """
+    end = len(keys) if before is None else bisect.bisect_left(keys, before)
+    return (keys[i] for i in range(end - 1, -1, -1))
+
+class SearchIndex:
+    def __init__(self):
+        # Maps each word to the sorted list of the (timestamp, floot_id) keys
+        # of the floots containing it. The lists share one key tuple per
+        # floot, so each entry costs a single pointer.
+        self._postings = {}
+        # Every word in _postings, sorted, so that the words sharing a prefix
+        # are next to each other
+        self._vocabulary = []
+        # Maps each floot id to its key and the words in it, each with the
+        # number of texts (message or comment) it appears in, so that a
+        # comment can be added or removed without going over the others
+        self._floots = {}
+        # The keys of every indexed floot, sorted
+        self._keys = []
+        # Floots are indexed from the thread that changed them (or, for
+        # shared databases, from the change poller) while others search.
+        self._lock = threading.Lock()
+
+    def index_floots(self, floots):
+        """
+        Indexes many floots at once, e.g. when the database is opened. Much
+        faster than calling index_floot for each of them, but only allowed
+        while the index is empty.
+        """
+        with self._lock:
+            if self._floots:
+                raise ValueError("index_floots needs an empty index")
+            for floot in floots:
+                key = (floot.get_timestamp_us(), floot.get_id())
+                words = get_words(floot)
+                self._floots[floot.get_id()] = (key, words)
+                self._keys.append(key)
+                for word in words:
+                    postings = self._postings.get(word)
+                    if postings is None:
+                        self._postings[word] = [key]
+                    else:
+                        postings.append(key)
+            self._keys.sort()
+            for postings in self._postings.values():
+                postings.sort()
+            self._vocabulary = sorted(self._postings)
+
+    def index_floot(self, floot):
+        """
+        Adds floot (and its comments) to the index, or updates it if it was
+        already there.
+        """
+        words = get_words(floot)
+        key = (floot.get_timestamp_us(), floot.get_id())
+        with self._lock:
+            old_key, old_words = self._floots.get(floot.get_id(), (None, {}))
+            if old_key != key:
+                # New floot, or one whose timestamp changed: index it afresh
+                self._remove(floot.get_id())
+                old_words = {}
+                insert_key(self._keys, key)
+            else:
+                key = old_key
+            for word in old_words.keys() - words.keys():
+                self._remove_posting(word, key)
+            for word in words.keys() - old_words.keys():
+                self._add_posting(word, key)
+            self._floots[floot.get_id()] = (key, words)
+
+    def add_text(self, floot_id, text):
+        """
+        Adds the words of text (e.g. a new comment) to an indexed floot.
+        Returns False, without doing anything, if the floot isn't indexed.
+        """
+        with self._lock:
+            if floot_id not in self._floots:
+                return False
+            key, words = self._floots[floot_id]
+            for word in set(tokenize(text)):
+                count = words.get(word, 0)
+                if count == 0:
+                    self._add_posting(word, key)
+                words[word] = count + 1
+            return True
+
+    def remove_text(self, floot_id, text):
+        """
+        Opposite of add_text: removes the words of text (e.g. a deleted
+        comment) from an indexed floot, keeping the words that also appear
+        in its other texts.
+        """
+        with self._lock:
+            if floot_id not in self._floots:
+                return False
+            key, words = self._floots[floot_id]
+            for word in set(tokenize(text)):
+                count = words.get(word, 0)
+                if count > 1:
+                    words[word] = count - 1
+                elif count == 1:
+                    del words[word]
+                    self._remove_posting(word, key)
+            return True
+
+    def remove_floot(self, floot_id):
+        """
+        Removes a floot from the index. Does nothing if it isn't there.
+        """
+        with self._lock:
+            self._remove(floot_id)
+
+    def _remove(self, floot_id):
+        key, words = self._floots.pop(floot_id, (None, ()))
+        if key is None:
+            return
+        remove_key(self._keys, key)
+        for word in words:
+            self._remove_posting(word, key)
+
+    def _add_posting(self, word, key):
+        postings = self._postings.get(word)
+        if postings is None:
+            postings = self._postings[word] = []
+            bisect.insort(self._vocabulary, word)
+        insert_key(postings, key)
+
+    def _remove_posting(self, word, key):
+        postings = self._postings[word]
+        remove_key(postings, key)
+        if not postings:
+            del self._postings[word]
+            del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+
+    def _expand(self, word, is_prefix):
+        """
+        Returns the set of indexed words matching one query word.
+        """
+        if not is_prefix:
+            return {word} if word in self._postings else set()
+        start = bisect.bisect_left(self._vocabulary, word)
+        end = start
+        while end < len(self._vocabulary) and self._vocabulary[end].startswith(word):
+            end += 1
+        return set(self._vocabulary[start:end])
+
+    def search(self, query, count=None, before=None):
+        """
+        Returns the ids of the floots matching query, newest first, at most
+        `count` of them. If `before` is a (timestamp, floot_id) key, only
+        floots older than that key are included.
+        """
+        clauses = parse_query(query)
+        if not clauses or count == 0:
+            return []
+        with self._lock:
+            word_sets = [self._expand(word, is_prefix) for word, is_prefix in clauses]
+            if not all(word_sets):
+                return []
+            # Walk the floots of the rarest clause, and keep those that match
+            # every other clause too.
+            word_sets.sort(key=lambda words: sum(len(self._postings[w]) for w in words))
+            driver, others = word_sets[0], word_sets[1:]
+            if len(driver) > MAX_MERGED_WORDS:
+                keys, others = newest_keys(self._keys, before), word_sets
+            else:
+                keys = heapq.merge(*(newest_keys(self._postings[word], before)
+                                     for word in driver), reverse=True)
+            floot_ids = []
+            last_key = None
+            for key in keys:
+                if key == last_key:
+                    continue  # Contains several words of the driving clause
+                last_key = key
+                words = self._floots[key[1]][1]
+                if all(not words.keys().isdisjoint(clause) for clause in others):
+                    floot_ids.append(key[1])
+                    if len(floot_ids) == count:
+                        break
+            return floot_ids
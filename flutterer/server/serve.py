@@ -7,18 +7,50 @@ STUDENTS: You're welcome to look around this file if you're interested, but you
 don't need to, and you certainly don't need to modify anything here.
 """
 
+import argparse
+import inspect
 import json
+import os
 import re
+import signal
+import socket
+import threading
 import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
 
 import api
+import compression
 from colorama import Fore, Style, init
+from database import Database
 from error import HTTPError
+from event_stream import EventStreamHub
+from json_cache import EncodedDict
 from response import Response
 
 SERVER_PORT = 1066
 
+# Number of requests handled at the same time, and number of connections the
+# OS queues up while all of them are busy.
+DEFAULT_THREADS = 16
+DEFAULT_BACKLOG = 128
+
+# A client that stalls for this long while sending its request (or receiving
+# the response) is disconnected, so it can't tie up a worker forever.
+REQUEST_TIMEOUT = 30  # second(s)
+
+# A worker process (see --workers) that dies this soon after being started is
+# restarted only after this delay, so a worker that crashes on startup doesn't
+# make the supervisor fork in a tight loop.
+MIN_WORKER_LIFETIME = 1  # second(s)
+
+# Clients connected to this path are sent every change to the database as it
+# happens, as Server-Sent Events (see event_stream.py).
+STREAM_PATH = "/api/stream"
+
 def flutterer_print(*args, **kwargs):
     timestamp = time.strftime("%I:%M:%S %p").lower()
     print(f"{Fore.LIGHTBLACK_EX}{timestamp}{Style.RESET_ALL} {Fore.LIGHTBLUE_EX}[Flutterer]{Style.RESET_ALL}",
@@ -34,24 +66,274 @@ def print_green(msg):
 def print_red(msg):
     flutterer_print(f"{Fore.RED}{msg}{Style.RESET_ALL}")
 
-def find_route(path, route_list):
-    for route in route_list:
-        criteria = route[0]
-        handler = route[1]
-        if isinstance(criteria, str):
-            if path == criteria:
-                # Route takes no args, so return empty args dict
-                return (handler, {})
-        elif isinstance(criteria, tuple):
-            if re.fullmatch("^" + criteria[0] + "$", path):
-                arg_names = criteria[1:]
-                match = re.findall("^" + criteria[0] + "$", path)[0]
-                match_components = match if isinstance(match, tuple) else (match,)
-                return (handler, dict(zip(arg_names, match_components)))
+class RouteTable:
+    """
+    Matches request paths against a list of routes (see api.GET_ROUTES). Each
+    route is either an exact path, or a (regex, arg_name, ...) tuple whose
+    groups are passed to the handler as arguments named arg_name, ...; the
+    first route that matches the whole path wins.
+
+    All the routes are compiled into one regex, with one named group around
+    each route, so finding the route for a path takes a single match.
+    """
+    def __init__(self, route_list):
+        alternatives = []
+        # Maps the number of each route's group to (handler, arg names,
+        # numbers of the groups holding the args)
+        self._routes = {}
+        group_count = 0
+        for route in route_list:
+            criteria = route[0]
+            handler = route[1]
+            if isinstance(criteria, str):
+                pattern, arg_names = re.escape(criteria), ()
+            elif isinstance(criteria, tuple):
+                pattern, arg_names = criteria[0], criteria[1:]
+            else:
+                raise TypeError(f"route[0] has unknown type: {route}")
+            route_group = group_count + 1
+            inner_groups = re.compile(pattern).groups
+            group_count += 1 + inner_groups
+            alternatives.append(f"(?P<route{len(alternatives)}>{pattern})")
+            self._routes[route_group] = (
+                handler, arg_names, range(route_group + 1, route_group + 1 + inner_groups))
+        self._regex = re.compile("|".join(alternatives)) if alternatives else None
+
+    def find(self, path):
+        """
+        Returns a (handler, args dict) tuple for the first route matching
+        path, or None if no route matches.
+        """
+        match = self._regex and self._regex.fullmatch(path)
+        if not match:
+            return None
+        # The route's own group closes after the groups inside it, so it is
+        # the last group matched.
+        handler, arg_names, arg_groups = self._routes[match.lastindex]
+        values = [match.group(group) or "" for group in arg_groups]
+        return (handler, dict(zip(arg_names, values)))
+
+# Compiled once, when the server starts
+GET_ROUTE_TABLE = RouteTable(api.GET_ROUTES)
+POST_ROUTE_TABLE = RouteTable(api.POST_ROUTES)
+
+def get_query_args(handler, query_string):
+    """
+    Parses a query string (e.g. "limit=20&before=abc") into a dict of keyword
+    arguments for handler. Parameters the handler doesn't accept are ignored,
+    and if a parameter is repeated, the last value wins.
+    """
+    accepted = inspect.signature(handler).parameters
+    return {name: values[-1]
+            for name, values in parse_qs(query_string).items()
+            if name in accepted}
+
+# JSON is sent without any extra whitespace unless the client asks for
+# ?pretty=1. The encoders are built once and reused.
+COMPACT_JSON_ENCODER = json.JSONEncoder(separators=(",", ":"))
+PRETTY_JSON_ENCODER = json.JSONEncoder(indent=4)
+
+# Lists longer than this are encoded and sent a few items at a time instead of
+# as one giant string.
+STREAMED_LIST_LENGTH = 1000
+STREAMED_CHUNK_ITEMS = 500
+
+def encode_json(output, pretty=False):
+    """
+    Encodes a list or dict as JSON. Returns a string, or, for long lists, an
+    iterator over the pieces of the JSON text. Dictionaries that already know
+    their encoding (see json_cache.EncodedDict) aren't encoded again.
+    """
+    if pretty:
+        return PRETTY_JSON_ENCODER.encode(output)
+    if isinstance(output, list) and len(output) > STREAMED_LIST_LENGTH:
+        return iter_json_list(output)
+    return encode_compact_json(output)
+
+def encode_compact_json(value):
+    if isinstance(value, EncodedDict):
+        return value.json
+    if isinstance(value, list):
+        if value and isinstance(value[0], EncodedDict):
+            return "[" + ",".join([encode_compact_json(item) for item in value]) + "]"
+    elif isinstance(value, dict):
+        # e.g. a page of floots: {"floots": [...], "next_cursor": ...}
+        if any(isinstance(item, EncodedDict)
+               or (isinstance(item, list) and item and isinstance(item[0], EncodedDict))
+               for item in value.values()):
+            return "{" + ",".join([COMPACT_JSON_ENCODER.encode(str(key)) + ":" + encode_compact_json(item)
+                                   for key, item in value.items()]) + "}"
+    return COMPACT_JSON_ENCODER.encode(value)
+
+def iter_json_list(items):
+    # Each chunk is encoded in one go, which is much faster than
+    # json.JSONEncoder.iterencode (that one is written in pure Python).
+    for start in range(0, len(items), STREAMED_CHUNK_ITEMS):
+        chunk = encode_compact_json(items[start:start + STREAMED_CHUNK_ITEMS])
+        if start > 0:
+            chunk = "," + chunk[1:]
+        if start + STREAMED_CHUNK_ITEMS < len(items):
+            chunk = chunk[:-1]
+        yield chunk
+
+def wants_pretty_json(query_string):
+    if "pretty" not in query_string:
+        return False
+    return parse_qs(query_string).get("pretty", [""])[-1] in ("1", "true")
+
+def make_response(handler_function, output, pretty=False):
+    """
+    Converts the value returned by an API handler into a Response. JSON is
+    indented if pretty is True.
+    """
+    # These are the acceptable output types:
+    #
+    # * string (gets returned as plain text)
+    # * list or dict (gets serialized to JSON)
+    # * Response (gets written out with appropriate content type)
+    # * HTTPError (gets thrown as an exception, which is subsequently
+    #   caught and written as an error with appropriate status code)
+    #
+    # Anything else indicates the student is probably not doing what they
+    # meant to do, so we throw an exception.
+    if isinstance(output, str):
+        output = Response(output, content_type="text/plain")
+    elif isinstance(output, list) or isinstance(output, dict):
+        output = Response(encode_json(output, pretty), content_type="application/json")
+    elif isinstance(output, Response):
+        # nothing to do here
+        pass
+    elif isinstance(output, HTTPError):
+        raise output
+    else:
+        raise TypeError(f"Function {handler_function.__name__!r} returned unacceptable "
+                f"output: {output!r}\n"
+                "Your function should return one of these:\n"
+                " * A string (to be sent to the client as plain text)\n"
+                " * A list or dictionary (to be sent to the client as JSON)\n"
+                " * A Response object (if you are trying to send a specific content-type)\n"
+                " * An HTTPError (if you want to report an error to the client)")
+    return output
+
+def parse_request_body(headers, body):
+    """
+    Converts the body of a POST request into a python dictionary, raising an
+    HTTPError if the client didn't send JSON.
+    """
+    ctype = headers["Content-Type"]
+
+    # refuse to receive non-json content
+    if ctype != "application/json":
+        raise HTTPError(400,
+                "Error in serve.py: Expected the client to specify a content "
+                f"type of 'application/json', but got {ctype!r} instead.")
+
+    try:
+        return json.loads(body)
+    except json.JSONDecodeError:
+        raise HTTPError(400,
+                "Error in serve.py: The request body received from the client "
+                "is not valid JSON.")
+
+def is_not_modified(headers, response):
+    """
+    Returns whether the client already has an up-to-date copy of response,
+    judging by the request's If-None-Match or If-Modified-Since header and
+    the response's ETag or Last-Modified header.
+    """
+    response_headers = response.get_headers()
+    if_none_match = headers["If-None-Match"]
+    if if_none_match is not None:
+        etag = response_headers.get("ETag")
+        if etag is None:
+            return False
+        # Weak comparison, as RFC 9110 requires for If-None-Match
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+
+    if_modified_since = headers["If-Modified-Since"]
+    last_modified = response_headers.get("Last-Modified")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+def service_request(method, target, headers, body=None, wait_until_durable=True):
+    """
+    Runs the API handler matching a request and returns a tuple of
+    (status code, Response, HTTPError or None). This is shared by every
+    server front end (see FluttererHandler and async_serve.py). Unexpected
+    exceptions raised by the handler are passed on to the caller. The
+    Response is gzip-encoded if the client accepts that, and if the client's
+    cached copy of a GET response is still good, the status is 304 and the
+    Response has no body.
+
+    POST requests only return once the changes they made are durable (see
+    Database.durable), unless wait_until_durable is False, in which case the
+    caller must wait for api.db.durable() before responding.
+    """
+    try:
+        if method == "GET":
+            routes, extra_params, writes = GET_ROUTE_TABLE, None, False
+        elif method == "POST":
+            extra_params = {"request_body": parse_request_body(headers, body)}
+            routes, writes = POST_ROUTE_TABLE, True
         else:
-            raise TypeError(f"route[0] has unknown type: {route}")
+            raise HTTPError(501, f"Unsupported method {method!r}")
+
+        path, _, query_string = target.partition("?")
+        route_match = routes.find(path)
+        if not route_match:
+            raise HTTPError(404, "Matching route not found")
+        handler, route_args = route_match
+        # Arguments taken from the path (and the request body) win over
+        # query parameters with the same name.
+        args = get_query_args(handler, query_string)
+        args.update(route_args)
+        if extra_params:
+            args.update(extra_params)
+        # Hold the database lock while the handler runs and its output is
+        # encoded, but not while the response is sent to a (possibly slow)
+        # client.
+        with (api.db.writing() if writes else api.db.reading()):
+            output = handler(**args)
+            response = make_response(handler, output, wants_pretty_json(query_string))
+        # Waiting after the lock is released lets the requests that come in
+        # meanwhile make their changes too, and share the same disk sync.
+        if writes and wait_until_durable:
+            api.db.durable().result()
+        response = compression.encode_response(headers, response)
+        if method == "GET" and is_not_modified(headers, response):
+            return (304, Response(b"", content_type=response.get_content_type(),
+                                  headers=response.get_headers()), None)
+        return (200, response, None)
+    except HTTPError as e:
+        return (e.status, Response(f"Error: {e.message}", content_type="text/plain"), e)
+
+def get_last_event_id(headers, query_string):
+    """
+    Returns the seq of the last change a client connecting to STREAM_PATH has
+    seen, or None if it is connecting for the first time. EventSource sends
+    Last-Event-ID when it reconnects; it can also be given as
+    ?last_event_id= on the first connection.
+    """
+    last_event_id = headers["Last-Event-ID"]
+    if last_event_id is None:
+        last_event_id = parse_qs(query_string).get("last_event_id", [None])[-1]
+    if last_event_id is None:
+        return None
+    try:
+        return int(last_event_id)
+    except ValueError:
+        return 0  # Unknown position, so the client must reload
+
+INTERNAL_SERVER_ERROR_MESSAGE = "Unexpected server error (see terminal for details)"
 
 class FluttererHandler(BaseHTTPRequestHandler):
+    timeout = REQUEST_TIMEOUT
+
     def __init__(self, *args, **kwargs):
         self._http_error = None
         BaseHTTPRequestHandler.__init__(self, *args, **kwargs)
@@ -67,106 +349,250 @@ class FluttererHandler(BaseHTTPRequestHandler):
         if self._http_error:
             msg += f": {self._http_error.message}"
             self._http_error = None
-        (print_green if code == 200 else print_red)(msg)
+        (print_green if code in (200, 304) else print_red)(msg)
 
-    def _service_request(self, routes, extra_params=None):
+    def _service_request(self, body=None):
         try:
-            route_match = find_route(self.path, routes)
-            if not route_match:
-                raise HTTPError(404, "Matching route not found")
-            handler, args = route_match
-            if extra_params:
-                args.update(extra_params)
-            output = handler(**args)
-            self._send_reponse(handler, output)
-        except HTTPError as e:
-            self._handle_http_error(e)
+            status, response, self._http_error = service_request(
+                self.command, self.path, self.headers, body)
         except Exception:
             self._handle_internal_server_error()
             raise
+        # Errors from here on (e.g. while a streamed body is being encoded)
+        # can't be reported to the client anymore: the connection is just
+        # closed.
+        self._send_reponse(status, response)
 
-    def _send_reponse(self, handler_function, output):
-        # These are the acceptable output types:
-        #
-        # * string (gets returned as plain text)
-        # * list or dict (gets serialized to JSON)
-        # * Response (gets written out with appropriate content type)
-        # * HTTPError (gets thrown as an exception, which is subsequently
-        #   caught and written as an error with appropriate status code)
-        #
-        # Anything else indicates the student is probably not doing what they
-        # meant to do, so we throw an exception.
-        if isinstance(output, str):
-            output = Response(output, content_type="text/plain")
-        elif isinstance(output, list) or isinstance(output, dict):
-            output = Response(json.dumps(output, indent=4),
-                              content_type="application/json")
-        elif isinstance(output, Response):
-            # nothing to do here
-            pass
-        elif isinstance(output, HTTPError):
-            raise output
-        else:
-            raise TypeError(f"Function {handler_function.__name__!r} returned unacceptable "
-                    f"output: {output!r}\n"
-                    "Your function should return one of these:\n"
-                    " * A string (to be sent to the client as plain text)\n"
-                    " * A list or dictionary (to be sent to the client as JSON)\n"
-                    " * A Response object (if you are trying to send a specific content-type)\n"
-                    " * An HTTPError (if you want to report an error to the client)")
-
-        self.send_response(200)
+    def _send_reponse(self, status, output):
+        self.send_response(status)
         self.send_header("Content-Type", output.get_content_type())
+        for name, value in output.get_headers().items():
+            self.send_header(name, value)
         self.end_headers()
-        self.wfile.write(output.get_body_bytes())
+        for chunk in output.iter_body_bytes():
+            self.wfile.write(chunk)
 
     def _handle_internal_server_error(self):
         self.send_response(500)
         self.send_header("Content-Type", "text/plain")
         self.end_headers()
-        self.wfile.write(bytes(f"Unexpected server error (see terminal for details)",
-                                "utf-8"))
+        self.wfile.write(bytes(INTERNAL_SERVER_ERROR_MESSAGE, "utf-8"))
 
-    def _handle_http_error(self, e):
-        self._http_error = e
-        self.send_response(e.status)
-        self.send_header("Content-Type", "text/plain")
+    def _service_stream(self, query_string):
+        last_event_id = get_last_event_id(self.headers, query_string)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
         self.end_headers()
-        self.wfile.write(bytes(f"Error: {e.message}", "utf-8"))
+        self.wfile.flush()
+
+        # Hand the socket over to the stream hub, which keeps it open after
+        # this request is done.
+        self.close_connection = True
+        self.server.detach_request(self.request)
+        self.server.stream_hub.subscribe(self.request, last_event_id)
 
     def do_GET(self):
         self._log_request_start()
-        self._service_request(api.GET_ROUTES)
+        path, _, query_string = self.path.partition("?")
+        if path == STREAM_PATH:
+            self._service_stream(query_string)
+            return
+        self._service_request()
 
     # Handles POST requests
     def do_POST(self):
         self._log_request_start()
+        try:
+            length = int(self.headers["Content-Length"] or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # The body can't be read, so the connection is closed after this.
+            self.send_error(400, explain="Invalid Content-Length")
+            return
+        self._service_request(self.rfile.read(length))
 
-        ctype = self.headers["Content-Type"]
+class FluttererServer(HTTPServer):
+    """
+    HTTPServer that handles up to `threads` requests at once on a pool of
+    worker threads (or one at a time on the calling thread if threads is 0),
+    and that can hand a client's socket over to the event stream hub instead
+    of closing it once its request has been handled. If listen_socket is
+    given, connections are accepted from it (it must already be listening)
+    instead of from a newly bound socket.
+    """
+    def __init__(self, server_address, handler_class, database,
+                 threads=DEFAULT_THREADS, backlog=DEFAULT_BACKLOG, listen_socket=None):
+        # Connections beyond the ones being handled wait in the kernel's
+        # accept queue, which holds up to `backlog` of them.
+        self.request_queue_size = backlog
+        HTTPServer.__init__(self, server_address, handler_class,
+                            bind_and_activate=listen_socket is None)
+        if listen_socket is not None:
+            self.socket.close()
+            self.socket = listen_socket
+            self.server_address = listen_socket.getsockname()
+            self.server_name = socket.getfqdn(self.server_address[0])
+            self.server_port = self.server_address[1]
+        self.stream_hub = EventStreamHub(database)
+        self._detached_requests = set()
+        self._pool = None
+        if threads:
+            self._pool = ThreadPoolExecutor(threads, thread_name_prefix="flutterer")
+            self._free_workers = threading.Semaphore(threads)
 
-        # refuse to receive non-json content
-        if ctype != "application/json":
-            self._handle_http_error(HTTPError(400,
-                    "Error in serve.py: Expected the client to specify a content "
-                    f"type of 'application/json', but got {ctype!r} instead."))
+    def process_request(self, request, client_address):
+        if self._pool is None:
+            HTTPServer.process_request(self, request, client_address)
             return
+        # Stop accepting new connections while every worker is busy, rather
+        # than queueing an unbounded number of them.
+        self._free_workers.acquire()
+        self._pool.submit(self._process_request_in_worker, request, client_address)
 
-        # read the message and convert it into a python dictionary
-        length = int(self.headers["Content-Length"])
+    def _process_request_in_worker(self, request, client_address):
         try:
-            info = json.loads(self.rfile.read(length))
-        except json.JSONDecodeError:
-            self._handle_http_error(HTTPError(400,
-                    "Error in serve.py: The request body received from the client "
-                    "is not valid JSON."))
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._free_workers.release()
+
+    def detach_request(self, request):
+        self._detached_requests.add(request)
+
+    def shutdown_request(self, request):
+        if request in self._detached_requests:
+            self._detached_requests.remove(request)
             return
+        HTTPServer.shutdown_request(self, request)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        if self._pool is not None:
+            self._pool.shutdown()
+        self.stream_hub.close()
+
+def run_worker(listen_socket, args):
+    """
+    Body of a worker process started by run_workers. Never returns.
+    """
+    exit_code = 1
+    try:
+        # Ctrl-C is handled by the supervisor, which then stops the workers.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # Every worker opens the database itself; connections can't be shared
+        # across fork().
+        api.db = Database(shared=True)
+        server = FluttererServer(listen_socket.getsockname(), FluttererHandler, api.db,
+                                 threads=args.threads, backlog=args.backlog,
+                                 listen_socket=listen_socket)
+        server.serve_forever()
+        exit_code = 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        os._exit(exit_code)
+
+def run_workers(args):
+    """
+    Binds the server's port once, then forks args.workers processes that all
+    accept connections from it, restarting any worker that exits until the
+    supervisor itself is interrupted.
+    """
+    try:
+        # This also sets the database file up before the workers race to.
+        Database(shared=True).close()
+    except ValueError as e:
+        print_red(f"Can't use --workers: {e}. Run with FLUTTERER_DB_BACKEND=sqlite.")
+        return
+    listen_socket = socket.create_server(("0.0.0.0", args.port), backlog=args.backlog)
+    # Every worker is woken up when a connection arrives, but only one gets
+    # it; the others must go back to waiting instead of blocking in accept().
+    listen_socket.setblocking(False)
+    # The supervisor never touches the database, and the workers open their
+    # own connections to it.
+    api.db.close()
+
+    workers = {}  # pid -> time the worker was started
+    def start_worker():
+        pid = os.fork()
+        if pid == 0:
+            run_worker(listen_socket, args)
+        workers[pid] = time.monotonic()
+
+    stopping = False
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(args.workers):
+        start_worker()
+    flutterer_print(f"Listening for requests at http://localhost:{args.port} "
+                    f"with {args.workers} worker processes")
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = workers.pop(pid, None)
+        if stopping or started is None:
+            continue
+        print_red(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}; restarting it")
+        if time.monotonic() - started < MIN_WORKER_LIFETIME:
+            time.sleep(MIN_WORKER_LIFETIME)
+        if not stopping:
+            start_worker()
+    listen_socket.close()
 
-        self._service_request(api.POST_ROUTES, {
-            "request_body": info,
-        })
+def get_args():
+    """
+    Parses the command line arguments, applying defaults for options that
+    weren't specified.
+    """
+    parser = argparse.ArgumentParser(description="Runs the Flutterer server.")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS,
+                        help="number of requests handled at once "
+                        f"(default: {DEFAULT_THREADS})")
+    parser.add_argument("--single-threaded", action="store_true",
+                        help="handle one request at a time on the main thread")
+    parser.add_argument("--backlog", type=int, default=DEFAULT_BACKLOG,
+                        help="number of pending connections the OS may queue "
+                        f"(default: {DEFAULT_BACKLOG})")
+    parser.add_argument("--gzip-level", type=int, default=compression.DEFAULT_LEVEL,
+                        help="gzip level for API responses, from 1 (fastest) to 9 "
+                        f"(smallest) (default: {compression.DEFAULT_LEVEL})")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="serve from this many processes sharing the port "
+                        "(needs FLUTTERER_DB_BACKEND=sqlite)")
+    args = parser.parse_args()
+    if args.single_threaded:
+        args.threads = 0
+    if args.workers:
+        if not hasattr(os, "fork"):
+            parser.error("--workers is not supported on this platform")
+    return args
 
 if __name__ == "__main__":
     init()  # initialize terminal color support
-    server = HTTPServer(("0.0.0.0", SERVER_PORT), FluttererHandler)
-    flutterer_print(f"Listening for requests at http://localhost:{SERVER_PORT}")
-    server.serve_forever()
+    args = get_args()
+    compression.set_level(args.gzip_level)
+    if args.workers:
+        run_workers(args)
+    else:
+        server = FluttererServer(("0.0.0.0", args.port), FluttererHandler, api.db,
+                                 threads=args.threads, backlog=args.backlog)
+        flutterer_print(f"Listening for requests at http://localhost:{args.port}")
+        server.serve_forever()
@@ -0,0 +1,149 @@
+"""
+This file exports ShardedStorage, a storage engine that splits the floots
+between several JsonStorage engines (shards), each with its own snapshot and
+journal (data.json.shard0, data.json.shard0.log, data.json.shard1, ...). A
+floot always lives in the shard picked by a hash of its id.
+
+Each shard syncs and snapshots its own files, so changes to different shards
+are flushed to the disk in parallel, and no single snapshot has to hold
+every floot. Opening the database reads the shards' snapshots and journals
+in a pool of processes, and get_floots merges the shards' newest-first
+indexes.
+
+The number of shards is recorded in data.json.shards, since floots can only
+be found again with the number of shards they were placed with.
+
+STUDENTS: You don't need to read anything in this file. Use the Database class
+instead.
+"""
+
+import heapq
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import chain, islice
+
+from durability import gather_futures
+from json_storage import (JOURNAL_SUFFIX, ROTATED_JOURNAL_SUFFIX, JsonStorage, read_journal,
+                          read_snapshot)
+from rwlock import ReadWriteLock
+
+SHARD_SUFFIX = ".shard"
+SHARD_COUNT_SUFFIX = ".shards"
+
+def get_shard_number(floot_id, num_shards):
+    """
+    Returns the number of the shard that floot_id lives in.
+    """
+    # Unlike hash(), crc32 gives the same answer in every process.
+    return zlib.crc32(floot_id.encode()) % num_shards
+
+def read_shard_count(path):
+    """
+    Returns the number of shards the database at path was created with, or
+    None if it isn't sharded.
+    """
+    try:
+        with open(path + SHARD_COUNT_SUFFIX) as f:
+            return int(f.read())
+    except FileNotFoundError:
+        return None
+
+class ShardedStorage:
+    def __init__(self, path, shards, lock=None, **options):
+        """
+        Opens (or creates) a database of `shards` shards. The other options
+        are passed on to each shard's JsonStorage.
+        """
+        self._check_shard_count(path, shards)
+        self._lock = lock or ReadWriteLock()
+        paths = [f"{path}{SHARD_SUFFIX}{i}" for i in range(shards)]
+        preread = self._read_files(paths)
+        self._shards = [JsonStorage(shard_path, lock=self._lock, preread=preread, **options)
+                        for shard_path in paths]
+
+    def _check_shard_count(self, path, shards):
+        existing = read_shard_count(path)
+        if existing is not None:
+            if existing != shards:
+                raise ValueError(f"{path} has {existing} shards, not {shards}")
+        elif os.path.exists(path) or os.path.exists(path + JOURNAL_SUFFIX):
+            raise ValueError(f"{path} is not sharded")
+        else:
+            with open(path + SHARD_COUNT_SUFFIX, "w") as f:
+                f.write(str(shards))
+
+    def _read_files(self, paths):
+        """
+        Reads the snapshots and journals of the shards at paths in a pool of
+        processes, and returns a dictionary mapping each file's path to a
+        Future of its contents (see JsonStorage's preread option). The floots
+        themselves are built by each shard: sending built Floots back from
+        the pool costs as much as building them.
+        """
+        files = [(read, path + suffix) for path in paths
+                 for read, suffix in ((read_snapshot, ""),
+                                      (read_journal, ROTATED_JOURNAL_SUFFIX),
+                                      (read_journal, JOURNAL_SUFFIX))]
+        files = [(read, path) for read, path in files if os.path.exists(path)]
+        workers = min(len(files), os.cpu_count() or 1)
+        if workers < 2:
+            return {}
+        with ProcessPoolExecutor(workers) as pool:
+            preread = {path: pool.submit(read, path) for read, path in files}
+            wait(preread.values())
+        return preread
+
+    def _get_shard(self, floot_id):
+        return self._shards[get_shard_number(floot_id, len(self._shards))]
+
+    def compact(self):
+        if self._lock.is_held():
+            raise RuntimeError("Can't compact while holding the database lock")
+        with ThreadPoolExecutor(len(self._shards)) as pool:
+            list(pool.map(JsonStorage.compact, self._shards))
+
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+
+    def durable(self):
+        return gather_futures(shard.durable() for shard in self._shards)
+
+    def count(self):
+        return sum(shard.count() for shard in self._shards)
+
+    def iter_floots(self):
+        return chain.from_iterable(shard.iter_floots() for shard in self._shards)
+
+    def get_floots(self, count, before=None, username=None):
+        # Every shard gives its newest floots first, so merging them gives
+        # the newest floots overall, reading at most `count` from each.
+        keys = heapq.merge(*(shard.newest_keys(count, before, username)
+                             for shard in self._shards), reverse=True)
+        return [self._get_shard(floot_id).get_floot(floot_id)
+                for _, floot_id in islice(keys, count)]
+
+    def has_floot(self, floot_id):
+        return self._get_shard(floot_id).has_floot(floot_id)
+
+    def get_floot(self, floot_id):
+        return self._get_shard(floot_id).get_floot(floot_id)
+
+    def save_floot(self, floot):
+        return self._get_shard(floot.get_id()).save_floot(floot)
+
+    def delete_floot(self, floot_id):
+        return self._get_shard(floot_id).delete_floot(floot_id)
+
+    def add_comment(self, floot, comment):
+        return self._get_shard(floot.get_id()).add_comment(floot, comment)
+
+    def delete_comment(self, floot, comment):
+        return self._get_shard(floot.get_id()).delete_comment(floot, comment)
+
+    def set_liked(self, floot, username, liked):
+        return self._get_shard(floot.get_id()).set_liked(floot, username, liked)
+
+    def __str__(self):
+        return ", ".join(str(shard) for shard in self._shards)
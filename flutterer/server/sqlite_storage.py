@@ -0,0 +1,413 @@
+"""
+This file exports SqliteStorage, a storage engine for the Database that keeps
+floots, comments and likes in a SQLite file (data.db) using Python's built-in
+sqlite3 module. Unlike JsonStorage, nothing is loaded up front: every Database
+call is answered with an indexed query, so a huge database starts instantly
+and each lookup costs O(log n).
+
+STUDENTS: You don't need to read anything in this file. Use the Database class
+instead.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from change_log import MAX_RETAINED_CHANGES
+from durability import (BATCH_WINDOW, DURABILITY_ALWAYS, DURABILITY_BATCHED, DURABILITY_OS,
+                        SyncBatcher, completed_future, get_durability)
+from floot import Floot
+from floot_comment import FlootComment
+from json_cache import floot_json
+import timestamp_codec
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS floots (
+    id TEXT PRIMARY KEY,
+    message TEXT NOT NULL,
+    username TEXT NOT NULL,
+    timestamp_us INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS floots_by_timestamp ON floots (timestamp_us, id);
+CREATE INDEX IF NOT EXISTS floots_by_user_timestamp ON floots (username, timestamp_us, id);
+
+CREATE TABLE IF NOT EXISTS comments (
+    floot_id TEXT NOT NULL REFERENCES floots (id) ON DELETE CASCADE,
+    id TEXT NOT NULL,
+    message TEXT NOT NULL,
+    username TEXT NOT NULL,
+    PRIMARY KEY (floot_id, id)
+);
+
+CREATE TABLE IF NOT EXISTS likes (
+    floot_id TEXT NOT NULL REFERENCES floots (id) ON DELETE CASCADE,
+    username TEXT NOT NULL,
+    PRIMARY KEY (floot_id, username)
+);
+"""
+
+# Only created for databases shared between processes (see
+# SqliteChangeLog).
+CHANGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    change TEXT NOT NULL
+);
+"""
+
+# Statements are kept as constants so that sqlite3's statement cache compiles
+# each of them once per connection and reuses the prepared statement.
+SELECT_FLOOT = "SELECT id, message, username, timestamp_us FROM floots WHERE id = ?"
+SELECT_NEWEST_FLOOTS = ("SELECT id, message, username, timestamp_us FROM floots "
+                        "ORDER BY timestamp_us DESC, id DESC LIMIT ?")
+SELECT_FLOOTS_BEFORE = ("SELECT id, message, username, timestamp_us FROM floots "
+                        "WHERE (timestamp_us, id) < (?, ?) "
+                        "ORDER BY timestamp_us DESC, id DESC LIMIT ?")
+SELECT_NEWEST_USER_FLOOTS = ("SELECT id, message, username, timestamp_us FROM floots "
+                             "WHERE username = ? "
+                             "ORDER BY timestamp_us DESC, id DESC LIMIT ?")
+SELECT_USER_FLOOTS_BEFORE = ("SELECT id, message, username, timestamp_us FROM floots "
+                             "WHERE username = ? AND (timestamp_us, id) < (?, ?) "
+                             "ORDER BY timestamp_us DESC, id DESC LIMIT ?")
+SELECT_FLOOT_EXISTS = "SELECT 1 FROM floots WHERE id = ?"
+SELECT_FLOOT_COUNT = "SELECT COUNT(*) FROM floots"
+SELECT_ALL_FLOOTS = "SELECT id, message, username, timestamp_us FROM floots ORDER BY timestamp_us, id"
+SELECT_COMMENTS = ("SELECT floot_id, id, message, username FROM comments "
+                   "WHERE floot_id IN ({}) ORDER BY rowid")
+SELECT_LIKES = "SELECT floot_id, username FROM likes WHERE floot_id IN ({}) ORDER BY rowid"
+UPSERT_FLOOT = ("INSERT INTO floots (id, message, username, timestamp_us) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+                "message = excluded.message, username = excluded.username, "
+                "timestamp_us = excluded.timestamp_us")
+DELETE_FLOOT = "DELETE FROM floots WHERE id = ?"
+INSERT_COMMENT = ("INSERT OR IGNORE INTO comments (floot_id, id, message, username) "
+                  "VALUES (?, ?, ?, ?)")
+DELETE_COMMENT = "DELETE FROM comments WHERE floot_id = ? AND id = ?"
+DELETE_COMMENTS = "DELETE FROM comments WHERE floot_id = ?"
+INSERT_LIKE = "INSERT OR IGNORE INTO likes (floot_id, username) VALUES (?, ?)"
+DELETE_LIKE = "DELETE FROM likes WHERE floot_id = ? AND username = ?"
+DELETE_LIKES = "DELETE FROM likes WHERE floot_id = ?"
+
+INSERT_CHANGE = "INSERT INTO changes (change) VALUES (?)"
+SELECT_CHANGES_SINCE = "SELECT seq, change FROM changes WHERE seq > ? ORDER BY seq"
+SELECT_CHANGE_RANGE = "SELECT MIN(seq), MAX(seq) FROM changes"
+DELETE_OLD_CHANGES = "DELETE FROM changes WHERE seq <= ?"
+
+# How often a shared change log checks for changes made by other processes
+CHANGE_POLL_INTERVAL = 0.25  # second(s)
+
+# SQLite syncs its files itself; this is how much it does so for each
+# durability mode (see durability.py). In WAL mode, NORMAL doesn't sync the
+# WAL at each commit, only before it is checkpointed. In "batched" mode, the
+# commits made within the batch window then share one sync of the WAL, made
+# by SqliteStorage itself.
+SYNCHRONOUS = {
+    DURABILITY_ALWAYS: "FULL",
+    DURABILITY_BATCHED: "NORMAL",
+    DURABILITY_OS: "OFF",
+}
+
+# SQLite refuses statements with more than this many "?" placeholders.
+MAX_VARIABLES = 900
+
+class SqliteFloot(Floot):
+    """
+    A Floot read from SQLite. Every request reads its own copies, which are
+    dropped once it is answered, so their JSON isn't cached (see
+    json_cache.py): the cache could never hit.
+    """
+    __slots__ = ()
+
+    def to_feed_dictionary(self):
+        return floot_json.encode(self._build_feed_dictionary)
+
+class SqliteStorage:
+    def __init__(self, path, durability=None, batch_window=BATCH_WINDOW):
+        self._db_path = path
+        durability = get_durability(durability)
+        synchronous = SYNCHRONOUS[durability]
+        self._syncs = (SyncBatcher(self._sync_wal, batch_window)
+                       if durability == DURABILITY_BATCHED else None)
+        # The connection is shared by every thread that serves requests, so
+        # access to it is serialized with a lock.
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._change_log = None
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._conn.execute(f"PRAGMA synchronous = {synchronous}")
+        with self._conn:
+            self._upgrade_schema()
+            self._conn.executescript(SCHEMA)
+
+    def _upgrade_schema(self):
+        """
+        Brings the floots table of a database created by an older version up
+        to date. Must be called inside a transaction.
+        """
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(floots)")]
+        # The display string, which was never read
+        if "timestamp" in columns:
+            self._conn.execute("ALTER TABLE floots DROP COLUMN timestamp")
+        # The local time, which repeats when the clocks go back. The times it
+        # can't tell apart are taken to be the first of the two.
+        if "created" in columns:
+            self._conn.execute("ALTER TABLE floots ADD COLUMN timestamp_us INTEGER NOT NULL "
+                               "DEFAULT 0")
+            self._conn.executemany("UPDATE floots SET timestamp_us = ? WHERE id = ?", [
+                (timestamp_codec.from_datetime(datetime.fromisoformat(created)), floot_id)
+                for floot_id, created in self._conn.execute("SELECT id, created FROM floots")])
+            self._conn.execute("DROP INDEX IF EXISTS floots_by_created")
+            self._conn.execute("DROP INDEX IF EXISTS floots_by_username")
+            self._conn.execute("ALTER TABLE floots DROP COLUMN created")
+
+    def _build_floots(self, rows):
+        """
+        Turns rows from the floots table into Floot objects, fetching the
+        comments and likes of all of them with one query each.
+        """
+        comments = {row[0]: [] for row in rows}
+        liked_by = {row[0]: [] for row in rows}
+        ids = list(comments)
+        for start in range(0, len(ids), MAX_VARIABLES):
+            chunk = ids[start:start + MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            for floot_id, comment_id, message, username in self._conn.execute(
+                    SELECT_COMMENTS.format(placeholders), chunk):
+                comments[floot_id].append(FlootComment(message, username, comment_id))
+            for floot_id, username in self._conn.execute(
+                    SELECT_LIKES.format(placeholders), chunk):
+                liked_by[floot_id].append(username)
+
+        return [SqliteFloot(message, username, liked_by[floot_id], floot_id,
+                            timestamp_us, comments[floot_id])
+                for floot_id, message, username, timestamp_us in rows]
+
+    def _write_floot(self, floot):
+        """
+        Writes a floot with all of its comments and likes. Must be called
+        inside a transaction.
+        """
+        floot_id = floot.get_id()
+        self._conn.execute(UPSERT_FLOOT, (
+            floot_id, floot.get_message(), floot.get_username(),
+            floot.get_timestamp_us()))
+        self._conn.execute(DELETE_COMMENTS, (floot_id,))
+        self._conn.executemany(INSERT_COMMENT, [
+            (floot_id, c.get_id(), c.get_message(),
+             c.get_author()) for c in floot.iter_comments()])
+        self._conn.execute(DELETE_LIKES, (floot_id,))
+        self._conn.executemany(INSERT_LIKE, [
+            (floot_id, username) for username in floot.get_liked_by()])
+
+    def compact(self):
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def _sync_wal(self):
+        # Every commit that has returned is in the WAL, so syncing it makes
+        # them all durable.
+        try:
+            fd = os.open(self._db_path + "-wal", os.O_RDONLY)
+        except FileNotFoundError:
+            return  # Checkpointed (and synced) when the database was closed
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _committed(self):
+        """
+        Returns a Future that is done once the commit that just returned is
+        durable.
+        """
+        if self._syncs is None:
+            # SQLite syncs at each commit, or never.
+            return completed_future()
+        return self._syncs.request()
+
+    def durable(self):
+        if self._syncs is None:
+            return completed_future()
+        return self._syncs.last_future()
+
+    def close(self):
+        self.durable().result()
+        with self._lock:
+            if self._change_log is not None:
+                self._change_log.stop()
+            self._conn.close()
+
+    def create_shared_change_log(self):
+        """
+        Returns a change log kept in the database file itself, so that every
+        process using this file sees the same changes.
+        """
+        with self._lock, self._conn:
+            self._conn.executescript(CHANGES_SCHEMA)
+        self._change_log = SqliteChangeLog(self._conn, self._lock)
+        return self._change_log
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute(SELECT_FLOOT_COUNT).fetchone()[0]
+
+    def iter_floots(self):
+        with self._lock:
+            rows = self._conn.execute(SELECT_ALL_FLOOTS).fetchall()
+            return iter(self._build_floots(rows))
+
+    def get_floots(self, count, before=None, username=None):
+        limit = -1 if count is None else count
+        params = (limit,)
+        if before is not None:
+            timestamp, floot_id = before
+            params = (timestamp, floot_id, limit)
+        # Floots by one user are read through the floots_by_username index.
+        if username is None:
+            query = SELECT_NEWEST_FLOOTS if before is None else SELECT_FLOOTS_BEFORE
+        else:
+            query = SELECT_NEWEST_USER_FLOOTS if before is None else SELECT_USER_FLOOTS_BEFORE
+            params = (username,) + params
+        with self._lock:
+            return self._build_floots(self._conn.execute(query, params).fetchall())
+
+    def has_floot(self, floot_id):
+        with self._lock:
+            return self._conn.execute(SELECT_FLOOT_EXISTS, (floot_id,)).fetchone() is not None
+
+    def get_floot(self, floot_id):
+        with self._lock:
+            row = self._conn.execute(SELECT_FLOOT, (floot_id,)).fetchone()
+            if row is None:
+                raise KeyError(floot_id)
+            return self._build_floots([row])[0]
+
+    def save_floot(self, floot):
+        with self._lock, self._conn:
+            self._write_floot(floot)
+        return self._committed()
+
+    def save_floots(self, floots):
+        """
+        Writes many floots in a single transaction. Used when migrating an
+        existing JSON database.
+        """
+        with self._lock, self._conn:
+            for floot in floots:
+                self._write_floot(floot)
+
+    def delete_floot(self, floot_id):
+        with self._lock, self._conn:
+            if self._conn.execute(DELETE_FLOOT, (floot_id,)).rowcount == 0:
+                raise KeyError(floot_id)
+        return self._committed()
+
+    def add_comment(self, floot, comment):
+        with self._lock, self._conn:
+            # Another process may have deleted the floot; don't bring it back.
+            if not self.has_floot(floot.get_id()):
+                raise KeyError(floot.get_id())
+            self._conn.execute(INSERT_COMMENT, (
+                floot.get_id(), comment.get_id(),
+                comment.get_message(), comment.get_author()))
+        return self._committed()
+
+    def delete_comment(self, floot, comment):
+        with self._lock, self._conn:
+            if not self.has_floot(floot.get_id()):
+                raise KeyError(floot.get_id())
+            self._conn.execute(DELETE_COMMENT, (floot.get_id(), comment.get_id()))
+        return self._committed()
+
+    def set_liked(self, floot, username, liked):
+        with self._lock, self._conn:
+            if not self.has_floot(floot.get_id()):
+                raise KeyError(floot.get_id())
+            self._conn.execute(INSERT_LIKE if liked else DELETE_LIKE,
+                               (floot.get_id(), username))
+        return self._committed()
+
+    def __str__(self):
+        return f"sqlite:{self._db_path}"
+
+class SqliteChangeLog:
+    """
+    A ChangeLog (see change_log.py) stored in the changes table, for
+    databases that several server processes use at once. Changes are numbered
+    by SQLite, so the numbers agree between processes. Listeners are called
+    from a background thread that polls the table, so they hear about changes
+    made by any process, always in order.
+    """
+    def __init__(self, conn, lock, capacity=MAX_RETAINED_CHANGES,
+                 poll_interval=CHANGE_POLL_INTERVAL):
+        self._conn = conn
+        self._lock = lock
+        self._capacity = capacity
+        self._poll_interval = poll_interval
+        self._listeners = []
+        self._poller = None
+        self._stopped = threading.Event()
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+        if self._poller is None:
+            self._poller = threading.Thread(target=self._poll, name="change-poller", daemon=True)
+            self._poller.start()
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def record(self, change_type, **fields):
+        fields["type"] = change_type
+        with self._lock, self._conn:
+            seq = self._conn.execute(INSERT_CHANGE, (json.dumps(fields),)).lastrowid
+            # Trim in big batches so that recording stays cheap.
+            if seq % self._capacity == 0:
+                self._conn.execute(DELETE_OLD_CHANGES, (seq - self._capacity,))
+        change = {"seq": seq}
+        change.update(fields)
+        return change
+
+    def _get_seq_range(self):
+        first_seq, latest_seq = self._conn.execute(SELECT_CHANGE_RANGE).fetchone()
+        if latest_seq is None:
+            return (1, 0)
+        return (first_seq, latest_seq)
+
+    def get_latest_seq(self):
+        with self._lock:
+            return self._get_seq_range()[1]
+
+    def get_changes_since(self, seq):
+        with self._lock:
+            first_seq, latest_seq = self._get_seq_range()
+            if seq < first_seq - 1 or seq > latest_seq:
+                return None
+            changes = []
+            for change_seq, change_json in self._conn.execute(SELECT_CHANGES_SINCE, (seq,)):
+                change = {"seq": change_seq}
+                change.update(json.loads(change_json))
+                changes.append(change)
+            return changes
+
+    def stop(self):
+        """
+        Stops the background thread. Called when the storage is closed.
+        """
+        self._stopped.set()
+
+    def _poll(self):
+        seen_seq = self.get_latest_seq()
+        while not self._stopped.wait(self._poll_interval):
+            changes = self.get_changes_since(seen_seq)
+            if changes is None:
+                # Too many changes to catch up on; skip to the newest.
+                seen_seq = self.get_latest_seq()
+                continue
+            for change in changes:
+                for listener in list(self._listeners):
+                    listener(change)
+                seen_seq = change["seq"]
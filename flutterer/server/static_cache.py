@@ -0,0 +1,90 @@
+"""
+This file exports StaticFileCache, which keeps the files served from the
+client/ directory (index.html, the JS files, images...) in memory, along with
+the validators browsers use to ask "has this changed since I downloaded it?"
+(an ETag and a Last-Modified date). A file is read again from disk only when
+its modification time or size changes.
+
+STUDENTS: You don't need to read anything in this file.
+"""
+
+import hashlib
+import mimetypes
+import os
+import stat
+import threading
+from email.utils import formatdate
+
+import compression
+from response import Response
+
+# Files bigger than this are still served, but aren't kept in memory.
+MAX_CACHED_FILE_BYTES = 8 * 1024 * 1024
+
+# Static files are only compressed once, so they get the smallest output.
+GZIP_LEVEL = 9
+
+class StaticFile:
+    def __init__(self, path, body, file_stat):
+        self.body = body
+        # Guess the content-type based on the file extension (e.g. a .html
+        # file is probably text/html).
+        self.content_type = mimetypes.guess_type(path)[0]
+        # A strong validator: it changes whenever the contents do.
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.last_modified = formatdate(int(file_stat.st_mtime), usegmt=True)
+        self.mtime_ns = file_stat.st_mtime_ns
+        self.size = file_stat.st_size
+        self._gzip_body = None
+
+    def get_gzip_body(self):
+        """
+        Returns the file compressed with gzip, compressing it the first time.
+        """
+        if self._gzip_body is None:
+            self._gzip_body = compression.compress(self.body, GZIP_LEVEL)
+        return self._gzip_body
+
+class StaticFileResponse(Response):
+    """
+    A Response that sends a StaticFile, so that its cached compressed copy
+    can be used.
+    """
+    def __init__(self, static_file, headers=None):
+        Response.__init__(self, static_file.body, content_type=static_file.content_type,
+                          headers=headers)
+        self.static_file = static_file
+
+class StaticFileCache:
+    def __init__(self, max_file_size=MAX_CACHED_FILE_BYTES):
+        self._max_file_size = max_file_size
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Returns the StaticFile for path, or None if path isn't a regular file.
+        """
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            file_stat = None
+        if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
+            with self._lock:
+                self._files.pop(path, None)
+            return None
+
+        with self._lock:
+            cached = self._files.get(path)
+        if cached is not None and cached.mtime_ns == file_stat.st_mtime_ns \
+                and cached.size == file_stat.st_size:
+            return cached
+
+        with open(path, "rb") as f:
+            static_file = StaticFile(path, f.read(), file_stat)
+        with self._lock:
+            if static_file.size <= self._max_file_size:
+                self._files[path] = static_file
+            else:
+                self._files.pop(path, None)
+        return static_file
@@ -3,9 +3,10 @@ This file contains a series of test cases you can use to ensure your api.py
 implementations are correct. You don't need to understand or change any of the
 code here. To run these tests, go to Run > Run 'Unittests in test_api.py'.
 """
+import glob
 import os
 import unittest
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 import api
 from database import Database
@@ -16,7 +17,20 @@ from error import HTTPError
 TEST_DB_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)),
                             "test_database.json")
 
+def remove_test_database():
+    """
+    Deletes the test database, along with any files the Database keeps next
+    to it (e.g. its journal).
+    """
+    for path in glob.glob(TEST_DB_PATH + "*"):
+        os.unlink(path)
+
 class TestApi(unittest.TestCase):
+    # Storage engine the test database uses (see database.BACKENDS)
+    BACKEND = "json"
+    # Extra arguments for the storage engine
+    STORAGE_OPTIONS = {}
+
     def setUp(self):
         """
         This function is called before every test function. Its goal is to set
@@ -24,17 +38,16 @@ class TestApi(unittest.TestCase):
         """
         # First, let's create an empty test database. Delete any existing test
         # database:
-        if os.path.exists(TEST_DB_PATH):
-            os.unlink(TEST_DB_PATH)
-        self.test_db = Database(TEST_DB_PATH)
+        remove_test_database()
+        self.test_db = Database(TEST_DB_PATH, backend=self.BACKEND, **self.STORAGE_OPTIONS)
 
         # Add some fake floots to this database
-        self.floots = [ Floot("Hello world!", "Test User 1"),
+        # The first floot is backdated, which ensures consistent ordering
+        # between floots created in the same second.
+        self.floots = [ Floot("Hello world!", "Test User 1",
+                              timestamp=datetime.now() - timedelta(minutes=5)),
                         Floot("Hello world again!", "Test User 2") ]
 
-        # ensures consistent ordering between floots created in the same second.
-        self.floots[0]._timestamp -= timedelta(minutes=5)
-
         for floot in self.floots:
             self.test_db.save_floot(floot)
 
@@ -59,8 +72,8 @@ class TestApi(unittest.TestCase):
         database, so that the next test to be run gets a clean slate.
         """
         # Delete the test database
-        if os.path.exists(TEST_DB_PATH):
-            os.unlink(TEST_DB_PATH)
+        self.test_db.close()
+        remove_test_database()
 
     def test_get_floots(self):
         """
@@ -81,6 +94,130 @@ class TestApi(unittest.TestCase):
                 "aren't accidentally reordering the floots.")
 
 
+    def test_get_floots_paginated(self):
+        """
+        Verify that GET /api/floots?limit=&before= pages through every floot
+        exactly once, newest first
+        """
+        first_page = api.get_floots(limit="1")
+        self.assertEqual([f["id"] for f in first_page["floots"]], [self.floots[1].get_id()])
+        self.assertIsNotNone(first_page["next_cursor"])
+
+        # Floots posted after the first page was fetched must not shift the
+        # next page.
+        api.create_floot({"message": "Newer floot", "username": "Test User 3"})
+        second_page = api.get_floots(limit="5", before=first_page["next_cursor"])
+        self.assertEqual([f["id"] for f in second_page["floots"]], [self.floots[0].get_id()])
+        self.assertIsNone(second_page["next_cursor"])
+
+    def test_get_user_floots(self):
+        """
+        Verify that GET /api/users/{username}/floots pages through only that
+        user's floots, newest first, and follows deletions
+        """
+        newer = api.create_floot({"message": "Another one", "username": "Test User 1"})
+        api.create_floot({"message": "Someone else", "username": "Test User 3"})
+
+        first_page = api.get_user_floots("Test%20User%201", limit="1")
+        self.assertEqual([f["id"] for f in first_page["floots"]], [newer["id"]])
+        second_page = api.get_user_floots("Test User 1", limit="1",
+                                          before=first_page["next_cursor"])
+        self.assertEqual([f["id"] for f in second_page["floots"]], [self.floots[0].get_id()])
+        self.assertIsNone(second_page["next_cursor"])
+
+        api.delete_floot(newer["id"], {"username": "Test User 1"})
+        output = api.get_user_floots("Test User 1")
+        self.assertEqual([f["id"] for f in output["floots"]], [self.floots[0].get_id()])
+        self.assertEqual(api.get_user_floots("Nobody")["floots"], [])
+
+    def test_search_floots(self):
+        """
+        Verify that GET /api/search finds floots by words in their message or
+        comments, with AND and prefix queries, and forgets deleted floots
+        """
+        found = lambda q, **args: [f["id"] for f in api.search_floots(q, **args)["floots"]]
+        both = [self.floots[1].get_id(), self.floots[0].get_id()]
+        self.assertEqual(found("HELLO"), both)
+        self.assertEqual(found("hello again"), [self.floots[1].get_id()])
+        self.assertEqual(found("wor* comm*"), both)
+        self.assertEqual(found("hello missing"), [])
+
+        comment = api.create_comment(self.floots[0].get_id(),
+                                     {"message": "Zebras!", "username": "Test User 3"})
+        self.assertEqual(found("zebra*"), [self.floots[0].get_id()])
+        api.delete_comment(self.floots[0].get_id(), comment["id"], {"username": "Test User 3"})
+        self.assertEqual(found("zebra*"), [])
+
+        first_page = api.search_floots("hello", limit="1")
+        self.assertEqual(found("hello", limit="1", before=first_page["next_cursor"]), both[1:])
+        api.delete_floot(self.floots[1].get_id(), {"username": "Test User 2"})
+        self.assertEqual(found("hello"), both[1:])
+        self.assertEqual(api.search_floots(" ").status, 400)
+
+    def test_get_floots_with_invalid_page_parameters(self):
+        """
+        Verify that GET /api/floots returns an error 400 when given a bad
+        limit or cursor
+        """
+        for args in [{"limit": "ten"}, {"limit": "0"}, {"before": "not a cursor"}]:
+            output = api.get_floots(**args)
+            self.assertIsInstance(output, HTTPError)
+            self.assertEqual(output.status, 400)
+
+    def test_get_floot_changes(self):
+        """
+        Verify that GET /api/floots/changes?since= returns only the changes
+        made after `since`, oldest first
+        """
+        start = api.get_floot_changes()
+        self.assertTrue(start["reset"])
+
+        floot = api.create_floot({"message": "New floot", "username": "Test User 3"})
+        comment = api.create_comment(floot["id"], {"message": "Hi", "username": "Test User 1"})
+        api.delete_floot(self.floots[1].get_id(), {"username": self.floots[1].get_username()})
+
+        output = api.get_floot_changes(since=str(start["seq"]))
+        self.assertFalse(output["reset"])
+        self.assertEqual([c["type"] for c in output["changes"]],
+                         ["floot_saved", "comment_added", "floot_deleted"])
+        self.assertEqual(output["changes"][0]["floot"]["id"], floot["id"])
+        self.assertEqual(output["changes"][1]["comment"]["id"], comment["id"])
+        self.assertEqual(output["changes"][2]["floot_id"], self.floots[1].get_id())
+
+        # Nothing has changed since the latest seq
+        latest = api.get_floot_changes(since=str(output["seq"]))
+        self.assertEqual(latest["changes"], [])
+        self.assertFalse(latest["reset"])
+
+    def test_get_floot_changes_sends_feed_floots(self):
+        """
+        Verify that a saved floot is sent in the changes the way it appears in
+        the feed, with only its first few comments
+        """
+        start = api.get_floot_changes()
+        floot = self.floots[0]
+        num_comments = floot.get_num_comments() + Floot.FEED_COMMENTS + 2
+        for i in range(Floot.FEED_COMMENTS + 2):
+            floot.create_comment(FlootComment(f"Comment {i}", "Test User 3"))
+        self.test_db.save_floot(floot)
+
+        output = api.get_floot_changes(since=str(start["seq"]))
+        self.assertEqual([c["type"] for c in output["changes"]], ["floot_saved"])
+        saved = output["changes"][0]["floot"]
+        self.assertEqual(saved, floot.to_feed_dictionary())
+        self.assertEqual(len(saved["comments"]), Floot.FEED_COMMENTS)
+        self.assertEqual(saved["comment_count"], num_comments)
+
+    def test_get_floot_changes_with_unknown_seq(self):
+        """
+        Verify that GET /api/floots/changes asks the client to reload when it
+        doesn't remember the requested changes, and rejects bad numbers
+        """
+        self.assertTrue(api.get_floot_changes(since="0")["reset"])
+        output = api.get_floot_changes(since="soon")
+        self.assertIsInstance(output, HTTPError)
+        self.assertEqual(output.status, 400)
+
     def test_get_floot_with_valid_id(self):
         """
         Verify that GET /api/floots/{id} works, when passed a valid ID
@@ -187,6 +324,17 @@ class TestApi(unittest.TestCase):
         # Make sure the specific error is error 400
         self.assertEqual(exception.status, 400, expectation)
 
+    def test_create_floot_with_non_string_fields(self):
+        """
+        Verify that any message and username are accepted, not just strings
+        """
+        output = api.create_floot({"message": 5, "username": 7})
+        self.assertIsInstance(output, dict)
+        self.assertTrue(self.test_db.has_floot(output["id"]))
+        self.assertIsInstance(api.create_comment(output["id"], {"message": 6, "username": 7}),
+                              dict)
+        self.assertIsInstance(api.like_floot(output["id"], {"username": 7}), dict)
+
     def test_delete_floot_with_valid_id_and_username(self):
         """
         Verify that POST /api/floots/{id}/delete works, when passed a valid ID
@@ -286,6 +434,52 @@ class TestApi(unittest.TestCase):
         self.assertEqual(output[0]["id"], self.comments[0].get_id())
         self.assertEqual(output[1]["id"], self.comments[1].get_id())
 
+    def test_get_comments_paginated(self):
+        """
+        Verify that GET /api/floots/{id}/comments?limit=&after= pages through
+        every comment exactly once, oldest first, even when the last comment
+        of a page is deleted before the next page is fetched
+        """
+        floot = self.floots[0]
+        for i in range(3):
+            api.create_comment(floot.get_id(), {"message": f"More {i}", "username": "Test User 3"})
+        expected = [c["id"] for c in api.get_comments(floot.get_id())]
+
+        first_page = api.get_comments(floot.get_id(), limit="2")
+        self.assertEqual([c["id"] for c in first_page["comments"]], expected[:2])
+        self.assertEqual(first_page["comment_count"], 5)
+        api.delete_comment(floot.get_id(), expected[1], {"username": "Test User 2"})
+        second_page = api.get_comments(floot.get_id(), limit="2", after=first_page["next_cursor"])
+        self.assertEqual([c["id"] for c in second_page["comments"]], expected[2:4])
+        third_page = api.get_comments(floot.get_id(), limit="2", after=second_page["next_cursor"])
+        self.assertEqual([c["id"] for c in third_page["comments"]], expected[4:])
+        self.assertIsNone(third_page["next_cursor"])
+
+        self.assertEqual(api.get_comments(floot.get_id(), count_only="1"), {"comment_count": 4})
+        for args in [{"limit": "0"}, {"after": "not a cursor"}]:
+            output = api.get_comments(floot.get_id(), **args)
+            self.assertIsInstance(output, HTTPError)
+            self.assertEqual(output.status, 400)
+
+    def test_feed_carries_only_the_first_comments(self):
+        """
+        Verify that floots in GET /api/floots carry a comment_count but only
+        their first few comments, while GET /api/floots/{id} has them all
+        """
+        floot = self.floots[0]
+        num_comments = floot.get_num_comments() + Floot.FEED_COMMENTS + 2
+        for i in range(Floot.FEED_COMMENTS + 2):
+            api.create_comment(floot.get_id(), {"message": f"More {i}", "username": "Test User 3"})
+        comments = api.get_comments(floot.get_id())
+        num_comments = len(comments)
+
+        feed_floot = api.get_floots()[1]
+        self.assertEqual(feed_floot["comment_count"], num_comments)
+        self.assertEqual(feed_floot["comments"], comments[:Floot.FEED_COMMENTS])
+        full_floot = api.get_floot(floot.get_id())
+        self.assertEqual(full_floot["comment_count"], num_comments)
+        self.assertEqual(len(full_floot["comments"]), num_comments)
+
     def test_get_comments_with_invalid_id(self):
         """
         Verify that GET /api/floots/{id}/comments returns an error 404 when
@@ -509,6 +703,76 @@ class TestApi(unittest.TestCase):
         # Make sure the specific error is error 401
         self.assertEqual(exception.status, 401, expectation)
 
+    def test_like_and_unlike_floot(self):
+        """
+        Verify that POST /api/floots/{floot_id}/like and /unlike update the
+        floot's likes, and that repeating them has no effect
+        """
+        floot_id = self.floots[0].get_id()
+        for username in ["Test User 2", "Test User 1", "Test User 2"]:
+            floot_dict = api.like_floot(floot_id, {"username": username})
+        self.assertEqual(floot_dict["liked_by"], ["Test User 2", "Test User 1"])
+
+        api.unlike_floot(floot_id, {"username": "Test User 2"})
+        api.unlike_floot(floot_id, {"username": "Test User 3"})
+        floot = self.test_db.get_floot_by_id(floot_id)
+        self.assertEqual(floot.get_liked_by(), ["Test User 1"])
+        self.assertEqual(floot.get_num_likes(), 1)
+        self.assertTrue(floot.is_liked_by("Test User 1"))
+
+        # Only the actual changes are recorded
+        changes = self.test_db.get_changes_since(self.test_db.get_latest_change_seq() - 3)
+        self.assertEqual([(c["type"], c["username"]) for c in changes], [
+            ("liked", "Test User 2"), ("liked", "Test User 1"), ("unliked", "Test User 2")])
+
+    def test_changing_a_deleted_floot_does_not_bring_it_back(self):
+        """
+        Verify that commenting on or liking a floot that was deleted (e.g. by
+        another server process) raises a KeyError instead of saving it again
+        """
+        floot = self.test_db.get_floot_by_id(self.floots[0].get_id())
+        comment = floot.get_comments()[0]
+        self.test_db.delete_floot(floot)
+        self.assertRaises(KeyError, self.test_db.add_comment, floot,
+                          FlootComment("Too late", "Test User 2"))
+        self.assertRaises(KeyError, self.test_db.delete_comment, floot, comment,
+                          comment.get_author())
+        self.assertRaises(KeyError, self.test_db.set_liked, floot, "Test User 2", True)
+        self.assertFalse(self.test_db.has_floot(floot.get_id()))
+
+    def test_like_floot_errors(self):
+        """
+        Verify that liking or unliking returns an error 404 for an unknown
+        floot, and an error 401 when no username is given
+        """
+        for function in (api.like_floot, api.unlike_floot):
+            output = function("invalid id", {"username": "Test User 1"})
+            self.assertIsInstance(output, HTTPError)
+            self.assertEqual(output.status, 404)
+            output = function(self.floots[0].get_id(), {})
+            self.assertIsInstance(output, HTTPError)
+            self.assertEqual(output.status, 401)
+
+
+class TestApiWithSqlite(TestApi):
+    """
+    Runs every test above against the SQLite storage engine.
+    """
+    BACKEND = "sqlite"
+
+class TestApiWithLazyJson(TestApi):
+    """
+    Runs every test above with the JSON storage engine in lazy mode, keeping
+    a single floot loaded at a time.
+    """
+    STORAGE_OPTIONS = {"lazy": True, "max_loaded_floots": 1}
+
+class TestApiWithShards(TestApi):
+    """
+    Runs every test above with the JSON storage engine split into shards.
+    """
+    STORAGE_OPTIONS = {"shards": 3}
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,870 @@
+"""
+This file contains test cases for the Database class's storage layer (how it
+saves data to disk and loads it back). You don't need to understand or change
+any of the code here.
+"""
+import glob
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import unittest
+import unittest.mock
+import uuid
+from datetime import datetime, timedelta
+
+from database import Database
+from floot import Floot
+from change_log import ChangeLog
+from floot_comment import FlootComment
+from floot_index import FlootIndex
+from json_cache import JsonCache, floot_json
+from migrate_db import migrate
+from packed_ids import pack_id, unpack_id
+from rwlock import ReadWriteLock
+from search_index import SearchIndex
+from timestamp_codec import format_timestamp, parse_timestamp
+
+TEST_DB_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            "test_storage.json")
+
+def remove_test_database():
+    for path in glob.glob(TEST_DB_PATH + "*"):
+        os.unlink(path)
+
+def set_time_zone(test, tz):
+    """
+    Switches the local time zone to tz (a POSIX TZ string) until test ends.
+    """
+    old_tz = os.environ.get("TZ")
+    def restore_tz():
+        if old_tz is None:
+            os.environ.pop("TZ", None)
+        else:
+            os.environ["TZ"] = old_tz
+        time.tzset()
+    test.addCleanup(restore_tz)
+    os.environ["TZ"] = tz
+    time.tzset()
+
+# New York's time zone, whose clocks went back from 2:00 EDT to 1:00 EST on
+# November 2nd, 2025, so that 1:40 EDT came before 1:30 EST
+NEW_YORK_TZ = "EST5EDT,M3.2.0,M11.1.0"
+EDT_1_40 = 1762062000 * 1000000
+EST_1_30 = 1762065000 * 1000000
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        remove_test_database()
+        self.db = Database(TEST_DB_PATH)
+        self.floot = Floot("Hello world!", "Test User 1")
+        self.db.save_floot(self.floot)
+
+    def tearDown(self):
+        self.db.close()
+        remove_test_database()
+
+    def reopen(self):
+        return Database(TEST_DB_PATH)
+
+    def test_mutations_are_appended_not_rewritten(self):
+        """
+        Verify that writes go to the journal and leave the snapshot alone
+        """
+        comment = FlootComment("Comment 1", "Test User 2")
+        self.db.add_comment(self.floot, comment)
+        self.db.set_liked(self.floot, "Test User 2", True)
+
+        self.assertFalse(os.path.exists(TEST_DB_PATH))
+        with open(TEST_DB_PATH + ".log") as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_replay_restores_every_mutation(self):
+        """
+        Verify that a reopened database sees floots, comments and likes
+        """
+        other = Floot("Goodbye!", "Test User 2")
+        self.db.save_floot(other)
+        kept = FlootComment("Kept", "Test User 2")
+        removed = FlootComment("Removed", "Test User 2")
+        self.db.add_comment(self.floot, kept)
+        self.db.add_comment(self.floot, removed)
+        self.db.delete_comment(self.floot, removed, "Test User 2")
+        self.db.set_liked(self.floot, "Test User 3", True)
+        self.db.set_liked(self.floot, "Test User 4", True)
+        self.db.set_liked(self.floot, "Test User 3", False)
+        self.db.delete_floot(other)
+
+        reloaded = self.reopen()
+        self.assertFalse(reloaded.has_floot(other.get_id()))
+        floot = reloaded.get_floot_by_id(self.floot.get_id())
+        self.assertEqual([c.get_id() for c in floot.get_comments()], [kept.get_id()])
+        self.assertEqual(floot.get_liked_by(), ["Test User 4"])
+
+    def test_compaction_folds_journal_into_snapshot(self):
+        """
+        Verify that the journal is emptied into the snapshot once it gets long
+        """
+        db = Database(TEST_DB_PATH, compaction_threshold=3)
+        floot = db.get_floot_by_id(self.floot.get_id())
+        db.add_comment(floot, FlootComment("Comment 1", "Test User 2"))
+        db.add_comment(floot, FlootComment("Comment 2", "Test User 2"))
+        db.close()  # Waits for the snapshot, which is written in the background
+
+        self.assertTrue(os.path.exists(TEST_DB_PATH))
+        self.assertEqual(os.path.getsize(TEST_DB_PATH + ".log"), 0)
+        self.assertEqual(len(self.reopen().get_floot_by_id(floot.get_id()).get_comments()), 2)
+
+    def test_torn_journal_record_is_discarded(self):
+        """
+        Verify that a half-written record at the end of the journal is ignored
+        and does not corrupt the records appended after it
+        """
+        with open(TEST_DB_PATH + ".log", "a") as f:
+            f.write('{"op": "delete_floot", "floot_')
+
+        reloaded = self.reopen()
+        self.assertTrue(reloaded.has_floot(self.floot.get_id()))
+        reloaded.save_floot(Floot("Another", "Test User 2"))
+        self.assertEqual(len(self.reopen().get_floots()), 2)
+
+    def test_damaged_snapshot_falls_back_to_previous(self):
+        """
+        Verify that a snapshot failing its checksum (or missing, as after a
+        crash between renames) is replaced by the previous one plus the
+        journals written since, and that old snapshots without a checksum
+        still load
+        """
+        self.db.compact()
+        comment = FlootComment("Comment 1", "Test User 2")
+        self.db.add_comment(self.floot, comment)
+        self.db.compact()
+        self.db.set_liked(self.floot, "Test User 3", True)
+        self.db.close()
+
+        with open(TEST_DB_PATH, "r+b") as f:
+            f.seek(-10, os.SEEK_END)
+            f.write(b"X")
+        with self.assertWarns(UserWarning):
+            self.db = self.reopen()
+        self.assertTrue(os.path.exists(TEST_DB_PATH + ".damaged"))
+        floot = self.db.get_floot_by_id(self.floot.get_id())
+        self.assertEqual([c.get_id() for c in floot.get_comments()], [comment.get_id()])
+        self.assertEqual(floot.get_liked_by(), ["Test User 3"])
+        self.db.close()
+
+        os.replace(TEST_DB_PATH + ".prev", TEST_DB_PATH)
+        self.assertEqual(self.reopen().get_floot_by_id(self.floot.get_id()).get_liked_by(),
+                         ["Test User 3"])
+
+        with open(TEST_DB_PATH, "w") as f:
+            json.dump({self.floot.get_id(): self.floot.to_dictionary()}, f, indent=4)
+        self.assertTrue(self.reopen().has_floot(self.floot.get_id()))
+
+    def test_changes_made_while_snapshotting_are_kept(self):
+        """
+        Verify that a snapshot written in the background, while the floots
+        keep changing, ends up with every change once its journal is replayed
+        """
+        db = Database(TEST_DB_PATH, compaction_threshold=5)
+        floot = db.get_floot_by_id(self.floot.get_id())
+        with db.writing():
+            # The snapshot starts after the fourth change, and can't read any
+            # floot until the lock is released.
+            comments = [FlootComment(f"Comment {i}", "Test User 2") for i in range(8)]
+            for comment in comments:
+                db.add_comment(floot, comment)
+            for comment in comments[::3]:
+                db.delete_comment(floot, comment, "Test User 2")
+            db.set_liked(floot, "Test User 3", True)
+        db.close()
+
+        self.assertTrue(os.path.exists(TEST_DB_PATH))
+        reloaded = self.reopen().get_floot_by_id(floot.get_id())
+        self.assertEqual(reloaded.to_dictionary(), floot.to_dictionary())
+
+    def test_lazy_loading(self):
+        """
+        Verify that a lazily opened database builds floots on demand, and
+        that changes to floots it unloaded again are kept through compaction
+        """
+        others = [Floot(f"Floot {i}", "Test User 2") for i in range(3)]
+        for floot in others:
+            self.db.save_floot(floot)
+        self.db.add_comment(self.floot, FlootComment("Comment 1", "Test User 2"))
+        self.db.compact()
+        self.db.close()
+
+        self.db = Database(TEST_DB_PATH, lazy=True, max_loaded_floots=2)
+        self.assertEqual(len(self.db.get_floots()), 4)
+        floot = self.db.get_floot_by_id(self.floot.get_id())
+        self.assertEqual(len(floot.get_comments()), 1)
+        self.db.set_liked(floot, "Test User 3", True)
+        for other in others:
+            self.db.get_floot_by_id(other.get_id())  # Unloads self.floot
+        self.db.compact()
+
+        reloaded = self.reopen().get_floot_by_id(self.floot.get_id())
+        self.assertEqual(reloaded.get_liked_by(), ["Test User 3"])
+        self.assertEqual(len(reloaded.get_comments()), 1)
+
+    def test_unloading_is_invisible_to_readers(self):
+        """
+        Verify that while readers load (and so unload) floots, including ones
+        that were just changed, other readers never find a floot missing
+        """
+        floots = [Floot(f"Floot {i}", "Test User 2") for i in range(4)]
+        for floot in floots:
+            self.db.save_floot(floot)
+        self.db.close()
+
+        self.db = Database(TEST_DB_PATH, lazy=True, max_loaded_floots=1)
+        # Switch threads as often as possible, to make any gap show up.
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+        stop = time.monotonic() + 0.5
+        missing = []
+        def read():
+            while time.monotonic() < stop:
+                for floot in floots:
+                    with self.db.reading():
+                        if not self.db.has_floot(floot.get_id()):
+                            missing.append(floot.get_id())
+                        self.db.get_floot_by_id(floot.get_id())
+                if len(self.db.get_floots()) != len(floots) + 1:
+                    missing.append("get_floots")
+        def write():
+            # Changed floots have no dictionary until they are unloaded.
+            liked = True
+            while time.monotonic() < stop:
+                for floot in floots:
+                    self.db.set_liked(self.db.get_floot_by_id(floot.get_id()), "Test User 3", liked)
+                liked = not liked
+        threads = [threading.Thread(target=read) for _ in range(3)]
+        threads.append(threading.Thread(target=write))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(missing, [])
+
+    def test_floots_by_user_survive_reopen(self):
+        """
+        Verify that each user's floots are indexed after a replay, and that a
+        floot saved again under another username moves to that user
+        """
+        other = Floot("Goodbye!", "Test User 2")
+        self.db.save_floot(other)
+        moved = Floot(self.floot.get_message(), "Test User 2", floot_id=self.floot.get_id(),
+                      timestamp=self.floot.get_timestamp_raw())
+        self.db.save_floot(moved)
+
+        db = self.reopen()
+        self.assertEqual({f.get_id() for f in db.get_floots(username="Test User 2")},
+                         {other.get_id(), moved.get_id()})
+        self.assertEqual(db.get_floots(username="Test User 1"), [])
+        db.close()
+
+
+class TestDurability(unittest.TestCase):
+    def setUp(self):
+        remove_test_database()
+        self.fsyncs = []
+        real_fsync = os.fsync
+        def counting_fsync(fd):
+            self.fsyncs.append(fd)
+            real_fsync(fd)
+        patcher = unittest.mock.patch.object(os, "fsync", counting_fsync)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        remove_test_database()
+
+    def make_changes(self, db):
+        floot = Floot("Hello world!", "Test User 1")
+        futures = [db.save_floot(floot)]
+        for i in range(20):
+            futures.append(db.add_comment(floot, FlootComment(f"Comment {i}", "Test User 2")))
+        futures.append(db.set_liked(floot, "Test User 2", True))
+        return futures
+
+    def test_batched_changes_share_fsyncs(self):
+        """
+        Verify that changes made within the batch window are synced together,
+        that their futures are done once that has happened, and that they
+        can be read back before that
+        """
+        db = Database(TEST_DB_PATH, durability="batched", batch_window=0.2)
+        futures = self.make_changes(db)
+        self.assertEqual(len(Database(TEST_DB_PATH).get_floots()), 1)
+        self.assertIs(db.durable(), futures[-1])
+        futures[0].result(timeout=5)
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(len(self.fsyncs), 1)
+        db.close()
+
+    def test_always_and_os_modes(self):
+        """
+        Verify that "always" syncs every change without making the next one
+        wait for it, and that "os" never syncs
+        """
+        db = Database(TEST_DB_PATH, durability="always")
+        futures = self.make_changes(db)
+        for future in futures:
+            future.result(timeout=5)
+        # Changes made while a sync is running share the next one.
+        self.assertGreaterEqual(len(self.fsyncs), 1)
+        self.assertLessEqual(len(self.fsyncs), len(futures))
+
+        # A change can be made while the disk is still syncing the last one.
+        syncing = threading.Event()
+        release = threading.Event()
+        def slow_fsync(fd):
+            syncing.set()
+            release.wait(5)
+        with unittest.mock.patch.object(os, "fsync", slow_fsync):
+            floot = Floot("Slow disk", "Test User 1")
+            first = db.save_floot(floot)
+            self.assertTrue(syncing.wait(5))
+            second = db.set_liked(floot, "Test User 2", True)
+            self.assertFalse(first.done() or second.done())
+            release.set()
+            second.result(timeout=5)
+        self.assertTrue(first.done())
+        db.close()
+
+        self.fsyncs.clear()
+        db = Database(TEST_DB_PATH, durability="os", compaction_threshold=5)
+        self.assertTrue(all(future.done() for future in self.make_changes(db)))
+        self.assertEqual(self.fsyncs, [])
+        db.close()
+
+        self.assertRaises(ValueError, Database, TEST_DB_PATH, durability="sometimes")
+
+
+class TestSharding(unittest.TestCase):
+    def setUp(self):
+        remove_test_database()
+
+    def tearDown(self):
+        remove_test_database()
+
+    def test_floots_are_spread_and_merged(self):
+        """
+        Verify that floots are spread between the shards' files, that
+        get_floots merges them newest first, and that a reopened database
+        (its snapshots and journals read by a pool of processes) finds them
+        all again
+        """
+        db = Database(TEST_DB_PATH, shards=4)
+        start = datetime.now()
+        floots = [Floot(f"Floot {i}", f"Test User {i % 2}", timestamp=start + timedelta(seconds=i))
+                  for i in range(40)]
+        for floot in floots:
+            db.save_floot(floot)
+        db.add_comment(floots[0], FlootComment("Comment 1", "Test User 2"))
+        db.compact()
+        db.set_liked(floots[1], "Test User 2", True)
+        db.close()
+        self.assertEqual(len(glob.glob(TEST_DB_PATH + ".shard[0-9]")), 4)
+
+        with unittest.mock.patch.object(os, "cpu_count", return_value=4):
+            db = Database(TEST_DB_PATH, shards=4)
+        newest = [f.get_id() for f in reversed(floots)]
+        self.assertEqual([f.get_id() for f in db.get_floots()], newest)
+        self.assertEqual([f.get_id() for f in db.get_floots(5, before=db.get_floot_key(floots[30]))],
+                         newest[10:15])
+        self.assertEqual([f.get_id() for f in db.get_floots(3, username="Test User 1")],
+                         newest[0:6:2])
+        self.assertEqual(len(db.get_floot_by_id(floots[0].get_id()).get_comments()), 1)
+        self.assertTrue(db.get_floot_by_id(floots[1].get_id()).is_liked_by("Test User 2"))
+        db.close()
+
+        self.assertRaises(ValueError, Database, TEST_DB_PATH, shards=2)
+        self.assertRaises(ValueError, Database, TEST_DB_PATH, shards=1)
+        db = Database(TEST_DB_PATH)  # Finds out it has 4 shards by itself
+        self.assertEqual(len(db.get_floots()), len(floots))
+        db.close()
+        self.assertFalse(os.path.exists(TEST_DB_PATH + ".log"))
+        self.assertRaises(ValueError, Database, TEST_DB_PATH, backend="sqlite", shards=2)
+
+
+class TestFlootIndex(unittest.TestCase):
+    def test_newest_first_with_count_and_before(self):
+        """
+        Verify that ids come back newest first, regardless of insertion order
+        """
+        index = FlootIndex()
+        for timestamp, floot_id in [(3, "c"), (1, "a"), (2, "b"), (2, "b2"), (5, "e")]:
+            index.add(timestamp, floot_id)
+
+        self.assertEqual(list(index.newest()), ["e", "c", "b2", "b", "a"])
+        self.assertEqual(list(index.newest(2)), ["e", "c"])
+        self.assertEqual(list(index.newest(2, before=(2, "b2"))), ["b", "a"])
+
+    def test_re_adding_and_removing(self):
+        """
+        Verify that moving and removing ids keeps the index consistent
+        """
+        index = FlootIndex()
+        index.add(1, "a")
+        index.add(2, "b")
+        index.add(3, "a")
+        index.remove("b")
+        index.remove("missing")
+
+        self.assertEqual(list(index.newest()), ["a"])
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.get_key("a"), (3, "a"))
+
+
+class TestSearchIndex(unittest.TestCase):
+    def test_updates_and_broad_prefixes(self):
+        """
+        Verify that re-indexed floots drop words they lost, and that a prefix
+        matching many words still finds floots newest first
+        """
+        start = datetime.now()
+        floots = [Floot(f"word{i} shared", "Test User 1", timestamp=start + timedelta(seconds=i))
+                  for i in range(100)]
+        index = SearchIndex()
+        index.index_floots(floots[:50])
+        for floot in floots[50:]:
+            index.index_floot(floot)
+
+        newest = [f.get_id() for f in reversed(floots)]
+        self.assertEqual(index.search("wor* shared", 3), newest[:3])
+        self.assertEqual(index.search("word7"), [floots[7].get_id()])
+        floots[7]._message = "Renamed"
+        index.index_floot(floots[7])
+        self.assertEqual(index.search("word7"), [])
+        self.assertEqual(index.search("renamed"), [floots[7].get_id()])
+        index.remove_floot(floots[7].get_id())
+        self.assertEqual(index.search("renamed"), [])
+
+    def test_comments_only_change_their_own_words(self):
+        """
+        Verify that adding and deleting comments updates the index, that a
+        word stays indexed until the last text containing it is gone, and
+        that deletions don't publish the deleted text
+        """
+        remove_test_database()
+        self.addCleanup(remove_test_database)
+        db = Database(TEST_DB_PATH)
+        floot = Floot("Hello world", "Test User 1")
+        db.save_floot(floot)
+        self.assertEqual(db.search_floots("hello"), [floot])  # Builds the index
+        first = FlootComment("Hello there", "Test User 2")
+        second = FlootComment("There again", "Test User 3")
+        db.add_comment(floot, first)
+        db.add_comment(floot, second)
+        self.assertEqual(db.search_floots("again there hello"), [floot])
+
+        changes = []
+        db.add_change_listener(changes.append)
+        db.delete_comment(floot, first, "Test User 2")
+        self.assertEqual(db.search_floots("hello there"), [floot])
+        db.delete_comment(floot, second, "Test User 3")
+        self.assertEqual(db.search_floots("there"), [])
+        self.assertEqual(db.search_floots("again"), [])
+        self.assertEqual(db.search_floots("hello world"), [floot])
+        # What a deleted comment said isn't published.
+        self.assertEqual([change["type"] for change in changes], ["comment_deleted"] * 2)
+        self.assertFalse(any("There" in json.dumps(change) for change in changes))
+        # Messages don't have to be strings.
+        number = Floot(5, "Test User 1")
+        db.save_floot(number)
+        db.add_comment(number, FlootComment(7, "Test User 2"))
+        self.assertEqual(db.search_floots("5 7"), [number])
+        db.close()
+
+
+class TestChangeLog(unittest.TestCase):
+    def test_old_changes_are_forgotten(self):
+        """
+        Verify that only the most recent changes are kept, and that asking for
+        forgotten changes returns None
+        """
+        changes = ChangeLog(capacity=2, first_seq=1)
+        for i in range(5):
+            changes.record("test", number=i)
+
+        self.assertEqual(changes.get_latest_seq(), 5)
+        self.assertEqual([c["number"] for c in changes.get_changes_since(2)], [2, 3, 4])
+        self.assertEqual(changes.get_changes_since(5), [])
+        self.assertIsNone(changes.get_changes_since(1))
+        self.assertIsNone(changes.get_changes_since(6))
+
+
+class TestReadWriteLock(unittest.TestCase):
+    def test_writer_waits_for_readers(self):
+        """
+        Verify that a writer only gets the lock once every reader is done, and
+        that the lock is reentrant
+        """
+        lock = ReadWriteLock()
+        events = []
+
+        def write():
+            with lock.writing():
+                with lock.reading():
+                    events.append("write")
+
+        with lock.reading():
+            with lock.reading():
+                writer = threading.Thread(target=write)
+                writer.start()
+                time.sleep(0.05)
+                events.append("read")
+        writer.join()
+        self.assertEqual(events, ["read", "write"])
+
+    def test_upgrading_is_refused(self):
+        """
+        Verify that taking the write lock while reading raises instead of
+        deadlocking
+        """
+        lock = ReadWriteLock()
+        with lock.reading():
+            with self.assertRaises(RuntimeError):
+                lock.acquire_write()
+
+
+class TestFlootComments(unittest.TestCase):
+    def test_comments_keep_their_order_through_deletions(self):
+        """
+        Verify that comments can be looked up and deleted by id, and stay
+        oldest to newest as comments come and go
+        """
+        floot = Floot("Hello world!", "Test User 1")
+        comments = [FlootComment(f"Comment {i}", "Test User 2") for i in range(10)]
+        for comment in comments:
+            floot.create_comment(comment)
+        self.assertIs(floot.get_comment(comments[3].get_id()), comments[3])
+
+        for i in (3, 0, 9, 1, 2, 4, 5):
+            floot.delete_comment(comments[i], "Test User 2")
+        comments = [comments[6], comments[7], comments[8]]
+        comments.append(FlootComment("Comment 10", "Test User 3"))
+        floot.create_comment(comments[-1])
+
+        self.assertEqual(floot.get_comments(), comments)
+        self.assertEqual(list(floot.iter_comments()), comments)
+        self.assertEqual(floot.get_num_comments(), 4)
+        self.assertIs(floot.get_comment(comments[-1].get_id()), comments[-1])
+        self.assertFalse(floot.has_comment("missing"))
+        self.assertRaises(KeyError, floot.get_comment, "missing")
+        self.assertRaises(KeyError, floot.delete_comment, FlootComment("?", "Test User 2"), "Test User 2")
+        self.assertRaises(PermissionError, floot.delete_comment, comments[0], "Test User 3")
+
+
+class TestTimestamps(unittest.TestCase):
+    def test_codec_matches_strftime(self):
+        """
+        Verify that timestamps are formatted and parsed exactly like
+        strftime/strptime would, and that floots keep sub-second precision
+        through to_dictionary
+        """
+        start = datetime(1999, 12, 31, 23, 59, 58)
+        for days in range(0, 20000, 37):
+            timestamp = start + timedelta(days=days, seconds=days)
+            text = timestamp.strftime(Floot.DATE_FORMAT)
+            self.assertEqual(format_timestamp(parse_timestamp(text)), text)
+            self.assertEqual(parse_timestamp(text), Floot("", "", timestamp=text).get_timestamp_us())
+        self.assertEqual(parse_timestamp("Sat Jan 1 00:00:00 2000"),
+                         parse_timestamp("Sat Jan 01 00:00:00 2000"))
+        self.assertRaises(ValueError, parse_timestamp, "Sat Feb 30 00:00:00 2000")
+
+        floot = Floot("Hello world!", "Test User 1", timestamp=start.replace(microsecond=123))
+        copy = Floot.from_dictionary(floot.to_dictionary())
+        self.assertEqual(copy.get_timestamp_raw(), floot.get_timestamp_raw())
+        self.assertEqual(copy.get_timestamp(), start.strftime(Floot.DATE_FORMAT))
+
+    def test_timestamps_are_unix_epoch(self):
+        """
+        Verify that timestamp_us counts from the Unix epoch in UTC whatever
+        the local time zone is, while the string timestamp is in local time,
+        and that a timestamp_us of 0 is kept
+        """
+        set_time_zone(self, "EST+5")
+
+        self.assertAlmostEqual(Floot("", "").get_timestamp_us() / 1e6, time.time(), delta=5)
+        epoch = Floot.from_dictionary(dict(Floot("", "").to_dictionary(), timestamp_us=0))
+        self.assertEqual(epoch.get_timestamp_us(), 0)
+        self.assertEqual(epoch.get_timestamp(), "Wed Dec 31 19:00:00 1969")
+        self.assertEqual(epoch.get_timestamp_raw(), datetime(1969, 12, 31, 19))
+        self.assertEqual(Floot("", "", timestamp=datetime(1969, 12, 31, 19)).get_timestamp_us(), 0)
+        self.assertEqual(parse_timestamp("Wed Dec 31 19:00:00 1969"), 0)
+
+    def test_floots_are_ordered_across_clock_changes(self):
+        """
+        Verify that floots posted in the hour repeated when the clocks go
+        back are still ordered (and paginated) by when they were posted
+        """
+        set_time_zone(self, NEW_YORK_TZ)
+        remove_test_database()
+        self.addCleanup(remove_test_database)
+        for backend in ("json", "sqlite"):
+            db = Database(TEST_DB_PATH, backend=backend)
+            later = Floot("Later", "Test User 1", timestamp=EST_1_30)
+            earlier = Floot("Earlier", "Test User 1", timestamp=EDT_1_40)
+            db.save_floot(later)
+            db.save_floot(earlier)
+            self.assertEqual([f.get_id() for f in db.get_floots()],
+                             [later.get_id(), earlier.get_id()])
+            self.assertEqual([f.get_id() for f in db.get_floots(before=db.get_floot_key(later))],
+                             [earlier.get_id()])
+            self.assertEqual(db.get_floot_by_id(later.get_id()).get_timestamp_us(), EST_1_30)
+            db.close()
+
+
+class TestPackedIds(unittest.TestCase):
+    def test_ids_round_trip(self):
+        """
+        Verify that uuids are kept as 16 bytes, and that every id (uuid or
+        not) comes back out of a Floot or FlootComment exactly as it went in
+        """
+        floot_id = str(uuid.uuid4())
+        self.assertEqual(len(pack_id(floot_id)), 16)
+        for item_id in (floot_id, floot_id.upper(), floot_id.replace("-", ""), "legacy-id-1", None):
+            self.assertEqual(unpack_id(pack_id(item_id)), item_id)
+
+        floot = Floot("Hello world!", "Test User 1", floot_id=floot_id)
+        comment = FlootComment("Hi!", "Test User 2", comment_id=floot_id.upper())
+        floot.create_comment(comment)
+        copy = Floot.from_dictionary(floot.to_dictionary())
+        self.assertEqual(copy.get_id(), floot_id)
+        self.assertEqual(copy.get_comment(floot_id.upper()).get_id(), floot_id.upper())
+        self.assertFalse(copy.has_comment(floot_id))
+
+
+class TestJsonCache(unittest.TestCase):
+    def test_floot_json_is_reused_until_the_floot_changes(self):
+        """
+        Verify that a floot's cached JSON is reused, and rebuilt after the
+        floot is changed
+        """
+        floot = Floot("Hello world!", "Test User 1")
+        first = floot.to_feed_dictionary()
+        expected = dict(floot.to_dictionary(), comment_count=0)
+        self.assertEqual(first, expected)
+        self.assertEqual(json.loads(first.json), expected)
+        self.assertIs(floot.to_feed_dictionary(), first)
+        self.assertRaises(TypeError, first.__setitem__, "message", "Changed")
+
+        for change in (lambda: floot.set_liked("Test User 2", True),
+                       lambda: floot.create_comment(FlootComment("Hi", "Test User 2")),
+                       lambda: floot.delete_comment(floot.get_comments()[0], "Test User 2")):
+            before = floot.to_feed_dictionary()
+            change()
+            after = floot.to_feed_dictionary()
+            self.assertIsNot(after, before)
+            self.assertEqual(json.loads(after.json),
+                             dict(floot.to_dictionary(), comment_count=floot.get_num_comments()))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        """
+        Verify that the cache stays under its size limit by dropping the least
+        recently used entries, and forgets objects that are garbage collected
+        """
+        floots = [Floot(f"Floot {i}", "Test User 1") for i in range(3)]
+        size = len(JsonCache().get(floots[0], floots[0].to_dictionary).json)
+        cache = JsonCache(max_bytes=2 * size + 10)
+        first = cache.get(floots[0], floots[0].to_dictionary)
+        cache.get(floots[1], floots[1].to_dictionary)
+        cache.get(floots[0], floots[0].to_dictionary)
+        cache.get(floots[2], floots[2].to_dictionary)
+        self.assertIs(cache.get(floots[0], floots[0].to_dictionary), first)
+        self.assertEqual(cache.get_metrics()["evictions"], 1)
+
+        del floots[:]
+        self.assertEqual(cache.get_metrics()["entries"], 0)
+        self.assertEqual(cache.get_metrics()["bytes"], 0)
+
+
+# The floots table as it was before timestamp_us
+OLD_SQLITE_SCHEMA = """
+CREATE TABLE floots (
+    id TEXT PRIMARY KEY,
+    message TEXT NOT NULL,
+    username TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    created TEXT NOT NULL
+);
+CREATE INDEX floots_by_created ON floots (created, id);
+CREATE INDEX floots_by_username ON floots (username, created, id);
+"""
+
+class TestSqlite(unittest.TestCase):
+    def setUp(self):
+        remove_test_database()
+        self.db = Database(TEST_DB_PATH, backend="sqlite")
+
+    def tearDown(self):
+        self.db.close()
+        remove_test_database()
+
+    def test_data_survives_reopen(self):
+        """
+        Verify that floots, comments and likes are read back from SQLite
+        """
+        floot = Floot("Hello world!", "Test User 1")
+        self.db.save_floot(floot)
+        first = FlootComment("Comment 1", "Test User 2")
+        second = FlootComment("Comment 2", "Test User 3")
+        self.db.add_comment(floot, first)
+        self.db.add_comment(floot, second)
+        self.db.set_liked(floot, "Test User 3", True)
+        self.db.set_liked(floot, "Test User 2", True)
+        self.db.close()
+
+        self.db = Database(TEST_DB_PATH, backend="sqlite")
+        reloaded = self.db.get_floot_by_id(floot.get_id())
+        self.assertEqual(reloaded.get_message(), "Hello world!")
+        self.assertEqual(reloaded.get_timestamp(), floot.get_timestamp())
+        self.assertEqual([c.get_id() for c in reloaded.get_comments()],
+                         [first.get_id(), second.get_id()])
+        self.assertEqual(reloaded.get_liked_by(), ["Test User 3", "Test User 2"])
+
+    def test_old_schema_is_upgraded(self):
+        """
+        Verify that a database created with the old timestamp columns (the
+        unused display string and the local `created` time) gets an integer
+        timestamp_us instead, keeping its floots, and can still be written to
+        """
+        self.db.close()
+        remove_test_database()
+        conn = sqlite3.connect(TEST_DB_PATH)
+        with conn:
+            conn.executescript(OLD_SQLITE_SCHEMA)
+            conn.execute("INSERT INTO floots VALUES (?, ?, ?, ?, ?)",
+                         ("old", "Old floot", "Test User 1", "Sat Jan 01 12:00:00 2000",
+                          "2000-01-01T12:00:00.000123"))
+        conn.close()
+
+        self.db = Database(TEST_DB_PATH, backend="sqlite")
+        old = self.db.get_floot_by_id("old")
+        self.assertEqual(old.get_timestamp_raw(), datetime(2000, 1, 1, 12, 0, 0, 123))
+        floot = Floot("Hello world!", "Test User 1")
+        self.db.save_floot(floot)
+        self.assertEqual(self.db.get_floot_by_id(floot.get_id()).get_timestamp_us(),
+                         floot.get_timestamp_us())
+        self.assertEqual([f.get_id() for f in self.db.get_floots()], [floot.get_id(), "old"])
+        conn = sqlite3.connect(TEST_DB_PATH)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(floots)")]
+        conn.close()
+        self.assertEqual(columns, ["id", "message", "username", "timestamp_us"])
+
+    def test_floot_json_is_not_cached(self):
+        """
+        Verify that floots read from SQLite, which are fresh copies for every
+        call, are encoded without going through the JSON cache
+        """
+        floot = Floot("Hello world!", "Test User 1")
+        self.db.save_floot(floot)
+        before = floot_json.get_metrics()
+        for _ in range(2):
+            feed_dict = self.db.get_floot_by_id(floot.get_id()).to_feed_dictionary()
+            self.assertEqual(json.loads(feed_dict.json),
+                             dict(floot.to_dictionary(), comment_count=0))
+        after = floot_json.get_metrics()
+        self.assertEqual(after["uncached"] - before["uncached"], 2)
+        self.assertEqual((after["hits"], after["misses"]), (before["hits"], before["misses"]))
+
+    def test_delete_floot_removes_comments(self):
+        """
+        Verify that deleting a floot also deletes its comments
+        """
+        floot = Floot("Hello world!", "Test User 1")
+        floot.create_comment(FlootComment("Comment 1", "Test User 2"))
+        self.db.save_floot(floot)
+        self.db.delete_floot(floot)
+
+        self.assertFalse(self.db.has_floot(floot.get_id()))
+        self.assertRaises(KeyError, self.db.delete_floot, floot)
+        self.db.save_floot(Floot("Hello again!", "Test User 1"))
+        self.assertEqual(self.db.get_floots()[0].get_comments(), [])
+
+    def test_batched_commits_share_a_sync(self):
+        """
+        Verify that in batched mode, the futures of commits are only done
+        once a single sync of the WAL has covered all of them
+        """
+        self.db.close()
+        fsyncs = []
+        real_fsync = os.fsync
+        def counting_fsync(fd):
+            fsyncs.append(fd)
+            real_fsync(fd)
+        self.db = Database(TEST_DB_PATH, backend="sqlite", durability="batched",
+                           batch_window=0.2)
+        with unittest.mock.patch.object(os, "fsync", counting_fsync):
+            floot = Floot("Hello world!", "Test User 1")
+            futures = [self.db.save_floot(floot),
+                       self.db.add_comment(floot, FlootComment("Comment 1", "Test User 2")),
+                       self.db.set_liked(floot, "Test User 2", True)]
+            self.assertFalse(any(future.done() for future in futures))
+            self.assertIs(self.db.durable(), futures[-1])
+            for future in futures:
+                future.result(timeout=5)
+        self.assertEqual(len(fsyncs), 1)
+
+    def test_migrate_from_json(self):
+        """
+        Verify that migrate_db copies a JSON database into SQLite
+        """
+        json_db = Database(TEST_DB_PATH + ".json")
+        floots = [Floot("Old", "Test User 1", timestamp=datetime.now() - timedelta(minutes=5)),
+                  Floot("New", "Test User 2")]
+        for floot in floots:
+            json_db.save_floot(floot)
+        json_db.add_comment(floots[0], FlootComment("Comment", "Test User 2"))
+
+        self.db.close()
+        self.assertEqual(migrate(TEST_DB_PATH + ".json", TEST_DB_PATH), 2)
+        self.db = Database(TEST_DB_PATH, backend="sqlite")
+        self.assertEqual([f.get_id() for f in self.db.get_floots()],
+                         [floots[1].get_id(), floots[0].get_id()])
+        self.assertEqual(len(self.db.get_floots(1)), 1)
+        self.assertEqual(len(self.db.get_floot_by_id(floots[0].get_id()).get_comments()), 1)
+
+    def test_shared_change_log(self):
+        """
+        Verify that databases shared between processes see each other's
+        changes, numbered the same way, and notify listeners about them
+        """
+        self.db.close()
+        self.db = Database(TEST_DB_PATH, backend="sqlite", shared=True)
+        other = Database(TEST_DB_PATH, backend="sqlite", shared=True)
+        try:
+            heard = []
+            self.db.add_change_listener(heard.append)
+            floot = Floot("Hello world!", "Test User 1")
+            other.save_floot(floot)
+            other.set_liked(floot, "Test User 2", True)
+
+            changes = self.db.get_changes_since(0)
+            self.assertEqual([c["type"] for c in changes], ["floot_saved", "liked"])
+            self.assertEqual(changes, other.get_changes_since(0))
+            self.assertEqual(self.db.get_latest_change_seq(), changes[-1]["seq"])
+            self.assertIsNone(self.db.get_changes_since(changes[-1]["seq"] + 1))
+
+            deadline = time.monotonic() + 2
+            while len(heard) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(heard, changes)
+        finally:
+            other.close()
+
+    def test_json_backend_cannot_be_shared(self):
+        """
+        Verify that asking for a shared JSON database is refused
+        """
+        self.assertRaises(ValueError, Database, TEST_DB_PATH + ".json", backend="json", shared=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
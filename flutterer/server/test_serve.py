@@ -0,0 +1,412 @@
+"""
+This file contains test cases for the web server plumbing in serve.py and the
+modules it uses. You don't need to understand or change any of the code here.
+"""
+import asyncio
+import glob
+import gzip
+import json
+import os
+import socket
+import threading
+import time
+import unittest
+import unittest.mock
+import urllib.error
+import urllib.request
+
+import api
+import serve
+from async_serve import AsyncFluttererServer
+from compression import accepts_gzip
+from database import Database
+from event_stream import EventStreamHub
+from floot import Floot
+from serve import FluttererHandler, FluttererServer, RouteTable
+from static_cache import StaticFileCache
+
+TEST_DB_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            "test_serve.json")
+
+def remove_test_database():
+    for path in glob.glob(TEST_DB_PATH + "*"):
+        os.unlink(path)
+
+def read_until(sock, text, timeout=2):
+    """
+    Reads from sock until `text` has been received, and returns everything
+    read so far.
+    """
+    sock.settimeout(timeout)
+    received = b""
+    deadline = time.monotonic() + timeout
+    while text.encode("utf-8") not in received and time.monotonic() < deadline:
+        received += sock.recv(4096)
+    return received.decode("utf-8")
+
+class TestRouteTable(unittest.TestCase):
+    def test_first_matching_route_wins(self):
+        """
+        Verify that routes are tried in order, with exact paths taken
+        literally and regex groups passed on as arguments
+        """
+        def handler(name):
+            return lambda: name
+        routes = RouteTable([
+            ("/a.b", handler("exact")),
+            (("/items/(.*?)/parts/(.*)", "item_id", "part_id"), handler("part")),
+            (("/items/(.*)", "item_id"), handler("item")),
+            (("/items/(x)?y", "maybe"), handler("never reached")),
+            (("(/.*)", "path"), handler("fallback")),
+        ])
+        def find(path):
+            handler, args = routes.find(path)
+            return (handler(), args)
+
+        self.assertEqual(find("/a.b"), ("exact", {}))
+        self.assertEqual(find("/aXb"), ("fallback", {"path": "/aXb"}))
+        self.assertEqual(find("/items/1/parts/2/3"),
+                         ("part", {"item_id": "1", "part_id": "2/3"}))
+        self.assertEqual(find("/items/y"), ("item", {"item_id": "y"}))
+        self.assertIsNone(routes.find("no leading slash"))
+        self.assertIsNone(RouteTable([]).find("/"))
+
+
+class TestStaticFileCache(unittest.TestCase):
+    def setUp(self):
+        self.path = TEST_DB_PATH + ".html"
+        self.write("<p>Old</p>")
+
+    def tearDown(self):
+        remove_test_database()
+
+    def write(self, text, mtime=None):
+        with open(self.path, "w") as f:
+            f.write(text)
+        if mtime is not None:
+            os.utime(self.path, (mtime, mtime))
+
+    def test_file_is_reread_when_it_changes(self):
+        """
+        Verify that cached files are reused until they change on disk
+        """
+        cache = StaticFileCache()
+        old = cache.get(self.path)
+        self.assertEqual(old.body, b"<p>Old</p>")
+        self.assertEqual(old.content_type, "text/html")
+        self.assertIs(cache.get(self.path), old)
+
+        self.write("<p>New</p>", mtime=old.mtime_ns / 1e9 + 10)
+        new = cache.get(self.path)
+        self.assertEqual(new.body, b"<p>New</p>")
+        self.assertNotEqual(new.etag, old.etag)
+
+        os.unlink(self.path)
+        self.assertIsNone(cache.get(self.path))
+
+
+class TestCompression(unittest.TestCase):
+    def test_accept_encoding_negotiation(self):
+        """
+        Verify that Accept-Encoding headers are read correctly
+        """
+        self.assertTrue(accepts_gzip("gzip, deflate, br"))
+        self.assertTrue(accepts_gzip("br;q=1.0, *;q=0.5"))
+        self.assertFalse(accepts_gzip("gzip;q=0, *"))
+        self.assertFalse(accepts_gzip("identity"))
+        self.assertFalse(accepts_gzip(None))
+
+
+class TestEventStream(unittest.TestCase):
+    def setUp(self):
+        remove_test_database()
+        self.db = Database(TEST_DB_PATH)
+        self.hub = EventStreamHub(self.db)
+        self.sockets = []
+
+    def tearDown(self):
+        self.hub.close()
+        for sock in self.sockets:
+            sock.close()
+        self.db.close()
+        remove_test_database()
+
+    def connect(self, last_event_id=None):
+        server_side, client_side = socket.socketpair()
+        self.sockets.append(client_side)
+        self.hub.subscribe(server_side, last_event_id)
+        return client_side
+
+    def test_changes_are_pushed_to_every_subscriber(self):
+        """
+        Verify that each subscriber receives a ready event, then every change
+        """
+        clients = [self.connect() for _ in range(3)]
+        for client in clients:
+            self.assertIn("event: ready", read_until(client, "event: ready"))
+
+        floot = Floot("Hello world!", "Test User 1")
+        self.db.save_floot(floot)
+        for client in clients:
+            received = read_until(client, floot.get_id())
+            self.assertIn("event: floot_saved", received)
+            self.assertIn(f"id: {self.db.get_latest_change_seq()}", received)
+
+    def test_resume_from_last_event_id(self):
+        """
+        Verify that a reconnecting subscriber is sent only what it missed, and
+        is told to reload if that is no longer available
+        """
+        seen = self.db.get_latest_change_seq()
+        missed = Floot("Missed", "Test User 1")
+        self.db.save_floot(missed)
+
+        received = read_until(self.connect(seen), missed.get_id())
+        self.assertIn("event: floot_saved", received)
+        self.assertNotIn("event: ready", received)
+
+        self.assertIn("event: reset", read_until(self.connect(0), "event: reset"))
+
+    def test_closed_subscribers_are_dropped(self):
+        """
+        Verify that the hub forgets subscribers that hang up
+        """
+        client = self.connect()
+        read_until(client, "event: ready")
+        self.assertEqual(self.hub.get_subscriber_count(), 1)
+        client.close()
+
+        deadline = time.monotonic() + 2
+        while self.hub.get_subscriber_count() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.hub.get_subscriber_count(), 0)
+
+
+class TestConcurrentServer(unittest.TestCase):
+    def setUp(self):
+        remove_test_database()
+        self.original_db = api.db
+        api.db = Database(TEST_DB_PATH)
+        api.db.save_floot(Floot("Hello world!", "Test User 1"))
+        self.server = FluttererServer(("127.0.0.1", 0), FluttererHandler, api.db, threads=4)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        api.db.close()
+        api.db = self.original_db
+        remove_test_database()
+
+    def get(self, path):
+        with urllib.request.urlopen(f"http://127.0.0.1:{self.port}{path}", timeout=5) as response:
+            return json.loads(response.read())
+
+    def test_slow_client_does_not_block_others(self):
+        """
+        Verify that a client that never finishes its request doesn't hold up
+        requests from other clients
+        """
+        slow_client = socket.create_connection(("127.0.0.1", self.port))
+        try:
+            slow_client.sendall(b"GET /api/flo")
+            self.assertEqual(len(self.get("/api/floots")), 1)
+        finally:
+            slow_client.close()
+
+    def test_concurrent_writes_are_all_applied(self):
+        """
+        Verify that floots posted from many threads at once are all saved
+        """
+        def post_floots(username):
+            for i in range(10):
+                request = urllib.request.Request(
+                    f"http://127.0.0.1:{self.port}/api/floots",
+                    data=json.dumps({"message": str(i), "username": username}).encode("utf-8"),
+                    headers={"Content-Type": "application/json"})
+                urllib.request.urlopen(request, timeout=5).close()
+
+        threads = [threading.Thread(target=post_floots, args=(f"User {n}",)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.get("/api/floots")), 41)
+
+    def test_invalid_content_length_is_rejected(self):
+        """
+        Verify that a POST with a negative or non-numeric Content-Length gets
+        a 400 instead of an error or a server waiting for a body
+        """
+        for length in (b"-1", b"ten"):
+            with socket.create_connection(("127.0.0.1", self.port)) as client:
+                client.sendall(b"POST /api/floots HTTP/1.1\r\nHost: localhost\r\n"
+                               b"Content-Length: " + length + b"\r\n\r\n")
+                self.assertIn("400 Bad Request", read_until(client, "400 Bad Request"))
+        self.assertEqual(len(self.get("/api/floots")), 1)
+
+    def test_json_is_compact_unless_pretty(self):
+        """
+        Verify that JSON responses have no extra whitespace unless the client
+        asks for ?pretty=1
+        """
+        url = f"http://127.0.0.1:{self.port}/api/floots"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            compact = response.read().decode("utf-8")
+        with urllib.request.urlopen(url + "?pretty=1", timeout=5) as response:
+            pretty = response.read().decode("utf-8")
+        self.assertNotIn("\n", compact)
+        self.assertIn('\n        "message": "Hello world!"', pretty)
+        self.assertEqual(json.loads(compact), json.loads(pretty))
+
+    def test_static_files_are_revalidated(self):
+        """
+        Verify that static files carry validators, and that a client with an
+        up-to-date copy is answered with 304 Not Modified
+        """
+        url = f"http://127.0.0.1:{self.port}/index.html"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            etag = response.headers["ETag"]
+            last_modified = response.headers["Last-Modified"]
+            self.assertEqual(response.headers["Cache-Control"], "no-cache")
+            self.assertIn(b"<html", response.read())
+
+        for headers in ({"If-None-Match": etag}, {"If-Modified-Since": last_modified}):
+            request = urllib.request.Request(url, headers=headers)
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(request, timeout=5)
+            self.assertEqual(context.exception.code, 304)
+            self.assertEqual(context.exception.read(), b"")
+
+        request = urllib.request.Request(url, headers={"If-None-Match": '"stale"'})
+        with urllib.request.urlopen(request, timeout=5) as response:
+            self.assertEqual(response.status, 200)
+
+    def test_responses_are_compressed_when_accepted(self):
+        """
+        Verify that clients that accept gzip get compressed responses, with
+        their own ETag, and that compression shows up in the metrics
+        """
+        url = f"http://127.0.0.1:{self.port}/index.html"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            plain = response.read()
+            plain_etag = response.headers["ETag"]
+            self.assertIsNone(response.headers["Content-Encoding"])
+            self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+
+        request = urllib.request.Request(url, headers={"Accept-Encoding": "gzip"})
+        with urllib.request.urlopen(request, timeout=5) as response:
+            self.assertEqual(response.headers["Content-Encoding"], "gzip")
+            self.assertEqual(gzip.decompress(response.read()), plain)
+            gzip_etag = response.headers["ETag"]
+        self.assertNotEqual(gzip_etag, plain_etag)
+
+        request = urllib.request.Request(url, headers={"Accept-Encoding": "gzip",
+                                                       "If-None-Match": gzip_etag})
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(request, timeout=5)
+        self.assertEqual(context.exception.code, 304)
+
+        compression_metrics = self.get("/api/metrics")["compression"]
+        self.assertGreaterEqual(compression_metrics["responses"], 1)
+        self.assertLess(compression_metrics["ratio"], 1)
+
+class TestAsyncServer(unittest.TestCase):
+    def setUp(self):
+        remove_test_database()
+        self.original_db = api.db
+        api.db = Database(TEST_DB_PATH)
+        api.db.save_floot(Floot("Hello world!", "Test User 1"))
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.server = AsyncFluttererServer(api.db, quiet=True)
+        self.run_on_loop(self.server.start("127.0.0.1", 0))
+        self.port = self.server.get_port()
+
+    def tearDown(self):
+        self.run_on_loop(self.server.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        api.db.close()
+        api.db = self.original_db
+        remove_test_database()
+
+    def run_on_loop(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout=5)
+
+    def test_pipelined_requests_share_a_connection(self):
+        """
+        Verify that several requests sent at once on one connection are all
+        answered, in order
+        """
+        body = json.dumps({"message": "Pipelined", "username": "Test User 2"})
+        with socket.create_connection(("127.0.0.1", self.port)) as client:
+            client.sendall(
+                b"GET /api/floots HTTP/1.1\r\nHost: localhost\r\n\r\n"
+                b"POST /api/floots HTTP/1.1\r\nHost: localhost\r\n"
+                b"Content-Type: application/json\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n{body}".encode("utf-8")
+                + b"GET /api/missing HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            received = read_until(client, "404 Not Found")
+        self.assertEqual(received.count("HTTP/1.1 200 OK"), 2)
+        self.assertLess(received.index("Hello world!"), received.index("Pipelined"))
+        self.assertEqual(len(api.db.get_floots()), 2)
+
+    def test_http_1_0_connection_is_closed(self):
+        """
+        Verify that HTTP/1.0 clients, which don't expect keep-alive, get their
+        connection closed after the response
+        """
+        with socket.create_connection(("127.0.0.1", self.port)) as client:
+            client.sendall(b"GET /api/floots HTTP/1.0\r\n\r\n")
+            client.settimeout(5)
+            received = b""
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    break
+                received += data
+        self.assertIn(b"Connection: close", received)
+        self.assertIn(b"Hello world!", received)
+
+    def test_negative_content_length_is_rejected(self):
+        """
+        Verify that a request with a negative Content-Length gets a 400
+        instead of being read
+        """
+        with socket.create_connection(("127.0.0.1", self.port)) as client:
+            client.sendall(b"POST /api/floots HTTP/1.1\r\nHost: localhost\r\n"
+                           b"Content-Length: -1\r\n\r\n")
+            received = read_until(client, "400 Bad Request")
+        self.assertIn("400 Bad Request", received)
+        self.assertEqual(len(api.db.get_floots()), 1)
+
+    def test_long_lists_are_streamed(self):
+        """
+        Verify that long lists are sent in chunks, with the connection still
+        usable afterwards
+        """
+        for i in range(4):
+            api.db.save_floot(Floot(f"Floot {i}", "Test User 2"))
+        with unittest.mock.patch.object(serve, "STREAMED_LIST_LENGTH", 2), \
+                unittest.mock.patch.object(serve, "STREAMED_CHUNK_ITEMS", 2), \
+                socket.create_connection(("127.0.0.1", self.port)) as client:
+            client.sendall(b"GET /api/floots HTTP/1.1\r\nHost: localhost\r\n\r\n"
+                           b"GET /api/missing HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            received = read_until(client, "404 Not Found")
+
+        head, _, rest = received.partition("\r\n\r\n")
+        self.assertIn("Transfer-Encoding: chunked", head)
+        body = ""
+        while True:
+            size, _, rest = rest.partition("\r\n")
+            if int(size, 16) == 0:
+                break
+            body += rest[:int(size, 16)]
+            rest = rest[int(size, 16) + 2:]
+        self.assertEqual(len(json.loads(body)), 5)
+        self.assertTrue(rest.startswith("\r\nHTTP/1.1 404"))
+
+
+if __name__ == "__main__":
+    unittest.main()